@@ -0,0 +1,160 @@
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+from typing import Any, Dict, List
+
+from src import step1_setup
+from src import step2_get_ig_user
+from src.pipeline import Pipeline
+from utils.client_utils import client_registry
+from utils.logger import get_logger
+from utils.token_pool import TokenPool, load_token_pool
+
+logger = get_logger("meta_metrics_collector.batch")
+
+# Clienti elaborati in parallelo. I thread condividono sessione HTTP, pool di token con il budget di chiamate
+# di ogni app (utils/token_pool.py) e la cache media; il rendering del PDF può usare processi (--pdf-workers)
+DEFAULT_WORKERS = 4
+
+
+def load_jobs(jobs_path: str = None, since: str = None, until: str = None) -> List[Dict[str, Any]]:
+    """
+    Lista dei report da generare.
+    - jobs_path: file JSON con una lista di {"client_name", "since", "until", "catalogue" (opzionale)}
+    - altrimenti tutti i clienti di config/clienti.json, con l'ultimo intervallo salvato (last_since/last_until)
+    since/until, se indicati, valgono per tutti i job.
+    """
+    if jobs_path:
+        with open(jobs_path, "r", encoding="utf-8") as f:
+            jobs = json.load(f)
+    else:
+        clienti = client_registry().all()
+        jobs = [
+            {"client_name": name, "since": data.get("last_since"), "until": data.get("last_until")}
+            for name, data in clienti.items()
+        ]
+
+    for job in jobs:
+        job["since"] = since or job.get("since")
+        job["until"] = until or job.get("until")
+    return jobs
+
+
+def run_job(job: Dict[str, Any], pool: TokenPool, args) -> Dict[str, Any]:
+    """
+    Esegue gli step 1-8 per un job senza interazione, con il token del pool che ha più margine.
+    Non solleva eccezioni: l'esito finisce nel riepilogo.
+    """
+    client_name = job.get("client_name")
+    since, until = job.get("since"), job.get("until")
+    result = {"client_name": client_name, "since": since, "until": until, "status": "failed"}
+    start = time.monotonic()
+    access_token = None
+
+    try:
+        if not client_name or not since or not until:
+            raise ValueError("client_name, since e until sono obbligatori")
+        access_token = pool.acquire(client_name)
+        if not access_token:
+            raise RuntimeError("Nessun token disponibile")
+
+        logger.info(f"▶ [{client_name}] Avvio report {since} → {until}")
+        config = step1_setup.run_step1(client_name, access_token, since, until)
+        config = step2_get_ig_user.run_step2(config)
+        if not config.get("ig_user_id"):
+            raise RuntimeError("IG User ID non disponibile")
+
+        pipeline = Pipeline(
+            config, catalogue=job.get("catalogue", args.catalogue), force=args.force,
+            stream=args.stream, interactive=False
+        )
+        pdf_path = pipeline.run(workers=args.pdf_workers)
+        if not pdf_path:
+            raise RuntimeError("PDF non generato")
+
+        result.update(status="ok", pdf_path=pdf_path, media=len(pipeline.state.media or []),
+                      skipped_steps=sorted(pipeline.skipped))
+        logger.info(f"✔ [{client_name}] Report generato: {pdf_path}")
+    except (Exception, SystemExit) as e:
+        # Anche sys.exit() negli step non deve fermare gli altri clienti
+        result["error"] = f"{type(e).__name__}: {e}"
+        logger.error(f"❌ [{client_name}] Report non generato: {result['error']}")
+    finally:
+        if access_token:
+            pool.release(access_token)
+
+    result["duration_seconds"] = round(time.monotonic() - start, 1)
+    return result
+
+
+def print_summary(results: List[Dict[str, Any]]):
+    logger.info("----- RIEPILOGO BATCH -----")
+    for r in results:
+        if r["status"] == "ok":
+            logger.info(f"✅ {r['client_name']} ({r['since']} → {r['until']}): {r['pdf_path']} in {r['duration_seconds']}s")
+        else:
+            logger.warning(f"❌ {r['client_name']} ({r['since']} → {r['until']}): {r.get('error')} dopo {r['duration_seconds']}s")
+    ok = sum(1 for r in results if r["status"] == "ok")
+    logger.info(f"Completati {ok}/{len(results)} report.")
+
+
+def prefetch_ig_accounts(tokens: TokenPool, jobs: List[Dict[str, Any]]):
+    """
+    Risolve gli IG User ID di tutti i clienti del batch con chiamate multi-id prima di avviare i job:
+    lo step 2 di ogni job li trova già in clienti.json e non fa chiamate.
+    """
+    access_token = tokens.acquire()
+    if not access_token:
+        return
+    try:
+        step2_get_ig_user.prefetch_ig_accounts({job["client_name"] for job in jobs}, access_token)
+    except Exception as e:
+        logger.warning(f"Prefetch degli IG User ID non riuscito, verranno risolti nei singoli job: {e}")
+    finally:
+        tokens.release(access_token)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Genera i report di più clienti in parallelo, senza interazione")
+    parser.add_argument("--jobs", type=str, help="File JSON con la lista dei job (default: tutti i clienti di config/clienti.json)")
+    parser.add_argument("--since", type=str, help="Data inizio (YYYY-MM-DD) per tutti i job")
+    parser.add_argument("--until", type=str, help="Data fine (YYYY-MM-DD) per tutti i job")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS, help="Clienti elaborati in parallelo")
+    parser.add_argument("--pdf-workers", type=int, default=1, help="Processi per il rendering di ogni PDF")
+    parser.add_argument("--catalogue", action="store_true", help="Genera il catalogo completo invece dei top 3")
+    parser.add_argument("--stream", action="store_true", help="Pipeline in streaming (vedi main.py)")
+    parser.add_argument("--force", action="append", default=[], metavar="STEP",
+                        choices=["step3", "step4", "step5", "step6", "step7", "step8", "all"],
+                        help="Riesegue lo step anche se i suoi input non sono cambiati")
+    args = parser.parse_args()
+
+    tokens = load_token_pool()
+    if not len(tokens):
+        sys.exit(1)
+
+    jobs = load_jobs(args.jobs, args.since, args.until)
+    prefetch_ig_accounts(tokens, jobs)
+    logger.info(f"▶ Avvio batch di {len(jobs)} report con {args.workers} worker")
+
+    with ThreadPoolExecutor(max_workers=max(1, args.workers), thread_name_prefix="batch") as pool:
+        futures = [pool.submit(run_job, job, tokens, args) for job in jobs]
+        results = [future.result() for future in as_completed(futures)]
+
+    results.sort(key=lambda r: str(r["client_name"]))
+    print_summary(results)
+
+    os.makedirs("output", exist_ok=True)
+    summary_path = os.path.join("output", f"batch_summary_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+    with open(summary_path, "w", encoding="utf-8") as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+    logger.info(f"[💾] Riepilogo salvato in {summary_path}")
+
+    sys.exit(0 if all(r["status"] == "ok" for r in results) else 1)
+
+
+if __name__ == "__main__":
+    main()
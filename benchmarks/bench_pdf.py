@@ -0,0 +1,174 @@
+"""
+Benchmark del rendering PDF (step8 + utils/pdf_utils).
+
+Genera post e immagini sintetici, renderizza N pagine con la stessa funzione usata
+da step8 e riporta tempo per pagina, picco di memoria e dimensione del file.
+Ogni misura gira in un processo separato, così il picco di memoria è quello del solo rendering.
+
+Uso (dalla root del progetto):
+    python -m benchmarks.bench_pdf
+    python -m benchmarks.bench_pdf --pages 3 50 --images 10 --json bench_output.txt
+    python -m benchmarks.bench_pdf --pages 100 1000 --catalogue
+"""
+import argparse
+import json
+import logging
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from PIL import Image
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BASE_DIR))
+
+from src import step8_generate_pdf  # noqa: E402
+from utils import pdf_utils  # noqa: E402
+
+DEFAULT_PAGES = [3, 50, 500]
+MEDIA_TYPES = ["IMAGE", "VIDEO", "CAROUSEL_ALBUM"]
+
+
+def make_images(folder: Path, count: int, size=(1080, 1350)):
+    """
+    Crea 'count' JPEG sintetici con rumore, così da avere dimensioni simili a quelle reali (300 KB+).
+    """
+    rng = random.Random(42)
+    paths = []
+    for i in range(count):
+        noise = Image.effect_noise(size, 32).convert("RGB")
+        tint = Image.new("RGB", size, (rng.randint(0, 255), rng.randint(0, 255), rng.randint(0, 255)))
+        img = Image.blend(noise, tint, 0.8)
+        path = folder / f"bench_{i + 1}.jpg"
+        img.save(path, "JPEG", quality=85)
+        paths.append(str(path))
+    return paths
+
+
+def make_posts(count: int, image_paths):
+    """
+    Crea 'count' post con la stessa struttura di pdf_fields_*_with_images.json.
+    """
+    rng = random.Random(7)
+    posts = []
+    for i in range(count):
+        media_type = MEDIA_TYPES[i % len(MEDIA_TYPES)]
+        posts.append({
+            "media_id": str(17800000000000000 + i),
+            "timestamp": f"2025-05-{(i % 28) + 1:02d}",
+            "permalink": f"https://www.instagram.com/p/bench{i}/",
+            "media_type": media_type,
+            "media_url": f"https://example.com/media/bench_{i}.jpg",
+            "local_img_path": image_paths[i % len(image_paths)],
+            "quality_score": float(rng.randint(0, 3)),
+            "caption": f"Post sintetico {i}",
+            "reach": rng.randint(100, 10000),
+            "saved": rng.randint(0, 100),
+            "views": rng.randint(100, 20000),
+            "like_count": rng.randint(0, 500),
+            "comments_count": rng.randint(0, 50),
+            "total_interactions": rng.randint(0, 600),
+            "shares": rng.randint(0, 30),
+        })
+    return posts
+
+
+def _peak_rss_bytes():
+    """
+    Picco di memoria residente del processo corrente (None se non disponibile, es. Windows).
+    """
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux riporta KB, macOS byte
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def run_once(n_pages, image_paths, output_path, cache_dir, workers=1, catalogue=False):
+    """
+    Esegue un rendering completo in un processo pulito.
+    Restituisce (secondi, picco RSS in byte, RSS prima del rendering in byte).
+    Se il RSS non è disponibile, il picco viene misurato con tracemalloc (più lento).
+    Le immagini ricampionate finiscono in cache_dir (vuota), così il costo del ricampionamento è incluso.
+    Con catalogue=True usa il rendering progressivo del catalogo (render_catalogue).
+    """
+    pdf_utils.IMAGE_CACHE_DIR = str(cache_dir)
+    # Il rendering logga ogni riga di testo: silenziato per non falsare i tempi
+    for name in ("src.step8_generate_pdf", "utils.pdf_utils"):
+        logging.getLogger(name).setLevel(logging.WARNING)
+
+    posts = make_posts(n_pages, image_paths)
+    baseline = _peak_rss_bytes()
+    if baseline is None:
+        tracemalloc.start()
+
+    start = time.perf_counter()
+    render = step8_generate_pdf.render_catalogue if catalogue else step8_generate_pdf.render_posts
+    render(posts, str(output_path), workers=workers)
+    elapsed = time.perf_counter() - start
+
+    if baseline is None:
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        return elapsed, peak, 0
+    return elapsed, _peak_rss_bytes(), baseline
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark rendering PDF step8")
+    parser.add_argument("--pages", type=int, nargs="+", default=DEFAULT_PAGES, help="Numero di pagine da renderizzare (più valori ammessi)")
+    parser.add_argument("--images", type=int, default=20, help="Numero di immagini sintetiche distinte")
+    parser.add_argument("--workers", type=int, default=1, help="Processi per il rendering delle pagine (1 = seriale, 0 = tutti i core)")
+    parser.add_argument("--catalogue", action="store_true", help="Misura la modalità catalogo (scrittura progressiva su disco)")
+    parser.add_argument("--json", type=str, help="Salva i risultati in formato JSON nel percorso indicato")
+    args = parser.parse_args()
+
+    # step8 usa percorsi relativi (template, font)
+    os.chdir(BASE_DIR)
+
+    results = []
+    with tempfile.TemporaryDirectory(prefix="bench_pdf_") as tmp:
+        tmp_dir = Path(tmp)
+        image_paths = make_images(tmp_dir, args.images)
+        avg_image_kb = sum(os.path.getsize(p) for p in image_paths) / len(image_paths) / 1024
+        print(f"Immagini sintetiche: {len(image_paths)} (media {avg_image_kb:.0f} KB)")
+
+        for n_pages in args.pages:
+            output_path = tmp_dir / f"bench_{n_pages}.pdf"
+
+            # Processo nuovo per ogni misura: il picco di memoria non è influenzato dai run precedenti
+            with ProcessPoolExecutor(max_workers=1) as executor:
+                elapsed, peak, baseline = executor.submit(run_once, n_pages, image_paths, output_path, tmp_dir / f"cache_{n_pages}", args.workers, args.catalogue).result()
+
+            size = os.path.getsize(output_path)
+            result = {
+                "pages": n_pages,
+                "total_s": round(elapsed, 3),
+                "ms_per_page": round(elapsed / n_pages * 1000, 2),
+                "peak_mem_mb": round(peak / 1024 / 1024, 2),
+                "render_mem_mb": round((peak - baseline) / 1024 / 1024, 2),
+                "file_size_kb": round(size / 1024, 1),
+                "kb_per_page": round(size / 1024 / n_pages, 1),
+            }
+            results.append(result)
+            print(
+                f"{n_pages:>5} pagine | {result['total_s']:>8.3f} s | {result['ms_per_page']:>8.2f} ms/pagina | "
+                f"picco mem {result['peak_mem_mb']:>8.2f} MB (+{result['render_mem_mb']:.2f} MB rendering) | "
+                f"{result['file_size_kb']:>10.1f} KB ({result['kb_per_page']:.1f} KB/pagina)"
+            )
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"Risultati salvati in {args.json}")
+
+
+if __name__ == "__main__":
+    main()
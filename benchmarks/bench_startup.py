@@ -0,0 +1,96 @@
+"""
+Benchmark dell'avvio a freddo degli entry point (main.py, batch.py, worker.py, moduli degli step).
+
+Per ogni modulo lancia più volte `python -X importtime -c "import <modulo>"` in un processo nuovo e riporta
+il tempo di import (mediana), i moduli più lenti e quali librerie pesanti (PyPDF2, reportlab, PIL, tqdm, rich)
+vengono caricate. Serve a verificare che un'esecuzione che non arriva agli step 6-8 non le importi.
+
+Uso (dalla root del progetto):
+    python -m benchmarks.bench_startup
+    python -m benchmarks.bench_startup --modules main src.step8_generate_pdf --runs 10 --json bench_output.txt
+"""
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+
+DEFAULT_MODULES = ["main", "batch", "worker", "src.pipeline", "src.step3_get_media", "src.step8_generate_pdf"]
+HEAVY_LIBRARIES = ["PyPDF2", "reportlab", "PIL", "tqdm", "rich"]
+
+
+def import_times(module: str):
+    """
+    Importa il modulo in un processo nuovo.
+    Restituisce (tempo cumulativo del modulo in µs, {sotto-modulo: tempo cumulativo in µs}, librerie pesanti caricate).
+    """
+    # Le librerie caricate si leggono da sys.modules: -X importtime elenca anche gli import falliti
+    code = f"import sys, {module}; print(','.join(lib for lib in {HEAVY_LIBRARIES!r} if lib in sys.modules))"
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", code], cwd=BASE_DIR, capture_output=True, text=True)
+    if proc.returncode != 0:
+        raise RuntimeError(f"Import di {module} fallito:\n{proc.stderr[-2000:]}")
+
+    # Formato: "import time:  self [us] | cumulative | imported package", con i sotto-moduli prima del
+    # modulo che li importa e indentati di più
+    entries = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        entries.append((name.strip(), int(cumulative), len(name) - len(name.lstrip())))
+
+    index = max(i for i, (name, _, _) in enumerate(entries) if name == module)
+    _, total, depth = entries[index]
+    children = {}
+    for name, cumulative, child_depth in reversed(entries[:index]):
+        if child_depth <= depth:
+            break
+        children.setdefault(name, cumulative)
+    loaded = [lib for lib in proc.stdout.strip().split(",") if lib]
+    return total, children, loaded
+
+
+def measure(module: str, runs: int, top: int):
+    totals = []
+    for _ in range(runs):
+        total, children, loaded = import_times(module)
+        totals.append(total)
+
+    slowest = sorted(children.items(), key=lambda item: item[1], reverse=True)[:top]
+    return {
+        "module": module,
+        "median_ms": round(statistics.median(totals) / 1000, 1),
+        "min_ms": round(min(totals) / 1000, 1),
+        "heavy_libraries": loaded,
+        "slowest": [{"module": name, "ms": round(us / 1000, 1)} for name, us in slowest],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark avvio a freddo degli entry point")
+    parser.add_argument("--modules", nargs="+", default=DEFAULT_MODULES, help="Moduli da importare (più valori ammessi)")
+    parser.add_argument("--runs", type=int, default=5, help="Processi avviati per ogni modulo")
+    parser.add_argument("--top", type=int, default=5, help="Moduli più lenti da mostrare")
+    parser.add_argument("--json", type=str, help="Salva i risultati in formato JSON nel percorso indicato")
+    args = parser.parse_args()
+
+    results = []
+    for module in args.modules:
+        result = measure(module, args.runs, args.top)
+        results.append(result)
+        heavy = ", ".join(result["heavy_libraries"]) or "nessuna"
+        print(f"{module:<28} | {result['median_ms']:>8.1f} ms (min {result['min_ms']:.1f}) | librerie pesanti: {heavy}")
+        for item in result["slowest"]:
+            print(f"{'':<28} |   {item['ms']:>8.1f} ms  {item['module']}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"Risultati salvati in {args.json}")
+
+
+if __name__ == "__main__":
+    main()
@@ -5,12 +5,7 @@ import logging
 
 from src import step1_setup
 from src import step2_get_ig_user
-from src import step3_get_media
-from src import step4_analyze_content
-from src import step5_extract_pdf_fields
-from src import step6_prepare_images
-from src import step7_prepare_data
-from src import step8_generate_pdf
+from src.pipeline import Pipeline
 
 from utils.token_utils import load_token
 from utils.logger import get_logger
@@ -24,6 +19,12 @@ parser.add_argument("--yes-all", action="store_true", help="Esegue tutti gli ste
 parser.add_argument("--client-name", type=str, help="Nome cliente da analizzare")
 parser.add_argument("--since", type=str, help="Data inizio analisi (YYYY-MM-DD)")
 parser.add_argument("--until", type=str, help="Data fine analisi (YYYY-MM-DD)")
+parser.add_argument("--pdf-workers", type=int, default=1, help="Processi per il rendering del PDF (1 = seriale, 0 = tutti i core)")
+parser.add_argument("--catalogue", action="store_true", help="Genera il catalogo completo (una pagina per ogni post del periodo) invece dei top 3")
+parser.add_argument("--force", action="append", default=[], metavar="STEP",
+                    choices=["step3", "step4", "step5", "step6", "step7", "step8", "all"],
+                    help="Riesegue lo step anche se i suoi input non sono cambiati (ripetibile, 'all' per tutti)")
+parser.add_argument("--stream", action="store_true", help="Analisi, classifica e download partono mentre lo Step 3 recupera i media")
 args, _ = parser.parse_known_args()
 
 # Logger root
@@ -88,48 +89,54 @@ if __name__ == "__main__":
         if not args.yes_all:
             ask_to_continue(2, logger)
 
-        # Step 3: Recupero media Instagram
-        logger.info("▶ Inizio Step 3: Recupero media Instagram")
-        all_media = step3_get_media.run_step3(config)
-        config["media"] = all_media
-
-        logger.info(f"✔ Step 3 completato. Trovati {len(all_media)} media.")
-        if not args.yes_all:
-            ask_to_continue(3, logger)
-
-        # Step 4: Analisi contenuti
-        logger.info("▶ Inizio Step 4: Analisi contenuti")
-        logger.info(f"[DEBUG] Chiamata Step 4 con parametro until: {until}")
-        step4_analyze_content.run_analysis(client_name, since, until)
-        logger.info("✔ Step 4 completato.")
-        if not args.yes_all:
-            ask_to_continue(4, logger)
-
-        # Step 5: Estrai top post per PDF
-        logger.info("▶ Inizio Step 5: Estrazione top post")
-        step5_extract_pdf_fields.extract_top_posts(config["client_name"], since, until)
-        logger.info("✔ Step 5 completato.")
-        if not args.yes_all:
-            ask_to_continue(5, logger)
-
-        # Step 6: Prepara immagini per PDF
-        logger.info("▶ Inizio Step 6: Preparazione immagini")
-        step6_prepare_images.prepare_images(config["client_name"], since, until, config["access_token"])
-        logger.info("✔ Step 6 completato.")
-        if not args.yes_all:
-            ask_to_continue(6, logger)
-
-        # Step 7: Prepara dati PDF
-        logger.info("▶ Inizio Step 7: Preparazione dati PDF")
-        step7_prepare_data.prepare_data(config["client_name"], since, until)
-        logger.info("✔ Step 7 completato.")
-        if not args.yes_all:
-            ask_to_continue(7, logger)
-
-        # Step 8: Genera PDF finale
-        logger.info("▶ Inizio Step 8: Generazione PDF")
-        step8_generate_pdf.generate_pdf(config["client_name"], since, until)
-        logger.info(f"✔ Step 8 completato. PDF generato in output/{config['client_name']}/analisi_post_{since}_{until}.pdf")
+        # Step 3-8: i dati passano in memoria tra gli step, ogni file viene scritto una sola volta
+        # Gli step con input invariati rispetto all'esecuzione precedente vengono saltati (vedi --force)
+        pipeline = Pipeline(config, catalogue=args.catalogue, force=args.force, stream=args.stream)
+        try:
+            # Step 3: Recupero media Instagram
+            logger.info("▶ Inizio Step 3: Recupero media Instagram")
+            all_media = pipeline.fetch_media()
+            config["media"] = all_media
+
+            logger.info(f"✔ Step 3 completato. Trovati {len(all_media)} media.")
+            if not args.yes_all:
+                ask_to_continue(3, logger)
+
+            # Step 4: Analisi contenuti
+            logger.info("▶ Inizio Step 4: Analisi contenuti")
+            pipeline.analyze()
+            logger.info("✔ Step 4 completato.")
+            if not args.yes_all:
+                ask_to_continue(4, logger)
+
+            # Step 5: Estrai top post per PDF
+            logger.info("▶ Inizio Step 5: Estrazione top post")
+            pipeline.select_posts()
+            logger.info("✔ Step 5 completato.")
+            if not args.yes_all:
+                ask_to_continue(5, logger)
+
+            # Step 6: Prepara immagini per PDF
+            logger.info("▶ Inizio Step 6: Preparazione immagini")
+            pipeline.prepare_images()
+            logger.info("✔ Step 6 completato.")
+            if not args.yes_all:
+                ask_to_continue(6, logger)
+
+            # Step 7: Prepara dati PDF
+            logger.info("▶ Inizio Step 7: Preparazione dati PDF")
+            pipeline.prepare_data()
+            logger.info("✔ Step 7 completato.")
+            if not args.yes_all:
+                ask_to_continue(7, logger)
+
+            # Step 8: Genera PDF finale
+            logger.info("▶ Inizio Step 8: Generazione PDF")
+            pdf_path = pipeline.generate_pdf(workers=args.pdf_workers)
+            logger.info(f"✔ Step 8 completato. PDF generato in {pdf_path}")
+        finally:
+            # Anche se l'esecuzione si ferma prima della fine, i dati già calcolati finiscono su disco
+            pipeline.save()
 
         logger.info("✔ Esecuzione main.py completata con successo.")
 
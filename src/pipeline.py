@@ -0,0 +1,448 @@
+import json
+import os
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from datetime import date
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+from utils.fingerprint import FingerprintStore, hash_data, hash_file, hash_files
+from utils.logger import get_logger
+from utils.save_utils import save_media_as_json
+
+# I moduli degli step (e con loro PyPDF2, reportlab, PIL, tqdm) vengono importati dentro i metodi,
+# solo quando lo step viene eseguito davvero: un'esecuzione con step saltati non li carica
+
+logger = get_logger(__name__)
+
+
+# Streaming: record in attesa per ogni consumatore (oltre, step3 aspetta) e download anticipati in parallelo
+STREAM_QUEUE_SIZE = 50
+PREFETCH_WORKERS = 4
+
+_DONE = object()
+
+
+def state_path(client_name: str, since: str, until: str, catalogue: bool = False) -> str:
+    """
+    Percorso del file con le impronte degli step: uno per periodo e modalità, così periodi
+    diversi (o catalogo e top post) dello stesso cliente non si sovrascrivono a vicenda.
+    """
+    suffix = "_catalogue" if catalogue else ""
+    return os.path.join("output", client_name, f".pipeline_state_{since}_{until}{suffix}.json")
+
+
+@dataclass(frozen=True)
+class StepSpec:
+    """
+    Dichiarazione di uno step per il salto incrementale:
+    - code: sorgenti che ne determinano il comportamento (versione del codice)
+    - config: chiavi di config usate dallo step
+    - upstream: step di cui usa i dati prodotti (entra l'impronta del loro output)
+    - files: altri file letti dallo step (template, font)
+    """
+    name: str
+    code: Tuple[str, ...]
+    config: Tuple[str, ...] = ()
+    upstream: Tuple[str, ...] = ()
+    files: Tuple[str, ...] = ()
+
+
+STEPS = {spec.name: spec for spec in (
+    StepSpec("step3", code=("src/step3_get_media.py", "utils/api_wrapper.py"),
+             config=("ig_user_id", "ig_user_ids", "since_unix", "until_unix")),
+    StepSpec("step4", code=("src/step4_analyze_content.py",), upstream=("step3",)),
+    StepSpec("step5", code=("src/step5_extract_pdf_fields.py",), upstream=("step3",)),
+    StepSpec("step6", code=("src/step6_prepare_images.py", "utils/media_utils.py", "utils/media_cache.py",
+                            "utils/frame_extractor.py", "utils/url_refresher.py"), upstream=("step5",)),
+    StepSpec("step7", code=("src/step7_prepare_data.py", "utils/media_cache.py", "utils/url_refresher.py"),
+             upstream=("step6",)),
+    StepSpec("step8", code=("src/step8_generate_pdf.py", "utils/pdf_utils.py"), upstream=("step7",),
+             # Il template è step8_generate_pdf.TEMPLATE_PATH, qui scritto per esteso per non importare step8
+             files=("templates/template_post.pdf", "fonts/Montserrat-Regular.ttf", "fonts/Montserrat-Bold.ttf")),
+)}
+
+
+@dataclass
+class PipelineState:
+    """
+    Dati passati in memoria tra gli step 3-8.
+    - media: record raw_media di step3 (URL aggiornati in place da step6/step7)
+    - analysis: risultati dell'analisi integrata di step4
+    - posts: campi PDF dei post selezionati da step5 (local_img_path aggiornati da step6/step7)
+    - pdf_path: PDF generato da step8
+    """
+    config: Dict[str, Any]
+    catalogue: bool = False
+    media: Optional[List[Dict[str, Any]]] = None
+    analysis: Optional[Dict[str, Any]] = None
+    posts: Optional[List[Dict[str, Any]]] = None
+    pdf_path: Optional[str] = None
+
+    @property
+    def client_name(self) -> str:
+        return self.config["client_name"]
+
+    @property
+    def since(self) -> str:
+        return self.config["since"]
+
+    @property
+    def until(self) -> str:
+        return self.config["until"]
+
+
+class Pipeline:
+    """
+    Esegue gli step 3-8 passando i dati in memoria (PipelineState) invece di rileggere e riscrivere
+    raw_media_*.json e pdf_fields_*.json a ogni step.
+    I file su disco restano un output secondario: ogni file viene scritto una sola volta, quando
+    il dato non verrà più modificato (raw_media e pdf_fields dopo step7, l'analisi dopo step4).
+    save() scrive subito quanto ancora non salvato: va chiamato anche se l'esecuzione si interrompe,
+    così gli step possono essere ripresi singolarmente da riga di comando.
+
+    Esecuzione incrementale: ogni step (STEPS) dichiara i propri input e l'impronta di input e output
+    viene salvata in output/{cliente}/.pipeline_state_{since}_{until}[_catalogue].json (uno per periodo
+    e modalità). Uno step con input invariati e file di output intatti viene saltato e i suoi dati
+    vengono riletti da disco; 'force' (es. {"step5"} o {"all"}) lo riesegue comunque. Gli step successivi vengono rieseguiti solo se l'output cambia davvero.
+    step3 non viene mai saltato se il periodo non è ancora concluso (le metriche cambiano).
+
+    Streaming (stream=True): step3 passa i media uno alla volta, tramite code limitate, all'analisi
+    incrementale di step4 (AnalysisAccumulator) e alla classifica incrementale di step5 (TopPostsRanker);
+    i post che entrano in classifica vengono scaricati subito nella cache media. Alla fine del recupero
+    analisi e classifica sono già pronte.
+
+    Esempio:
+        pipeline = Pipeline(config)
+        try:
+            pipeline.fetch_media()
+            pipeline.analyze()
+            ...
+        finally:
+            pipeline.save()
+    """
+
+    def __init__(self, config: Dict[str, Any], catalogue: bool = False, persist: bool = True,
+                 force: Iterable[str] = (), top_n: int = 3, stream: bool = False, interactive: bool = True):
+        self.state = PipelineState(config=config, catalogue=catalogue)
+        self.persist = persist
+        self.top_n = top_n
+        force = set(force)
+        self.force = set(STEPS) if "all" in force else force
+        self.skipped: Set[str] = set()
+        self._ran: Set[str] = set()
+        self._unsaved: Set[str] = set()
+        s = self.state
+        self._store = FingerprintStore(state_path(s.client_name, s.since, s.until, s.catalogue))
+        self.stream = stream
+        # False: nessuna conferma richiesta negli step 5 e 7 (batch.py)
+        self.interactive = interactive
+        # Risultati calcolati durante il recupero in streaming (None = da calcolare negli step 4/5)
+        self._streamed_analysis: Optional[Dict[str, Any]] = None
+        self._ranked: Optional[List[Dict[str, Any]]] = None
+
+    # Step 3
+    def fetch_media(self) -> List[Dict[str, Any]]:
+        def run():
+            from src import step3_get_media
+            if self.stream:
+                self.state.media = self._stream_media()
+            else:
+                self.state.media = step3_get_media.run_step3(self.state.config, persist=False)
+            self._unsaved.add("media")
+            return self.state.media
+        return self._run("step3", run, lambda: self.state.media)
+
+    # Step 4
+    def analyze(self) -> Dict[str, Any]:
+        def run():
+            from src import step4_analyze_content
+            s = self.state
+            if self._streamed_analysis is not None:
+                logger.info("Analisi contenuti già calcolata durante il recupero dei media (streaming)")
+                s.analysis = self._streamed_analysis
+            else:
+                s.analysis = step4_analyze_content.run_analysis(s.client_name, s.since, s.until, media=s.media or [], persist=False)
+            if s.analysis:
+                self._unsaved.add("analysis")
+                self.save("analysis")
+            return s.analysis
+        return self._run("step4", run, lambda: self.state.analysis)
+
+    # Step 5
+    def select_posts(self) -> List[Dict[str, Any]]:
+        def run():
+            from src import step5_extract_pdf_fields
+            s = self.state
+            # In streaming la classifica è già pronta: step5 lavora solo sui post selezionati
+            raw_data = self._ranked if self._ranked is not None else s.media or []
+            s.posts = step5_extract_pdf_fields.extract_top_posts(
+                s.client_name, s.since, s.until, top_n=self.top_n, catalogue=s.catalogue, raw_data=raw_data,
+                persist=False, confirm=self.interactive
+            ) or []
+            self._unsaved.add("posts")
+            return s.posts
+        return self._run("step5", run, lambda: self.state.posts)
+
+    # Step 6
+    def prepare_images(self) -> List[Dict[str, Any]]:
+        def run():
+            from src import step6_prepare_images
+            s = self.state
+            step6_prepare_images.prepare_images(
+                s.client_name, s.since, s.until, s.config["access_token"], catalogue=s.catalogue,
+                posts=s.posts, raw_media=s.media, persist=False
+            )
+            self._unsaved.add("posts")
+            return s.posts
+        return self._run("step6", run, lambda: self.state.posts)
+
+    # Step 7
+    def prepare_data(self) -> List[Dict[str, Any]]:
+        def run():
+            from src import step7_prepare_data
+            s = self.state
+            done = step7_prepare_data.prepare_data(
+                s.client_name, s.since, s.until, catalogue=s.catalogue, access_token=s.config["access_token"],
+                posts=s.posts, raw_media=s.media, persist=False, confirm=self.interactive
+            )
+            self._unsaved.add("posts")
+            # Dopo step7 media e post non cambiano più
+            self.save("media", "posts")
+            # Download annullato: lo step non risulta eseguito
+            return s.posts if done else None
+        self._run("step7", run, lambda: self.state.posts)
+        return self.state.posts
+
+    # Step 8
+    def generate_pdf(self, workers: int = 1) -> Optional[str]:
+        def run():
+            from src import step8_generate_pdf
+            s = self.state
+            if s.catalogue:
+                s.pdf_path = step8_generate_pdf.generate_catalogue(s.client_name, s.since, s.until, workers=workers, posts=s.posts)
+            else:
+                s.pdf_path = step8_generate_pdf.generate_pdf(s.client_name, s.since, s.until, workers=workers, posts=s.posts)
+            return s.pdf_path
+        return self._run("step8", run, lambda: self.state.pdf_path)
+
+    def run(self, workers: int = 1) -> Optional[str]:
+        """
+        Esegue gli step 3-8 di seguito, senza pause (batch.py), e salva i dati anche in caso di errore.
+        :return: percorso del PDF generato, oppure None.
+        """
+        try:
+            self.fetch_media()
+            self.analyze()
+            self.select_posts()
+            self.prepare_images()
+            self.prepare_data()
+            return self.generate_pdf(workers=workers)
+        finally:
+            self.save()
+
+    def _stream_media(self) -> List[Dict[str, Any]]:
+        """
+        Step 3 in streaming: ogni media recuperato viene passato subito ai consumatori (analisi e classifica),
+        ognuno nel proprio thread con una coda di STREAM_QUEUE_SIZE record.
+        """
+        from src import step3_get_media, step4_analyze_content, step5_extract_pdf_fields
+        from utils.media_cache import shared_cache
+        s = self.state
+        accumulator = step4_analyze_content.AnalysisAccumulator(s.since, s.until)
+        ranker = step5_extract_pdf_fields.TopPostsRanker(self.top_n, catalogue=s.catalogue)
+        cache = shared_cache()
+        failed = set()
+        media = []
+
+        with ThreadPoolExecutor(max_workers=PREFETCH_WORKERS, thread_name_prefix="prefetch") as prefetch_pool:
+            def rank(entry):
+                if ranker.add(entry):
+                    prefetch_pool.submit(self._prefetch, cache, entry)
+
+            consumers = {"step4": accumulator.add, "step5": rank}
+            queues = {name: queue.Queue(maxsize=STREAM_QUEUE_SIZE) for name in consumers}
+            threads = [
+                threading.Thread(target=self._consume, args=(name, queues[name], consumer, failed),
+                                 name=f"stream-{name}", daemon=True)
+                for name, consumer in consumers.items()
+            ]
+            for thread in threads:
+                thread.start()
+            try:
+                for entry in step3_get_media.iter_step3(s.config):
+                    media.append(entry)
+                    for q in queues.values():
+                        q.put(entry)
+            finally:
+                for q in queues.values():
+                    q.put(_DONE)
+                for thread in threads:
+                    thread.join()
+        cache.save()
+
+        # Un consumatore fallito non blocca la pipeline: il suo step verrà calcolato sulla lista completa
+        if "step4" not in failed and media:
+            self._streamed_analysis = accumulator.results()
+        if "step5" not in failed:
+            self._ranked = ranker.selected()
+        logger.info(f"Recupero in streaming completato: {len(media)} media, {len(ranker.selected())} post in classifica")
+        return media
+
+    @staticmethod
+    def _consume(name: str, q: queue.Queue, consumer: Callable[[Dict[str, Any]], Any], failed: Set[str]):
+        while True:
+            entry = q.get()
+            if entry is _DONE:
+                return
+            if name in failed:
+                # Si continua a svuotare la coda per non bloccare step3
+                continue
+            try:
+                consumer(entry)
+            except Exception as e:
+                logger.error(f"Errore nel consumatore {name} durante lo streaming: {e}", exc_info=True)
+                failed.add(name)
+
+    @staticmethod
+    def _prefetch(cache, entry: Dict[str, Any]):
+        from src import step5_extract_pdf_fields, step6_prepare_images
+        media_url, thumbnail_url = step5_extract_pdf_fields.select_media_urls(entry)
+        post = {
+            "media_id": entry.get("media_id"),
+            "media_type": entry.get("media_type", ""),
+            "media_url": media_url,
+            "thumbnail_url": thumbnail_url,
+        }
+        try:
+            step6_prepare_images.prefetch_media(cache, post)
+        except Exception as e:
+            # Il media verrà comunque scaricato da step6
+            logger.warning(f"Download anticipato fallito per {post['media_id']}: {e}")
+
+    def _output_paths(self, step: str) -> List[str]:
+        """
+        File su disco da cui si rileggono i dati di uno step saltato.
+        """
+        s = self.state
+        if step == "step3":
+            return [os.path.join("media", s.client_name, f"raw_media_{s.since}_{s.until}.json")]
+        if step == "step4":
+            return [os.path.join("media", s.client_name, f"analysis_results_{s.since}_{s.until}.json"),
+                    os.path.join("output", s.client_name, f"integrated_analysis_report_{s.since}_{s.until}.txt")]
+        if step in ("step5", "step6", "step7"):
+            from src.step5_extract_pdf_fields import pdf_fields_path
+            return [pdf_fields_path(s.client_name, s.since, s.until, s.catalogue)]
+        name = "catalogo_post" if s.catalogue else "analisi_post"
+        return [os.path.join("output", s.client_name, f"{name}_{s.since}_{s.until}.pdf")]
+
+    def _input_fingerprint(self, step: str) -> Optional[str]:
+        spec = STEPS[step]
+        s = self.state
+        if step == "step3" and s.until >= date.today().isoformat():
+            # Periodo non concluso: i dati remoti possono ancora cambiare
+            return None
+        return hash_data({
+            "code": hash_files(spec.code),
+            "files": hash_files(spec.files),
+            "config": {key: s.config.get(key) for key in spec.config},
+            "params": {"client_name": s.client_name, "since": s.since, "until": s.until,
+                       "catalogue": s.catalogue, "top_n": self.top_n},
+            "upstream": {name: (self._store.get(name) or {}).get("output") for name in spec.upstream},
+        })
+
+    def _load_outputs(self, step: str) -> bool:
+        """
+        Rilegge da disco i dati prodotti da uno step saltato.
+        """
+        s = self.state
+        path = self._output_paths(step)[0]
+        try:
+            if step == "step8":
+                s.pdf_path = path
+                return True
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Output di {step} non leggibile ({e}), lo step viene rieseguito.")
+            return False
+        if step == "step3":
+            s.media = data
+        elif step == "step4":
+            s.analysis = data
+        else:
+            s.posts = data
+        return True
+
+    def _can_skip(self, step: str, fingerprint: Optional[str]) -> bool:
+        record = self._store.get(step)
+        if fingerprint is None or step in self.force or not record or record.get("inputs") != fingerprint:
+            return False
+        # File di output mancanti o modificati dopo l'ultima esecuzione: lo step va rifatto
+        if hash_files(self._output_paths(step)) != record.get("files"):
+            return False
+        if not self._load_outputs(step):
+            return False
+        if step in ("step6", "step7") and not self._images_available():
+            logger.info(f"Immagini di {step} non più presenti nella cache media, lo step viene rieseguito.")
+            return False
+        return True
+
+    def _images_available(self) -> bool:
+        """
+        True se i file indicati da local_img_path dei post esistono ancora: stanno nella cache media condivisa,
+        che può averli rimossi per rientrare nel budget (altri clienti o periodi).
+        """
+        from utils.media_cache import shared_cache
+        cache = shared_cache()
+        paths = [post["local_img_path"] for post in self.state.posts or [] if post.get("local_img_path")]
+        # Tutti i percorsi vengono controllati: quelli presenti restano esclusi dalla pulizia fino allo step8
+        return all([cache.get_path(path) for path in paths])
+
+    def _run(self, step: str, run: Callable[[], Any], result: Callable[[], Any]):
+        fingerprint = self._input_fingerprint(step)
+        if self._can_skip(step, fingerprint):
+            logger.info(f"⏭ {step} saltato: input invariati (usa --force {step} per rieseguirlo)")
+            self.skipped.add(step)
+            return result()
+
+        output = run()
+        if output:
+            # Anche con impronta None (step3 a periodo aperto) si registra l'output, da cui dipendono gli step successivi
+            output_fingerprint = hash_file(output) if step == "step8" else hash_data(output)
+            self._store.record(step, fingerprint, output_fingerprint)
+            self._ran.add(step)
+        else:
+            self._store.forget(step)
+        return output
+
+    def save(self, *names: str):
+        """
+        Scrive su disco i dati indicati (tutti se non specificati) non ancora salvati.
+        """
+        if not self.persist:
+            return
+        s = self.state
+        for name in [n for n in (names or ("media", "analysis", "posts")) if n in self._unsaved]:
+            if name == "media" and s.media is not None:
+                save_media_as_json(s.media, s.client_name, s.since, s.until)
+            elif name == "analysis" and s.analysis:
+                from src.step4_analyze_content import save_analysis
+                save_analysis(s.analysis, s.client_name, s.since, s.until)
+            elif name == "posts" and s.posts:
+                from src.step5_extract_pdf_fields import pdf_fields_path
+                json_path = pdf_fields_path(s.client_name, s.since, s.until, s.catalogue)
+                os.makedirs(os.path.dirname(json_path), exist_ok=True)
+                with open(json_path, "w", encoding="utf-8") as f:
+                    json.dump(s.posts, f, ensure_ascii=False, indent=4)
+                logger.info(f"[💾] Campi PDF salvati in {json_path} ({len(s.posts)} post)")
+            self._unsaved.discard(name)
+
+        if not self._unsaved:
+            # Le impronte dei file si registrano solo quando sono tutti su disco (anche per gli step
+            # saltati: pdf_fields è condiviso dagli step 5-7)
+            for step in (self._ran | self.skipped) & set(STEPS):
+                if self._store.get(step) is not None:
+                    self._store.set_files(step, hash_files(self._output_paths(step)))
+            self._store.save()
@@ -1,7 +1,19 @@
+import os
 import requests
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional
+from utils.api_wrapper import get as api_get
+from utils.client_utils import ClientDataError, client_registry
 from utils.logger import get_logger
 logger = get_logger(__name__)
 
+GRAPH_URL = "https://graph.facebook.com/v23.0/"
+# Page ID per chiamata multi-id (?ids=p1,p2,...): limite della Graph API
+MAX_IDS_PER_CALL = 50
+# Giorni dopo cui il collegamento pagina → account IG salvato in clienti.json viene ricontrollato,
+# sovrascrivibile con IG_USER_ID_TTL_DAYS
+DEFAULT_IG_TTL_DAYS = 7
+
 
 def get_instagram_user_id(page_id: str, access_token: str) -> str:
     """
@@ -69,16 +81,114 @@ def run(client_name, since, until):
         else:
             logger.warning(f"Impossibile recuperare IG User ID per pagina {page_id}")
 
+def fetch_ig_user_ids(page_ids: Iterable[str], access_token: str) -> Dict[str, Optional[str]]:
+    """
+    IG User ID collegato a ogni pagina, con una chiamata multi-id ogni MAX_IDS_PER_CALL pagine.
+    Le pagine senza account Instagram hanno None; quelle non risolte (errore API) non compaiono nel risultato.
+    """
+    page_ids = list(dict.fromkeys(page_ids))
+    resolved = {}
+    for start in range(0, len(page_ids), MAX_IDS_PER_CALL):
+        chunk = page_ids[start:start + MAX_IDS_PER_CALL]
+        logger.info(f"Recupero IG User ID per {len(chunk)} Page ID: {', '.join(chunk)}")
+        # api_get usa la sessione HTTP e il budget di chiamate condivisi (batch.py)
+        data = api_get(GRAPH_URL, params={
+            "ids": ",".join(chunk),
+            "fields": "connected_instagram_account",
+            "access_token": access_token
+        })
+        if "error" in data:
+            if len(chunk) > 1:
+                # Un solo Page ID non valido fa fallire tutta la chiamata: si riprova pagina per pagina
+                logger.warning(f"Chiamata multi-id fallita ({data['error']}), recupero le pagine singolarmente")
+                for page_id in chunk:
+                    resolved.update(fetch_ig_user_ids([page_id], access_token))
+            else:
+                logger.error(f"Errore API durante il recupero IG User ID per Page {chunk[0]}: {data['error']}")
+            continue
+
+        for page_id in chunk:
+            account = (data.get(page_id) or {}).get("connected_instagram_account") or {}
+            resolved[page_id] = account.get("id")
+            if resolved[page_id]:
+                logger.info(f"IG User ID trovato: {resolved[page_id]} per Page {page_id}")
+            else:
+                logger.warning(f"Nessun account Instagram collegato alla pagina {page_id}")
+    return resolved
+
+
+def stored_ig_accounts(client_data: dict) -> Dict[str, Optional[str]]:
+    """
+    Collegamenti pagina → IG User ID salvati in clienti.json (ig_accounts, oppure page_id/ig_user_id).
+    """
+    if isinstance(client_data.get("ig_accounts"), dict):
+        return dict(client_data["ig_accounts"])
+    if client_data.get("page_id") and client_data.get("ig_user_id"):
+        return {str(client_data["page_id"]): str(client_data["ig_user_id"])}
+    return {}
+
+
+def _is_fresh(client_data: dict) -> bool:
+    checked_at = client_data.get("ig_checked_at")
+    if not checked_at:
+        return False
+    ttl_days = float(os.getenv("IG_USER_ID_TTL_DAYS", DEFAULT_IG_TTL_DAYS))
+    try:
+        return datetime.now() - datetime.fromisoformat(checked_at) < timedelta(days=ttl_days)
+    except ValueError:
+        return False
+
+
+def resolve_ig_accounts(clients: Dict[str, List[str]], access_token: str) -> Dict[str, Dict[str, Optional[str]]]:
+    """
+    Collegamenti pagina → IG User ID per più clienti ({cliente: [page_id, ...]}).
+    Usa quelli salvati in clienti.json se controllati da meno di IG_USER_ID_TTL_DAYS giorni; tutte le altre
+    pagine vengono risolte insieme con chiamate multi-id e il risultato viene salvato (ig_accounts, ig_checked_at).
+    """
+    registry = client_registry()
+    accounts = {}
+    stale = {}
+    for client_name, page_ids in clients.items():
+        client_data = registry.get(client_name)
+        stored = stored_ig_accounts(client_data)
+        if _is_fresh(client_data) and all(page_id in stored for page_id in page_ids):
+            accounts[client_name] = {page_id: stored[page_id] for page_id in page_ids}
+        else:
+            stale[client_name] = page_ids
+
+    if stale:
+        resolved = fetch_ig_user_ids([page_id for page_ids in stale.values() for page_id in page_ids], access_token)
+        checked_at = datetime.now().isoformat(timespec="seconds")
+        for client_name, page_ids in stale.items():
+            accounts[client_name] = {page_id: resolved.get(page_id) for page_id in page_ids}
+            if not all(page_id in resolved for page_id in page_ids):
+                # Risoluzione incompleta: non si salva, al prossimo avvio si riprova
+                continue
+            stored = {**stored_ig_accounts(registry.get(client_name)), **accounts[client_name]}
+            changes = {"ig_accounts": stored, "ig_checked_at": checked_at}
+            first = next((ig_id for ig_id in accounts[client_name].values() if ig_id), None)
+            if first:
+                changes["ig_user_id"] = first
+            try:
+                registry.patch(client_name, changes)
+            except ClientDataError as e:
+                # Gli ID restano validi per questa esecuzione, verranno risolti di nuovo la prossima volta
+                logger.error(f"Collegamenti Instagram di '{client_name}' non salvati: {e}")
+    return accounts
+
+
 def run_step2(config: dict) -> dict:
     """
     Esegue lo Step 2: recupera l'Instagram User ID per i Page ID presenti in config,
-    aggiorna config con la chiave 'ig_user_id', e restituisce il config aggiornato.
+    aggiorna config con le chiavi 'ig_user_ids' (tutti gli account collegati) e 'ig_user_id' (il primo),
+    e restituisce il config aggiornato.
+    I collegamenti già salvati in clienti.json e ancora validi (IG_USER_ID_TTL_DAYS) non richiedono chiamate API.
 
     Parametri:
     - config: dict con almeno le chiavi 'page_ids' (list di stringhe) e 'access_token' (str).
 
     Ritorna:
-    - config aggiornato con 'ig_user_id' (str) o None in caso di errore.
+    - config aggiornato con 'ig_user_ids' (list) e 'ig_user_id' (str), senza le due chiavi in caso di errore.
     """
     logger.info("Inizio Step 2 - Recupero Instagram User ID")
 
@@ -91,35 +201,22 @@ def run_step2(config: dict) -> dict:
         logger.error("Nessun 'access_token' fornito nel config")
         return config
 
-    ig_user_id = None
-    for page_id in page_ids:
-        logger.info(f"Recupero IG User ID per Page ID: {page_id}")
-        try:
-            response = requests.get(
-                f"https://graph.facebook.com/v23.0/{page_id}",
-                params={
-                    "fields": "connected_instagram_account",
-                    "access_token": access_token
-                }
-            )
-            logger.debug(f"Risposta API: {response.status_code} - {response.text}")
-            response.raise_for_status()
-
-            data = response.json()
-            connected_instagram_account = data.get("connected_instagram_account")
-            if connected_instagram_account and "id" in connected_instagram_account:
-                ig_user_id = connected_instagram_account["id"]
-                logger.info(f"IG User ID trovato: {ig_user_id} per Page {page_id}")
-                break  # esce al primo ID valido trovato, rimuovi break se vuoi tutti
-            else:
-                logger.warning(f"Nessun account Instagram collegato alla pagina {page_id}")
-        except Exception as e:
-            logger.error(f"Errore durante il recupero IG User ID per Page {page_id}: {e}")
-
-    if ig_user_id:
-        # Inserisci o aggiorna la chiave 'ig_user_id' in config
-        config['ig_user_id'] = ig_user_id
-        logger.info(f"Aggiornato config con ig_user_id: {ig_user_id}")
+    client_name = config.get("client_name")
+    try:
+        accounts = resolve_ig_accounts({client_name: page_ids}, access_token)[client_name]
+    except Exception as e:
+        logger.error(f"Errore durante il recupero IG User ID: {e}")
+        accounts = {}
+
+    # Tutti gli account Instagram collegati alle pagine, nell'ordine dei Page ID (più pagine possono
+    # condividere lo stesso account)
+    ig_user_ids = list(dict.fromkeys(accounts[page_id] for page_id in page_ids if accounts.get(page_id)))
+
+    if ig_user_ids:
+        # 'ig_user_id' resta il primo account, per chi usa un solo account; step3 li recupera tutti
+        config['ig_user_id'] = ig_user_ids[0]
+        config['ig_user_ids'] = ig_user_ids
+        logger.info(f"Aggiornato config con {len(ig_user_ids)} account Instagram: {', '.join(ig_user_ids)}")
     else:
         logger.warning("Impossibile recuperare IG User ID da nessuna pagina fornita")
 
@@ -127,6 +224,21 @@ def run_step2(config: dict) -> dict:
     return config
 
 
+def prefetch_ig_accounts(client_names: Iterable[str], access_token: str) -> Dict[str, Dict[str, Optional[str]]]:
+    """
+    Risolve in anticipo, con una sola chiamata multi-id ogni MAX_IDS_PER_CALL pagine, i collegamenti di tutti
+    i clienti di un batch: run_step2 dei singoli job li trova poi già salvati.
+    """
+    registry = client_registry()
+    clients = {}
+    for client_name in client_names:
+        client_data = registry.get(client_name)
+        page_ids = list(stored_ig_accounts(client_data)) or ([str(client_data["page_id"])] if client_data.get("page_id") else [])
+        if page_ids:
+            clients[client_name] = page_ids
+    return resolve_ig_accounts(clients, access_token)
+
+
 
 if __name__ == "__main__":
     if len(sys.argv) != 4:
@@ -1,7 +1,10 @@
 import os
+import queue
 import sys
+import threading
 import time
-from typing import List, Dict, Any, Union, Optional
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Any, Iterator, Union, Optional
 from datetime import datetime, timezone, timedelta
 from utils.api_wrapper import get as api_get
 from utils.logger import get_logger, log_exceptions
@@ -12,6 +15,11 @@ from utils.save_utils import save_media_as_json
 
 logger = get_logger(__name__)
 
+# Account Instagram dello stesso cliente recuperati in parallelo: le chiamate passano tutte da
+# utils/api_wrapper.py, quindi il budget di chiamate al secondo resta quello condiviso del token
+ACCOUNT_WORKERS = 4
+_DONE = object()
+
 
 def generate_monthly_intervals(start_date: datetime, end_date: datetime) -> List[Dict[str, datetime]]:
     intervals = []
@@ -114,22 +122,50 @@ def get_media_complete_data(
     since: int,
     until: int,
     client_name: str,
+    persist: bool = True,
 ) -> List[Dict[str, Any]]:
-    
-    logger.info(f"[DEBUG] Input parameters:")
-    logger.info(f"  ig_user_id: {ig_user_id}")
-    logger.info(f"  access_token: {'<hidden>'}")  # non stampare il token reale per sicurezza
-    logger.info(f"  since (timestamp): {since}")
-    logger.info(f"  until (timestamp): {until}")
-    logger.info(f"  client_name: {client_name}")
-
     """
     Flusso completo:
     1) Recupera lista media (id + media_type) suddividendo in intervalli mensili se > 1 mese
     2) Per ogni media, chiama API dati dettagliati + insights a seconda del tipo
     3) Aggrega dati per caroselli
-    4) Salva JSON raw finale unito
+    4) Salva JSON raw finale unito (se persist=True)
+    """
+    all_media_complete = list(iter_media_complete_data(ig_user_id, access_token, since, until, client_name))
+
+    if persist:
+        save_raw_media(all_media_complete, client_name, since, until)
+
+    return all_media_complete
+
+
+def save_raw_media(media: List[Dict[str, Any]], client_name: str, since: int, until: int):
+    start_date = datetime.utcfromtimestamp(since).replace(tzinfo=None)
+    end_date = datetime.utcfromtimestamp(until).replace(tzinfo=None)
+    since_str = start_date.strftime("%Y-%m-%d")
+    until_str = end_date.strftime("%Y-%m-%d")
+    save_media_as_json(media, client_name, since_str, until_str)
+    logger.info(f"File JSON raw_media salvato per {client_name} da {since_str} a {until_str}")
+
+
+def iter_media_complete_data(
+    ig_user_id: str,
+    access_token: str,
+    since: int,
+    until: int,
+    client_name: str,
+) -> Iterator[Dict[str, Any]]:
+    """
+    Come get_media_complete_data, ma restituisce i media uno alla volta appena completati (dettagli + insights),
+    così gli step successivi possono iniziare durante il recupero (pipeline in streaming, src/pipeline.py).
+    Non salva nulla su file.
     """
+    logger.info(f"[DEBUG] Input parameters:")
+    logger.info(f"  ig_user_id: {ig_user_id}")
+    logger.info(f"  access_token: {'<hidden>'}")  # non stampare il token reale per sicurezza
+    logger.info(f"  since (timestamp): {since}")
+    logger.info(f"  until (timestamp): {until}")
+    logger.info(f"  client_name: {client_name}")
 
     start_date = datetime.utcfromtimestamp(since).replace(tzinfo=None)
     end_date = datetime.utcfromtimestamp(until).replace(tzinfo=None)
@@ -143,7 +179,6 @@ def get_media_complete_data(
     else:
         intervals = [{"since": start_date, "until": end_date}]
 
-    all_media_complete = []
     processed_media_count = 0
 
     for interval in intervals:
@@ -292,8 +327,8 @@ def get_media_complete_data(
                     logger.warning(f"Tipo media sconosciuto o non gestito: {media_type} per media {media_id}")
                     continue
 
-                all_media_complete.append(media_entry)
                 processed_media_count += 1
+                yield media_entry
                 if processed_media_count % 25 == 0:
                     logger.info(f"{processed_media_count} media processati finora...")
 
@@ -302,38 +337,98 @@ def get_media_complete_data(
 
     logger.info(f"Totale media processati in tutti gli intervalli: {processed_media_count}")
 
-    since_str = start_date.strftime("%Y-%m-%d")
-    until_str = end_date.strftime("%Y-%m-%d")
-    save_media_as_json(all_media_complete, client_name, since_str, until_str)
-    logger.info(f"File JSON raw_media salvato per {client_name} da {since_str} a {until_str}")
+def account_ids(config: dict) -> List[str]:
+    """
+    Account Instagram del cliente: tutti quelli trovati da step2 ('ig_user_ids'), altrimenti 'ig_user_id'.
+    """
+    ig_user_ids = config.get("ig_user_ids") or ([config["ig_user_id"]] if config.get("ig_user_id") else [])
+    return list(dict.fromkeys(str(ig_user_id) for ig_user_id in ig_user_ids))
 
-    return all_media_complete
 
-from typing import List, Dict
+def iter_accounts_media(
+    ig_user_ids: List[str],
+    access_token: str,
+    since: int,
+    until: int,
+    client_name: str,
+) -> Iterator[Dict[str, Any]]:
+    """
+    Media di tutti gli account Instagram del cliente, ognuno con la chiave 'ig_user_id' dell'account di provenienza.
+    Gli account vengono recuperati in parallelo (al massimo ACCOUNT_WORKERS alla volta) e i media restituiti
+    appena completati, quindi media di account diversi possono arrivare alternati.
+    Un errore nel recupero di un account viene rilanciato qui (come con un solo account) e ferma gli altri.
+    """
+    if len(ig_user_ids) == 1:
+        for entry in iter_media_complete_data(ig_user_ids[0], access_token, since, until, client_name):
+            yield {**entry, "ig_user_id": ig_user_ids[0]}
+        return
+
+    results = queue.Queue()
+    # Impostato se chi consuma smette prima della fine: i thread si fermano al media successivo
+    stop = threading.Event()
 
-def run_step3(config: dict) -> List[Dict]:
+    def fetch(ig_user_id: str):
+        count = 0
+        try:
+            for entry in iter_media_complete_data(ig_user_id, access_token, since, until, client_name):
+                if stop.is_set():
+                    return
+                results.put({**entry, "ig_user_id": ig_user_id})
+                count += 1
+            logger.info(f"Account {ig_user_id}: {count} media recuperati")
+        except Exception as e:
+            logger.error(f"Errore nel recupero dei media dell'account {ig_user_id}: {e}", exc_info=True)
+            # Passata a chi consuma: un account mancante non deve sembrare un recupero riuscito
+            results.put(e)
+        finally:
+            results.put(_DONE)
+
+    logger.info(f"Recupero in parallelo dei media di {len(ig_user_ids)} account Instagram per {client_name}")
+    with ThreadPoolExecutor(max_workers=min(ACCOUNT_WORKERS, len(ig_user_ids)), thread_name_prefix="account") as pool:
+        for ig_user_id in ig_user_ids:
+            pool.submit(fetch, ig_user_id)
+        remaining = len(ig_user_ids)
+        try:
+            while remaining:
+                entry = results.get()
+                if entry is _DONE:
+                    remaining -= 1
+                elif isinstance(entry, Exception):
+                    raise entry
+                else:
+                    yield entry
+        finally:
+            stop.set()
+
+
+def run_step3(config: dict, persist: bool = True) -> List[Dict]:
+    """
+    Esegue lo Step 3 con i parametri del config: i media di tutti gli account Instagram del cliente in un unico
+    elenco, raggruppati per account (nell'ordine di 'ig_user_ids') e con la chiave 'ig_user_id'.
+    Con persist=False raw_media non viene scritto: se ne occupa chi chiama (src/pipeline.py).
+    """
     client_name = config.get("client_name")
     since_unix = config.get("since_unix")
     until_unix = config.get("until_unix")
     access_token = config.get("access_token")
-    ig_user_id = config.get("ig_user_id")
+    ig_user_ids = account_ids(config)
 
     logger.info(f"run_step3 avviato per cliente {client_name}")
 
     # Verifica presenza parametri essenziali
-    if not all([client_name, since_unix, until_unix, access_token, ig_user_id]):
+    if not all([client_name, since_unix, until_unix, access_token, ig_user_ids]):
         logger.error("Parametri mancanti nel config per run_step3")
         return []
 
     try:
-        media_list = get_media_complete_data(
-            ig_user_id=ig_user_id,
-            access_token=access_token,
-            since=since_unix,
-            until=until_unix,
-            client_name=client_name
-        )
-        logger.info(f"run_step3 completato: {len(media_list)} media recuperati per cliente {client_name}")
+        media_list = list(iter_accounts_media(ig_user_ids, access_token, since_unix, until_unix, client_name))
+        # Ordine stabile qualunque sia l'account che finisce prima (sort stabile: l'ordine dei media di ogni account resta quello dell'API)
+        position = {ig_user_id: i for i, ig_user_id in enumerate(ig_user_ids)}
+        media_list.sort(key=lambda entry: position[entry["ig_user_id"]])
+        if persist:
+            save_raw_media(media_list, client_name, since_unix, until_unix)
+        logger.info(f"run_step3 completato: {len(media_list)} media recuperati da {len(ig_user_ids)} account "
+                    f"per cliente {client_name}")
         return media_list
 
     except Exception as e:
@@ -342,6 +437,26 @@ def run_step3(config: dict) -> List[Dict]:
 
 
 
+def iter_step3(config: dict) -> Iterator[Dict]:
+    """
+    Come run_step3, ma restituisce i media uno alla volta appena completati, con gli account alternati
+    (pipeline in streaming, src/pipeline.py).
+    """
+    client_name = config.get("client_name")
+    since_unix = config.get("since_unix")
+    until_unix = config.get("until_unix")
+    access_token = config.get("access_token")
+    ig_user_ids = account_ids(config)
+
+    logger.info(f"iter_step3 avviato per cliente {client_name}")
+
+    if not all([client_name, since_unix, until_unix, access_token, ig_user_ids]):
+        logger.error("Parametri mancanti nel config per iter_step3")
+        return
+
+    yield from iter_accounts_media(ig_user_ids, access_token, since_unix, until_unix, client_name)
+
+
 @log_exceptions
 def run(client_name: str, since_unix: int, until_unix: int) -> List[Dict[str, Any]]:
     logger.info(f"[DEBUG] run() chiamato con parametri:")
@@ -99,66 +99,27 @@ def generate_date_range(since: str, until: str) -> List[datetime]:
     logger.info(f"Generata lista date da {since} a {until}, totale {len(date_list)} giorni.")
     return date_list
 
+def _media_date(media: Dict[str, Any]):
+    """
+    Data di pubblicazione (date) di un media, None se assente o non valida.
+    """
+    ts = media.get("timestamp", "")
+    if not ts:
+        logger.warning("Media senza timestamp trovato.")
+        return None
+    try:
+        return datetime.strptime(ts[:10], "%Y-%m-%d").date()
+    except Exception as e:
+        logger.warning(f"Formato timestamp errato '{ts}': {e}")
+        return None
+
 def analyze_publication_frequency(media_list: List[Dict], since: str, until: str) -> Dict[str, Any]:
     logger.info("Inizio analisi frequenza e costanza pubblicazioni.")
     try:
-        dates = []
-        for media in media_list:
-            ts = media.get("timestamp", "")
-            if ts:
-                try:
-                    dt = datetime.strptime(ts[:10], "%Y-%m-%d").date()
-                    dates.append(dt)
-                except Exception as e:
-                    logger.warning(f"Formato timestamp errato '{ts}': {e}")
-            else:
-                logger.warning("Media senza timestamp trovato.")
+        dates = [d for d in (_media_date(media) for media in media_list) if d is not None]
 
         logger.info(f"Estrazioni date completate, totali: {len(dates)}")
-        full_dates = generate_date_range(since, until)
-        count_per_day = Counter(dates)
-        logger.info(f"Conteggio contenuti per giorno calcolato.")
-
-        active_days = [d for d in full_dates if count_per_day.get(d, 0) > 0]
-        pause_days = [d for d in full_dates if count_per_day.get(d, 0) == 0]
-
-        max_count = max(count_per_day.values()) if count_per_day else 0
-        peak_days = [d for d, c in count_per_day.items() if c == max_count] if max_count > 0 else []
-
-        detailed_report = []
-        for day in full_dates:
-            cnt = count_per_day.get(day, 0)
-            peak_flag = cnt == max_count and cnt > 0
-            detailed_report.append({
-                "date": day.isoformat(),
-                "content_count": cnt,
-                "is_peak": peak_flag
-            })
-
-        stats = {
-            "total_days": len(full_dates),
-            "active_days_count": len(active_days),
-            "pause_days_count": len(pause_days),
-            "peak_days": [d.isoformat() for d in peak_days],
-            "max_content_count": max_count,
-        }
-
-        logger.info(f"Analisi frequenza completata: {stats}")
-
-        report_text = (
-            f"Analisi pubblicazioni dal {since} al {until}:\n"
-            f"Totale giorni: {stats['total_days']}\n"
-            f"Giorni attivi: {stats['active_days_count']}\n"
-            f"Giorni di pausa: {stats['pause_days_count']}\n"
-            f"Giorni con picco di pubblicazione ({max_count} contenuti): "
-            f"{', '.join(stats['peak_days']) if stats['peak_days'] else 'Nessuno'}\n"
-        )
-
-        return {
-            "stats": stats,
-            "detailed_report": detailed_report,
-            "report_text": report_text
-        }
+        return frequency_report(Counter(dates), since, until)
 
     except Exception as e:
         logger.error(f"Errore durante analisi frequenza pubblicazioni: {e}", exc_info=True)
@@ -168,23 +129,78 @@ def analyze_publication_frequency(media_list: List[Dict], since: str, until: str
             "report_text": "Errore durante analisi frequenza pubblicazioni."
         }
 
+def frequency_report(count_per_day: Counter, since: str, until: str) -> Dict[str, Any]:
+    """
+    Statistiche e report di frequenza a partire dal numero di contenuti per giorno.
+    """
+    full_dates = generate_date_range(since, until)
+    logger.info(f"Conteggio contenuti per giorno calcolato.")
+
+    active_days = [d for d in full_dates if count_per_day.get(d, 0) > 0]
+    pause_days = [d for d in full_dates if count_per_day.get(d, 0) == 0]
+
+    max_count = max(count_per_day.values()) if count_per_day else 0
+    peak_days = [d for d, c in count_per_day.items() if c == max_count] if max_count > 0 else []
+
+    detailed_report = []
+    for day in full_dates:
+        cnt = count_per_day.get(day, 0)
+        peak_flag = cnt == max_count and cnt > 0
+        detailed_report.append({
+            "date": day.isoformat(),
+            "content_count": cnt,
+            "is_peak": peak_flag
+        })
+
+    stats = {
+        "total_days": len(full_dates),
+        "active_days_count": len(active_days),
+        "pause_days_count": len(pause_days),
+        "peak_days": [d.isoformat() for d in peak_days],
+        "max_content_count": max_count,
+    }
+
+    logger.info(f"Analisi frequenza completata: {stats}")
+
+    report_text = (
+        f"Analisi pubblicazioni dal {since} al {until}:\n"
+        f"Totale giorni: {stats['total_days']}\n"
+        f"Giorni attivi: {stats['active_days_count']}\n"
+        f"Giorni di pausa: {stats['pause_days_count']}\n"
+        f"Giorni con picco di pubblicazione ({max_count} contenuti): "
+        f"{', '.join(stats['peak_days']) if stats['peak_days'] else 'Nessuno'}\n"
+    )
+
+    return {
+        "stats": stats,
+        "detailed_report": detailed_report,
+        "report_text": report_text
+    }
+
+def _media_duration(media: Dict[str, Any]):
+    """
+    Durata in secondi di un reel/video, None per gli altri tipi o se mancante/non valida.
+    """
+    media_type = media.get("media_type", "").upper()
+    if media_type not in ("REEL", "VIDEO"):
+        return None
+    duration = media.get("duration")
+    if duration is None:
+        logger.warning(f"Durata mancante per media ID {media.get('media_id', 'unknown')}")
+        return None
+    try:
+        return float(duration)
+    except Exception as e:
+        logger.warning(f"Errore nel parsing durata per media ID {media.get('media_id', 'unknown')}: {e}")
+        return None
+
 def calculate_average_reel_duration(media_list: List[Dict[str, Any]]) -> Dict[str, Any]:
     logger.info("Inizio calcolo durata media reel/video.")
-    durations = []
-    count = 0
-    for media in media_list:
-        media_type = media.get("media_type", "").upper()
-        if media_type in ("REEL", "VIDEO"):
-            duration = media.get("duration")
-            if duration is None:
-                logger.warning(f"Durata mancante per media ID {media.get('media_id', 'unknown')}")
-                continue
-            try:
-                dur_sec = float(duration)
-                durations.append(dur_sec)
-                count += 1
-            except Exception as e:
-                logger.warning(f"Errore nel parsing durata per media ID {media.get('media_id', 'unknown')}: {e}")
+    durations = [d for d in (_media_duration(media) for media in media_list) if d is not None]
+    return duration_stats(durations)
+
+def duration_stats(durations: List[float]) -> Dict[str, Any]:
+    count = len(durations)
     average = sum(durations) / count if count > 0 else 0.0
     logger.info(f"Calcolata durata media su {count} contenuti: {average:.2f} secondi.")
     return {
@@ -192,7 +208,76 @@ def calculate_average_reel_duration(media_list: List[Dict[str, Any]]) -> Dict[st
         "count": count
     }
 
-def integrated_analysis(media_list: List[Dict[str, Any]], since: str, until: str, client_name: str) -> Dict[str, Any]:
+class AnalysisAccumulator:
+    """
+    Versione incrementale di integrated_analysis: i media vengono aggiunti uno alla volta mentre
+    step3 li recupera (pipeline in streaming, src/pipeline.py) e results() restituisce lo stesso
+    dizionario di integrated_analysis, senza tenere in memoria la lista dei media.
+
+    Esempio:
+        accumulator = AnalysisAccumulator(since, until)
+        for media in iter_media_complete_data(...):
+            accumulator.add(media)
+        results = accumulator.results()
+    """
+
+    def __init__(self, since: str, until: str):
+        self.since = since
+        self.until = until
+        self.media_counts: Dict[str, int] = {}
+        self.count_per_day: Counter = Counter()
+        self.durations: List[float] = []
+
+    def add(self, media: Dict[str, Any]):
+        media_type = media.get("media_type") or "UNKNOWN"
+        self.media_counts[media_type] = self.media_counts.get(media_type, 0) + 1
+
+        day = _media_date(media)
+        if day is not None:
+            self.count_per_day[day] += 1
+
+        duration = _media_duration(media)
+        if duration is not None:
+            self.durations.append(duration)
+
+    def results(self) -> Dict[str, Any]:
+        logger.info(f"Conteggio media types: {self.media_counts}")
+        return {
+            'media_counts': dict(self.media_counts),
+            'frequency_stats': frequency_report(self.count_per_day, self.since, self.until),
+            'duration_stats': duration_stats(self.durations),
+        }
+
+def build_report_text(results: Dict[str, Any], client_name: str, since: str, until: str) -> str:
+    """
+    Testo del report integrato a partire dai risultati di integrated_analysis.
+    """
+    report_text = (
+        f"Report Analisi integrate per {client_name} da {since} a {until}:\n\n"
+        f"{results['frequency_stats']['report_text']}\n"
+        f"Durata media reel/video: {results['duration_stats']['average_duration_seconds']:.2f} secondi\n"
+        f"Conteggio media types:\n"
+    )
+    for media_type, count in results['media_counts'].items():
+        report_text += f" - {media_type}: {count}\n"
+    return report_text
+
+def save_analysis(results: Dict[str, Any], client_name: str, since: str, until: str) -> None:
+    """
+    Salva i risultati dell'analisi (JSON in media/{client_name}/) e il report testuale (output/{client_name}/).
+    """
+    save_media_as_json(results, client_name, since, until, output_path=f"media/{client_name}/analysis_results_{since}_{until}.json")
+    logger.info("Salvataggio file JSON completato.")
+
+    save_text_report(build_report_text(results, client_name, since, until), client_name, since, until, "integrated_analysis_report")
+    logger.info("Salvataggio report testuale completato.")
+
+def integrated_analysis(media_list: List[Dict[str, Any]], since: str, until: str, client_name: str,
+                        persist: bool = True) -> Dict[str, Any]:
+    """
+    Calcola le statistiche integrate del periodo.
+    Con persist=False i risultati non vengono salvati: se ne occupa chi chiama (src/pipeline.py, save_analysis).
+    """
     logger.info(f"Avvio analisi integrate per cliente {client_name} da {since} a {until}.")
     results = {}
 
@@ -209,28 +294,13 @@ def integrated_analysis(media_list: List[Dict[str, Any]], since: str, until: str
         logger.info(f"Statistiche durata media reel/video: {duration_stats}")
         results['duration_stats'] = duration_stats
 
-        save_media_as_json(results, client_name, since, until, output_path=f"media/{client_name}/analysis_results_{since}_{until}.json")
-
-        logger.info("Salvataggio file JSON completato.")
-
         analyzed_media = analyze_media(media_list)
 
         # Stampare a console l'input della funzione (media_list)
         print(f"\n[DEBUG] Input media_list (prima dell'analisi dettagliata):\n{json.dumps(media_list, indent=2, ensure_ascii=False)}\n")
 
-        
-
-        report_text = (
-            f"Report Analisi integrate per {client_name} da {since} a {until}:\n\n"
-            f"{freq_stats['report_text']}\n"
-            f"Durata media reel/video: {duration_stats['average_duration_seconds']:.2f} secondi\n"
-            f"Conteggio media types:\n"
-        )
-        for media_type, count in media_counts.items():
-            report_text += f" - {media_type}: {count}\n"
-
-        save_text_report(report_text, client_name, since, until, "integrated_analysis_report")
-        logger.info("Salvataggio report testuale completato.")
+        if persist:
+            save_analysis(results, client_name, since, until)
 
         logger.info("Analisi integrate completate con successo.")
         return results
@@ -239,32 +309,32 @@ def integrated_analysis(media_list: List[Dict[str, Any]], since: str, until: str
         logger.error(f"Errore durante l'analisi integrata: {e}", exc_info=True)
         return {}
 
-def run_analysis(client_name: str, since: str, until: str) -> None:
-
-    
-
+def run_analysis(client_name: str, since: str, until: str, media: List[Dict[str, Any]] = None,
+                 persist: bool = True) -> Dict[str, Any]:
+    """
+    Esegue lo Step 4. Se 'media' è fornito (output di step3 in memoria) raw_media non viene riletto da disco.
+    :return: risultati dell'analisi integrata ({} se non c'è nulla da analizzare).
+    """
     logger.info(f"Inizio run_analysis per cliente {client_name} da {since} a {until}.")
-    file_path = os.path.join(MEDIA_DIR, client_name, f"raw_media_{since}_{until}.json")
-    if not os.path.exists(file_path):
-        logger.error(f"File non trovato: {file_path}")
-        print(f"[❌] File non trovato: {file_path}")
-        return
-
-    with open(file_path, "r", encoding="utf-8") as f:
-        media = json.load(f)
+    if media is None:
+        file_path = os.path.join(MEDIA_DIR, client_name, f"raw_media_{since}_{until}.json")
+        if not os.path.exists(file_path):
+            logger.error(f"File non trovato: {file_path}")
+            print(f"[❌] File non trovato: {file_path}")
+            return {}
 
-    # Salvataggio raw media_list come JSON in media/{client_name}/
-    save_media_as_json(media, client_name, since, until)
-    logger.info(f"Salvato JSON raw media in media/{client_name}/raw_media_{since}_{until}.json")
+        with open(file_path, "r", encoding="utf-8") as f:
+            media = json.load(f)
 
     if not media:
         logger.warning(f"Nessun contenuto da analizzare per {client_name}.")
         print(f"[⚠️] Nessun contenuto da analizzare per {client_name}.")
-        return
+        return {}
 
-    integrated_analysis(media, since, until, client_name)
+    results = integrated_analysis(media, since, until, client_name, persist=persist)
     logger.info(f"Analisi completata per {client_name}. Report salvato.")
     print(f"[✅] Analisi completata per {client_name}. Report salvato.")
+    return results
 
 def main():
     parser = argparse.ArgumentParser()
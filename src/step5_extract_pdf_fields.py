@@ -1,8 +1,10 @@
 import csv
+import heapq
 import json
 import os
 import sys
 from datetime import datetime
+from typing import Any, Dict, List, Tuple
 from utils.logger import get_logger, log_exceptions
 
 logger = get_logger(__name__)
@@ -20,27 +22,105 @@ def safe_float(val):
         return 0.0
 
 
+def pdf_fields_path(client_name: str, since: str, until: str, catalogue: bool = False) -> str:
+    """
+    Percorso del JSON con i campi PDF condiviso dagli step 5-8.
+    """
+    suffix = "catalogue" if catalogue else "with_images"
+    return os.path.join("output", client_name, f"pdf_fields_{since}_{until}_{suffix}.json")
+
+
+def select_media_urls(entry: Dict[str, Any]) -> Tuple[str, str]:
+    """
+    media_url e thumbnail_url da usare per un post raw_media.
+    Per i caroselli si usa il primo child con media_url (con la sua thumbnail se è un video).
+    """
+    media_url = entry.get("media_url", "")  # default preso dal post
+    thumbnail_url = entry.get("thumbnail_url", "")  # presente solo per i video
+
+    if entry.get("media_type") == "CAROUSEL_ALBUM":
+        for child in entry.get("children", []):
+            if child.get("media_url"):
+                logger.info(f"Carosello {entry.get('media_id')} - Primo media_url valido trovato: {child['media_url']}")
+                # Per i children video serve la thumbnail, per le immagini non c'è
+                return child["media_url"], child.get("thumbnail_url") or ""
+        logger.info(f"Carosello {entry.get('media_id')} - Nessun media_url valido trovato nei children, uso media_url originale.")
+    return media_url, thumbnail_url
+
+
+class TopPostsRanker:
+    """
+    Classifica incrementale dei post per step5: mantiene solo i top_n record raw_media per quality_score
+    (heap di dimensione top_n) mentre step3 li recupera. A parità di punteggio vince il post arrivato prima,
+    come con l'ordinamento stabile di extract_top_posts. Con catalogue=True tiene tutti i post.
+
+    Esempio:
+        ranker = TopPostsRanker(3)
+        for media in iter_media_complete_data(...):
+            if ranker.add(media):
+                ...  # il post è (per ora) tra i primi top_n
+        extract_top_posts(..., raw_data=ranker.selected())
+    """
+
+    def __init__(self, top_n: int = 3, catalogue: bool = False):
+        self.top_n = top_n
+        self.catalogue = catalogue
+        self._heap: List[Tuple[float, int, Dict[str, Any]]] = []
+        self._count = 0
+
+    def add(self, entry: Dict[str, Any]) -> bool:
+        """
+        Aggiunge un record; True se è entrato in classifica.
+        """
+        self._count += 1
+        # -count: a parità di punteggio il primo a uscire dall'heap è l'ultimo arrivato
+        item = (safe_float(entry.get("quality_score", 0)), -self._count, entry)
+        if self.catalogue or len(self._heap) < self.top_n:
+            heapq.heappush(self._heap, item)
+            return True
+        if item[:2] > self._heap[0][:2]:
+            heapq.heapreplace(self._heap, item)
+            return True
+        return False
+
+    def selected(self) -> List[Dict[str, Any]]:
+        """
+        Record in classifica, nell'ordine di arrivo.
+        """
+        return [entry for _, _, entry in sorted(self._heap, key=lambda item: -item[1])]
+
 
 @log_exceptions
-def extract_top_posts(client_name: str, since: str, until: str, top_n: int = 3):
+def extract_top_posts(client_name: str, since: str, until: str, top_n: int = 3, catalogue: bool = False,
+                      raw_data=None, persist: bool = True, confirm: bool = True):
+    """
+    Estrae i campi per il PDF dai post del periodo.
+    Di default seleziona i top_n post per quality_score; con catalogue=True estrae tutti i post
+    in ordine cronologico in pdf_fields_{since}_{until}_catalogue.json (catalogo completo, step8).
+    Se raw_data è fornito (media di step3 in memoria) raw_media non viene riletto da disco;
+    con persist=False il JSON dei campi PDF non viene scritto (lo scrive src/pipeline.py).
+    Con confirm=False non chiede conferma dei campi (esecuzioni non interattive, batch.py).
+    :return: lista dei campi PDF dei post selezionati.
+    """
     input_json_path = os.path.join("media", client_name, f"raw_media_{since}_{until}.json")
-    output_json_path = os.path.join("output", client_name, f"pdf_fields_{since}_{until}_with_images.json")
+    output_json_path = pdf_fields_path(client_name, since, until, catalogue)
 
-    logger.info(f"Verifico esistenza file JSON raw_media: {input_json_path}")
-    if not os.path.exists(input_json_path):
-        logger.error(f"File JSON raw_media non trovato: {input_json_path}")
-        logger.error("Assicurati che il file JSON raw_media venga generato correttamente dallo step precedente.")
-        return
+    if raw_data is None:
+        logger.info(f"Verifico esistenza file JSON raw_media: {input_json_path}")
+        if not os.path.exists(input_json_path):
+            logger.error(f"File JSON raw_media non trovato: {input_json_path}")
+            logger.error("Assicurati che il file JSON raw_media venga generato correttamente dallo step precedente.")
+            return
 
-    with open(input_json_path, 'r', encoding="utf-8") as jsonfile:
-        try:
-            raw_data = json.load(jsonfile)
-            entry_by_media_id = {e.get("media_id"): e for e in raw_data}
+        with open(input_json_path, 'r', encoding="utf-8") as jsonfile:
+            try:
+                raw_data = json.load(jsonfile)
+                logger.info(f"Caricati {len(raw_data)} post dal file JSON raw_media")
+            except Exception as e:
+                logger.error(f"Errore nel parsing del file JSON: {e}")
+                return
 
-            logger.info(f"Caricati {len(raw_data)} post dal file JSON raw_media")
-        except Exception as e:
-            logger.error(f"Errore nel parsing del file JSON: {e}")
-            return
+    entry_by_media_id = {e.get("media_id"): e for e in raw_data}
 
     posts = []
     for entry in raw_data:
@@ -52,6 +132,7 @@ def extract_top_posts(client_name: str, since: str, until: str, top_n: int = 3):
                 "quality_score": safe_float(entry.get("quality_score", 0)),
                 "media_type": entry.get("media_type", ""),
                 "media_url": entry.get("media_url", ""),
+                "thumbnail_url": entry.get("thumbnail_url", ""),
                 "caption": entry.get("caption", ""),
                 "reach": safe_int(entry.get("reach", 0)),
                 "saved": safe_int(entry.get("saved", 0)),
@@ -82,20 +163,26 @@ def extract_top_posts(client_name: str, since: str, until: str, top_n: int = 3):
     for i, post in enumerate(posts[:max_show], 1):
         logger.info(f"Post {i}: id={post.get('id')}, timestamp={post.get('timestamp')}, permalink={post.get('permalink')}, media_type={post.get('media_type')}")
 
-    prompt = "Vuoi proseguire con questi campi? (s = sì, n = no): "
-    logger.info(prompt)
-    risposta = input(prompt).strip().lower()
-    if risposta != 's':
-        logger.info("Processo interrotto dall'utente.")
-        sys.exit(0)
+    if confirm:
+        prompt = "Vuoi proseguire con questi campi? (s = sì, n = no): "
+        logger.info(prompt)
+        risposta = input(prompt).strip().lower()
+        if risposta != 's':
+            logger.info("Processo interrotto dall'utente.")
+            sys.exit(0)
+    logger.info("Continuo con l'estrazione top post...")
+
+    if catalogue:
+        # Catalogo: tutti i post, in ordine cronologico
+        top_posts = sorted(posts, key=lambda x: x['timestamp'])
+        image_prefix = "catalogue"
     else:
-        logger.info("Continuo con l'estrazione top post...")
-
-    # Ordina post per quality_score decrescente
-    sorted_posts = sorted(posts, key=lambda x: x['quality_score'], reverse=True)
+        # Ordina post per quality_score decrescente
+        sorted_posts = sorted(posts, key=lambda x: x['quality_score'], reverse=True)
 
-    # Seleziona i primi top_n post
-    top_posts = sorted_posts[:top_n]
+        # Seleziona i primi top_n post
+        top_posts = sorted_posts[:top_n]
+        image_prefix = "post"
 
     # Prepara dati per JSON
     top_posts_data = []
@@ -108,25 +195,12 @@ def extract_top_posts(client_name: str, since: str, until: str, top_n: int = 3):
             logger.warning(f"Timestamp non valido per post media_id {post['media_id']}: {post['timestamp']}, uso valore originale.")
             date_formatted = post['timestamp']
 
-        image_local_path = os.path.join("media", client_name, f"post_{idx}.jpg")
+        image_local_path = os.path.join("media", client_name, f"{image_prefix}_{idx}.jpg")
         logger.info(f"Assigning local_img_path for post {idx}: {image_local_path}")
 
-        media_url = post["media_url"]  # default preso dal post
-
         if post["media_type"] == "CAROUSEL_ALBUM":
-            children = entry.get("children", [])
-            logger.info(f"Post {idx} è un carosello con {len(children)} children, cerco primo media_url valido...")
-            first_media_url = None
-            for child in children:
-                url = child.get("media_url")
-                if url:
-                    first_media_url = url
-                    break
-            if first_media_url:
-                logger.info(f"Post {idx} - Primo media_url valido dal carosello trovato: {first_media_url}")
-                media_url = first_media_url
-            else:
-                logger.info(f"Post {idx} - Nessun media_url valido trovato nei children, uso media_url originale.")
+            logger.info(f"Post {idx} è un carosello con {len(entry.get('children', []))} children, cerco primo media_url valido...")
+        media_url, thumbnail_url = select_media_urls(entry or post)
 
         post_data = {
             "media_id": post["media_id"],
@@ -134,6 +208,7 @@ def extract_top_posts(client_name: str, since: str, until: str, top_n: int = 3):
             "permalink": post["permalink"],
             "media_type": post["media_type"],
             "media_url": media_url,
+            "thumbnail_url": thumbnail_url,
             "local_img_path": image_local_path,
             "quality_score": post["quality_score"],
             "caption": post["caption"][:100],
@@ -159,24 +234,30 @@ def extract_top_posts(client_name: str, since: str, until: str, top_n: int = 3):
 
         top_posts_data.append(post_data)
 
-    # Salva i dati in formato JSON solo nel file con suffisso _with_images.json
-    os.makedirs(os.path.dirname(output_json_path), exist_ok=True)
-    with open(output_json_path, 'w', encoding='utf-8') as json_file:
-        json.dump(top_posts_data, json_file, ensure_ascii=False, indent=2)
+    if persist:
+        # Salva i dati in formato JSON solo nel file con suffisso _with_images.json
+        os.makedirs(os.path.dirname(output_json_path), exist_ok=True)
+        with open(output_json_path, 'w', encoding='utf-8') as json_file:
+            json.dump(top_posts_data, json_file, ensure_ascii=False, indent=2)
+
+        if catalogue:
+            logger.info(f"Catalogo di {len(top_posts_data)} post salvato correttamente in {output_json_path}")
+        else:
+            logger.info(f"Top {len(top_posts_data)} post salvati correttamente in {output_json_path}")
 
-    logger.info(f"Top {len(top_posts_data)} post salvati correttamente in {output_json_path}")
+    return top_posts_data
 
 
 @log_exceptions
 def main():
     if len(sys.argv) < 4:
-        logger.error("Uso: python step5_extract_top_posts.py <client_name> <since> <until>")
+        logger.error("Uso: python step5_extract_top_posts.py <client_name> <since> <until> [--catalogue]")
         sys.exit(1)
     else:
         client_name = sys.argv[1]
         since = sys.argv[2]
         until = sys.argv[3]
-        extract_top_posts(client_name, since, until)
+        extract_top_posts(client_name, since, until, catalogue="--catalogue" in sys.argv)
 
 
 if __name__ == "__main__":
@@ -1,10 +1,14 @@
 import os
 import sys
 import json
+from concurrent.futures import Future, ThreadPoolExecutor
 from pathlib import Path
 from tqdm import tqdm
+from utils.frame_extractor import FFMPEG_WORKERS, FrameExtractor
 from utils.logger import get_logger, log_exceptions
-from utils.media_utils import download_file, extract_frame, get_carousel_first_image
+from utils.media_cache import media_key, shared_cache
+from utils.media_utils import MAX_CONNECTIONS_PER_HOST, get_carousel_first_image, host_slot, read_head
+from utils.url_refresher import refresh_records, update_raw_media
 
 logger = get_logger(__name__)
 
@@ -13,39 +17,131 @@ BASE_DIR = Path(__file__).resolve().parent.parent
 MEDIA_DIR = BASE_DIR / "media"
 OUTPUT_DIR = BASE_DIR / "output"
 
+# Thread per i download (i processi ffmpeg sono limitati da FrameExtractor)
+DOWNLOAD_WORKERS = 8
+
+
+def _fetch_media(cache, key, media_url, thumbnail_url, is_video, progress, extractor):
+    """
+    Eseguita nel pool di download. Scarica l'immagine direttamente in cache.
+    Per i video prova nell'ordine: thumbnail_url, poi i primi RANGE_READ_BYTES del video
+    (frame estratto dal FrameExtractor, viene restituito il Future così il thread torna
+    subito libero), e solo infine il download completo.
+    """
+    if not is_video:
+        with host_slot(media_url):
+            return cache.get_or_download(key, media_url, "original", progress=progress)
+
+    if thumbnail_url:
+        with host_slot(thumbnail_url):
+            path = cache.get_or_download(key, thumbnail_url, "thumbnail", ext=".jpg", progress=progress)
+        if path is not None:
+            logger.info(f"Usata la thumbnail per il video {key}, download del video evitato")
+            return path
+        logger.warning(f"Thumbnail non disponibile per il video {key}, provo con la lettura parziale")
+
+    with host_slot(media_url):
+        head = read_head(media_url)
+    if head and progress is not None:
+        with progress.get_lock():
+            progress.total = (progress.total or 0) + len(head)
+            progress.update(len(head))
+    return extractor.submit(key, head, fallback_url=media_url, progress=progress)
+
+
+def _is_video(post):
+    """
+    True se per il post serve un frame video, False per le immagini, None se il tipo non è gestito.
+    """
+    media_type = post.get("media_type")
+    if media_type == "IMAGE":
+        return False
+    if media_type == "CAROUSEL_ALBUM":
+        # Determina se è immagine o video dall'estensione di media_url:
+        # IMAGE scaricata come jpg, VIDEO scaricato come mp4 + estrazione frame
+        return not post.get("media_url", "").lower().endswith(('.jpg', '.jpeg', '.png'))
+    if media_type in ["VIDEO", "REEL"]:
+        return True
+    return None
+
+
+def prefetch_media(cache, post, progress=None):
+    """
+    Scarica in anticipo nella cache l'immagine (o la thumbnail del video) di un post nel formato di step5,
+    con le stesse chiavi usate da main(): quando step6 parte il media risulta già in cache.
+    Non estrae frame: i video senza thumbnail restano a step6.
+    :return: percorso in cache, oppure None.
+    """
+    media_url = post.get("media_url")
+    is_video = _is_video(post)
+    if not media_url or is_video is None:
+        return None
+    key = media_key(post)
+    if not is_video:
+        with host_slot(media_url):
+            return cache.get_or_download(key, media_url, "original", progress=progress)
+    thumbnail_url = post.get("thumbnail_url")
+    if thumbnail_url:
+        with host_slot(thumbnail_url):
+            return cache.get_or_download(key, thumbnail_url, "thumbnail", ext=".jpg", progress=progress)
+    return None
+
 
 # SCRIPT PRINCIPALE
 @log_exceptions
-def main(client_name, since, until, access_token):
+def main(client_name, since, until, access_token, catalogue=False, posts=None, raw_media=None, persist=True):
+    """
+    Scarica le immagini (o il primo frame dei video) dei post selezionati da step5.
+    I download avvengono in parallelo (DOWNLOAD_WORKERS thread, al massimo MAX_CONNECTIONS_PER_HOST
+    per host) con un'unica barra di avanzamento; l'estrazione dei frame si sovrappone ai download.
+    Per i video si usa la thumbnail o una lettura parziale, il video completo solo come ultima risorsa.
+    I file finiscono nella cache condivisa (utils/media_cache.py): local_img_path punta alla cache
+    e i media già scaricati in esecuzioni precedenti non vengono riscaricati.
+    Con catalogue=True lavora sul JSON del catalogo completo (pdf_fields_*_catalogue.json).
+    Con posts/raw_media (pipeline in memoria, src/pipeline.py) i JSON non vengono riletti da disco e,
+    con persist=False, nemmeno riscritti: i post vengono aggiornati in place e restituiti.
+    """
     logger.info(f"Esecuzione step6_prepare_images per {client_name} dal {since} al {until}")
 
-    client_output = OUTPUT_DIR / client_name
-    json_input = client_output / f"pdf_fields_{since}_{until}_with_images.json"
-    json_output = client_output / f"pdf_fields_{since}_{until}_with_images.json"
+    suffix = "catalogue" if catalogue else "with_images"
+    json_output = OUTPUT_DIR / client_name / f"pdf_fields_{since}_{until}_{suffix}.json"
 
-    if not json_input.exists():
-        logger.error(f"File JSON non trovato: {json_input}")
-        sys.exit(1)
+    if posts is None:
+        if not json_output.exists():
+            logger.error(f"File JSON non trovato: {json_output}")
+            sys.exit(1)
 
-    logger.info(f"Caricamento JSON input: {json_input}")
-    with open(json_input, encoding='utf-8') as f:
-        posts = json.load(f)
+        logger.info(f"Caricamento JSON input: {json_output}")
+        with open(json_output, encoding='utf-8') as f:
+            posts = json.load(f)
 
-    if not posts:
-        logger.warning("Nessun post trovato nel JSON.")
-        sys.exit(0)
+        if not posts:
+            logger.warning("Nessun post trovato nel JSON.")
+            sys.exit(0)
+    elif not posts:
+        logger.warning("Nessun post da preparare.")
+        return posts
 
     logger.info(f"Campi trovati: {', '.join(posts[0].keys())}")
 
     client_media_dir = MEDIA_DIR / client_name
     client_media_dir.mkdir(parents=True, exist_ok=True)
+    cache = shared_cache()
+
+    # Gli URL firmati del CDN scadono (parametro 'oe'): quelli scaduti o in scadenza vengono
+    # rinnovati prima dei download, senza dover rieseguire step3
+    pending = [post for post in posts if post.get("download_status") != "ok"]
+    _, fresh = refresh_records(pending, access_token)
+    update_raw_media(client_name, since, until, fresh, raw_data=raw_media)
 
     downloaded = []
     failed = []
     total_posts = len(posts)
 
+    prefix = "catalogue" if catalogue else "post"
+    jobs = []
     for idx, post in enumerate(posts, 1):
-        filename_base = f"post_{idx}"
+        filename_base = f"{prefix}_{idx}"
 
         # Salta i post già scaricati
         if post.get("download_status") == "ok" and Path(post.get("local_img_path", "")).exists():
@@ -61,7 +157,6 @@ def main(client_name, since, until, access_token):
             f"(media_type={media_type}, media_url={'presente' if media_url else 'mancante'}, "
             f"download_status={post.get('download_status', 'none')})"
         )
-        logger.debug(f"Progresso: {idx}/{total_posts} ({(idx / total_posts) * 100:.1f}%) completato")
 
         if not media_url:
             reason = "Nessun media_url presente"
@@ -70,54 +165,77 @@ def main(client_name, since, until, access_token):
             post["download_status"] = f"failed: {reason}"
             continue
 
-        local_img_path = client_media_dir / f"{filename_base}.jpg"
-        success = False
+        if media_type == "CAROUSEL_ALBUM":
+            logger.info(f"Carosello: media_url trovato: {media_url}")
 
-        if media_type == "IMAGE":
-            success = download_file(media_url, local_img_path)
+        is_video = _is_video(post)
+        if is_video is None:
+            failed.append({"media_id": filename_base, "reason": "Download fallito"})
+            post["download_status"] = "failed: Download fallito"
+            logger.info(f"Download fallito per post {filename_base}")
+            continue
 
-        elif media_type == "CAROUSEL_ALBUM":
-            if not media_url:
-                reason = "Carosello senza media_url"
-                logger.warning(f"{reason} per post {filename_base}")
-                failed.append({"media_id": filename_base, "reason": reason})
-                post["download_status"] = f"failed: {reason}"
-                continue
+        # Media già scaricati in esecuzioni precedenti (anche di altri periodi) vengono presi dalla cache
+        key = media_key(post)
+        if is_video:
+            cached = cache.get(key, "thumbnail") or cache.get(key, "frame")
+        else:
+            cached = cache.get(key, "original")
+        if cached is not None:
+            logger.info(f"Media già in cache per post {filename_base}: {cached}")
+        jobs.append((post, filename_base, media_url, key, is_video, cached))
 
-            logger.info(f"Carosello: media_url trovato: {media_url}")
+    to_download = [job for job in jobs if job[5] is None]
+    if to_download:
+        logger.info(
+            f"Download di {len(to_download)} media con {DOWNLOAD_WORKERS} thread "
+            f"(max {MAX_CONNECTIONS_PER_HOST} per host, {FFMPEG_WORKERS} estrazioni frame in parallelo)"
+        )
 
-            # Determina se è immagine o video da media_url (tipicamente l'informazione è in media_type)
-            # Consideriamo IMAGE scaricata come jpg, VIDEO o REEL scaricati come mp4 + estrazione frame
-            if media_type == "CAROUSEL_ALBUM" and media_url:
-                # Dato che media_type è CAROUSEL_ALBUM, per sicurezza riusiamo media_url ma controlliamo estensione semplice:
-                if media_url.lower().endswith(('.jpg', '.jpeg', '.png')):
-                    success = download_file(media_url, local_img_path)
-                else:
-                    local_video_path = client_media_dir / f"{filename_base}.mp4"
-                    logger.debug(f"Download video (carosello) in corso: {local_video_path}")
-                    if download_file(media_url, local_video_path):
-                        success = extract_frame(local_video_path, local_img_path)
-                        if success and local_video_path.exists():
-                            local_video_path.unlink()
-                            logger.debug(f"Video temporaneo rimosso: {local_video_path}")
-                    else:
-                        success = False
-
-
-
-        elif media_type in ["VIDEO", "REEL"]:
-            local_video_path = client_media_dir / f"{filename_base}.mp4"
-            logger.debug(f"Download video in corso: {local_video_path}")
-            if download_file(media_url, local_video_path):
-                success = extract_frame(local_video_path, local_img_path)
-                if success and local_video_path.exists():
-                    local_video_path.unlink()
-                    logger.debug(f"Video temporaneo rimosso: {local_video_path}")
-
-        
-        
-
-        if success:
+    def wait_result(future, filename_base):
+        try:
+            result = future.result()
+            if isinstance(result, Future):
+                # Video: il frame viene estratto mentre gli altri download continuano
+                result = result.result()
+            return result
+        except Exception as e:
+            logger.error(f"Errore durante il download del post {filename_base}: {e}")
+            return None
+
+    with ThreadPoolExecutor(max_workers=DOWNLOAD_WORKERS) as download_pool, \
+            FrameExtractor(cache) as extractor, \
+            tqdm(total=0, unit="B", unit_scale=True, unit_divisor=1024, desc="Download media",
+                 disable=not to_download) as progress:
+
+        def submit(job):
+            post, _, _, key, is_video, _ = job
+            return download_pool.submit(
+                _fetch_media, cache, key, post["media_url"], post.get("thumbnail_url"), is_video, progress, extractor
+            )
+
+        futures = {id(job): submit(job) for job in to_download}
+
+        # I risultati vengono raccolti nell'ordine dei post, mentre i download proseguono in background
+        results = {}
+        for job in jobs:
+            results[id(job)] = job[5] if job[5] is not None else wait_result(futures[id(job)], job[1])
+
+        # Download falliti (tipicamente 403 per URL firmato scaduto): URL rinnovati con una sola
+        # chiamata batch e un secondo tentativo solo per i media effettivamente aggiornati
+        retry = [job for job in to_download if results[id(job)] is None and job[0].get("media_id")]
+        if retry and access_token:
+            updated, fresh = refresh_records([job[0] for job in retry], access_token, force_ids=[job[0]["media_id"] for job in retry])
+            update_raw_media(client_name, since, until, fresh, raw_data=raw_media)
+            retry = [job for job in retry if str(job[0]["media_id"]) in updated]
+            futures = {id(job): submit(job) for job in retry}
+            for job in retry:
+                results[id(job)] = wait_result(futures[id(job)], job[1])
+
+    for job in jobs:
+        post, filename_base, _, _, _, _ = job
+        local_img_path = results[id(job)]
+        if local_img_path is not None:
             downloaded.append(filename_base)
             old_path = post.get("local_img_path")
             new_path = str(local_img_path.relative_to(BASE_DIR))
@@ -129,6 +247,8 @@ def main(client_name, since, until, access_token):
             post["download_status"] = "failed: Download fallito"
             logger.info(f"Download fallito per post {filename_base}")
 
+    cache.save()
+
     # Riepilogo finale
     logger.info("----- RIEPILOGO DOWNLOAD -----")
     logger.info(f"✅ Scaricati: {len(downloaded)} -> {', '.join(downloaded) if downloaded else 'Nessuno'}")
@@ -140,10 +260,13 @@ def main(client_name, since, until, access_token):
     else:
         logger.info("🎉 Nessun download fallito!")
 
-    with open(json_output, "w", encoding='utf-8') as f:
-        json.dump(posts, f, ensure_ascii=False, indent=4)
+    if persist:
+        with open(json_output, "w", encoding='utf-8') as f:
+            json.dump(posts, f, ensure_ascii=False, indent=4)
+
+        logger.info(f"✅ JSON aggiornato salvato: {json_output}")
 
-    logger.info(f"✅ JSON aggiornato salvato: {json_output}")
+    return posts
 
 
 prepare_images = main
@@ -151,10 +274,10 @@ prepare_images = main
 if __name__ == "__main__":
     from utils.token_utils import load_token
 
-    if len(sys.argv) != 4:
-        logger.error("Uso corretto: python step6_prepare_images.py <client_name> <since> <until>")
+    if len(sys.argv) not in (4, 5):
+        logger.error("Uso corretto: python step6_prepare_images.py <client_name> <since> <until> [--catalogue]")
         sys.exit(1)
 
     client_name, since, until = sys.argv[1], sys.argv[2], sys.argv[3]
     access_token = load_token()
-    main(client_name, since, until, access_token)
+    main(client_name, since, until, access_token, catalogue="--catalogue" in sys.argv)
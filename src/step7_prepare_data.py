@@ -2,91 +2,114 @@ import os
 import json
 from tqdm import tqdm
 from utils.logger import get_logger, log_exceptions
-from src.step6_prepare_images import download_file
+from utils.media_cache import media_key, shared_cache
+from utils.url_refresher import refresh_records, update_raw_media
 
 logger = get_logger(__name__)
 
 @log_exceptions
-def prepare_data(client_name, since, until):
+def prepare_data(client_name, since, until, catalogue=False, access_token=None, posts=None, raw_media=None, persist=True,
+                 confirm=True):
     """
     Carica il JSON con i dati post,
     scarica i media se confermato dall'utente,
     aggiorna i percorsi locali e salva JSON aggiornato.
+    Con catalogue=True usa il JSON del catalogo completo.
+    Con access_token gli URL firmati scaduti vengono rinnovati prima del download.
+    Con posts/raw_media (pipeline in memoria, src/pipeline.py) i JSON non vengono riletti da disco;
+    con persist=False il JSON aggiornato non viene riscritto.
+    Con confirm=False il download parte senza chiedere conferma (esecuzioni non interattive, batch.py).
     NON genera PDF.
+    :return: i post aggiornati, oppure False se non c'è nulla da scaricare o il download viene annullato.
     """
-    json_path = f"output/{client_name}/pdf_fields_{since}_{until}_with_images.json"
-    download_dir = f"media/{client_name}"
+    suffix = "catalogue" if catalogue else "with_images"
+    json_path = f"output/{client_name}/pdf_fields_{since}_{until}_{suffix}.json"
 
-    logger.info(f"Caricamento file JSON: {json_path}")
-    if not os.path.exists(json_path):
-        logger.error(f"File JSON non trovato: {json_path}")
-        return False
+    if posts is None:
+        logger.info(f"Caricamento file JSON: {json_path}")
+        if not os.path.exists(json_path):
+            logger.error(f"File JSON non trovato: {json_path}")
+            return False
 
-    with open(json_path, "r", encoding="utf-8") as f:
-        top_posts = json.load(f)
+        with open(json_path, "r", encoding="utf-8") as f:
+            top_posts = json.load(f)
+    else:
+        top_posts = posts
 
     if not isinstance(top_posts, list) or len(top_posts) == 0:
         logger.error("Nessun top post trovato nel JSON o formato errato (lista attesa).")
         return False
 
-    download_paths = [post.get("media_url") for post in top_posts if post.get("media_url")]
-    if not download_paths:
+    if access_token:
+        _, fresh = refresh_records(top_posts, access_token)
+        update_raw_media(client_name, since, until, fresh, raw_data=raw_media)
+
+    download_posts = [post for post in top_posts if post.get("media_url")]
+    if not download_posts:
         logger.warning("Nessun media da scaricare.")
         return False
 
     logger.info("📸 Media da scaricare:")
-    for i, path in enumerate(download_paths, 1):
-        logger.info(f"{i}. {path}")
+    for i, post in enumerate(download_posts, 1):
+        logger.info(f"{i}. {post['media_url']}")
 
-    risposta = input("Vuoi procedere con il download? (s/n): ").strip().lower()
-    if risposta != "s":
-        logger.info("Download annullato dall'utente.")
-        return False
+    if confirm:
+        risposta = input("Vuoi procedere con il download? (s/n): ").strip().lower()
+        if risposta != "s":
+            logger.info("Download annullato dall'utente.")
+            return False
 
-    os.makedirs(download_dir, exist_ok=True)
+    # I media sono condivisi con step6 tramite la cache: ogni file viene scaricato una sola volta
+    cache = shared_cache()
 
     downloaded_files = 0
     skipped_files = 0
 
-    for url in tqdm(download_paths, desc="Download media", unit="file"):
-        filename = os.path.basename(url.split("?")[0])
-        filepath = os.path.join(download_dir, filename)
-        if os.path.exists(filepath):
-            logger.info(f"File già presente, skip download: {filename}")
+    for post in tqdm(download_posts, desc="Download media", unit="file"):
+        url = post["media_url"]
+        key = media_key(post)
+        filepath = cache.get(key, "thumbnail") or cache.get(key, "frame") or cache.get(key, "original")
+        if filepath is not None:
+            logger.info(f"File già presente in cache, skip download: {filepath.name}")
             skipped_files += 1
         else:
-            tqdm.write(f"⬇ Downloading: {filename}")
+            tqdm.write(f"⬇ Downloading: {key}")
             try:
-                success = download_file(url, filepath)
-                if success:
-                    logger.debug(f"Scaricato {filename}")
+                filepath = cache.get_or_download(key, url, "original")
+                if filepath is not None:
+                    logger.debug(f"Scaricato {filepath}")
                     downloaded_files += 1
                 else:
                     logger.warning(f"Download fallito per {url}")
             except Exception as e:
                 logger.error(f"Errore durante download di {url}: {e}")
+                filepath = None
+
+        # Aggiorna local_img_path del post se non punta già a un file esistente
+        local_img_path = post.get("local_img_path")
+        if filepath is not None and (not local_img_path or not os.path.exists(local_img_path)):
+            if filepath.suffix.lower() in (".jpg", ".jpeg", ".png"):
+                post["local_img_path"] = os.path.relpath(filepath)
 
-        # Aggiorna local_img_path nel post corrispondente
-        for post in top_posts:
-            if post.get("local_img_path") == url:
-                post["local_img_path"] = filepath
+    cache.save()
 
-    with open(json_path, "w", encoding="utf-8") as f:
-        json.dump(top_posts, f, ensure_ascii=False, indent=4)
-    logger.info("JSON aggiornato con i percorsi locali delle immagini.")
+    if persist:
+        with open(json_path, "w", encoding="utf-8") as f:
+            json.dump(top_posts, f, ensure_ascii=False, indent=4)
+        logger.info("JSON aggiornato con i percorsi locali delle immagini.")
     logger.info(f"Download completato: {downloaded_files} file scaricati, {skipped_files} file saltati.")
 
-    return True
+    return top_posts
 
 
 if __name__ == "__main__":
     import sys
-    if len(sys.argv) != 4:
-        logger.error("Usage: python src/step7_prepare_data.py <client_name> <since> <until>")
+    if len(sys.argv) not in (4, 5):
+        logger.error("Usage: python src/step7_prepare_data.py <client_name> <since> <until> [--catalogue]")
         logger.info("Example: python src/step7_prepare_data.py 55Bijoux 2025-07-01 2025-07-25")
         sys.exit(1)
 
     client_name = sys.argv[1]
     since = sys.argv[2]
     until = sys.argv[3]
-    prepare_data(client_name, since, until)
+    prepare_data(client_name, since, until, catalogue="--catalogue" in sys.argv)
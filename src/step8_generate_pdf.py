@@ -1,47 +1,55 @@
 import os
 import sys
 import json
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
-from PIL import Image
-from utils.pdf_utils import duplicate_template, add_text, add_hyperlink, add_image, save_pdf, register_font, PdfWriter
-from utils.pdf_utils import load_template
+from typing import Optional
+from utils.pdf_utils import add_template_page, get_template_size, get_image_size, PageComposer, save_pdf, register_font, serialize_page, PdfWriter, StreamingPdfWriter
 
 from utils.logger import get_logger, log_exceptions
 
 logger = get_logger(__name__)
 
+TEMPLATE_PATH = "templates/template_post.pdf"
+
+
 @log_exceptions
-def generate_pdf(client_name, since, until):
+def generate_pdf(client_name, since, until, workers=1, posts=None):
     """
     Genera un PDF multipagina a partire dal JSON con i percorsi locali delle immagini già aggiornati.
     Headline: testo fisso "Analisi Contenuti", allineamento a sinistra, margine fisso 80 px.
+    Con workers > 1 (0 = tutti i core) le pagine vengono renderizzate in parallelo, vedi render_posts.
+    Se posts è fornito (pipeline in memoria, src/pipeline.py) il JSON non viene riletto da disco.
+    :return: percorso del PDF generato, oppure None.
     """
     json_path = f"output/{client_name}/pdf_fields_{since}_{until}_with_images.json"
     output_path = f"output/{client_name}/analisi_post_{since}_{until}.pdf"
-    template_path = "templates/template_post.pdf"
 
-    if not os.path.exists(json_path):
+    if posts is not None:
+        top_posts = posts
+    elif not os.path.exists(json_path):
         logger.error(f"File JSON non trovato: {json_path}")
         return
-
-    with open(json_path, "r", encoding="utf-8") as f:
-        top_posts = json.load(f)
+    else:
+        with open(json_path, "r", encoding="utf-8") as f:
+            top_posts = json.load(f)
 
     if not isinstance(top_posts, list) or len(top_posts) == 0:
         logger.error("Nessun top post trovato nel JSON o formato errato (lista attesa).")
         return
 
-    # Registra font disponibili
-    register_font("Montserrat-Regular", "fonts/Montserrat-Regular.ttf")
-    register_font("Montserrat-Bold", "fonts/Montserrat-Bold.ttf")
-
-    pdf_final = PdfWriter()
+    os.makedirs(f"output/{client_name}", exist_ok=True)
+    render_posts(top_posts[:3], output_path, workers=workers)
+    return output_path
 
-    template_pdf = load_template(template_path)
-    mediabox = template_pdf.pages[0].mediabox
-    page_width = float(mediabox.right) - float(mediabox.left)
-    page_height = float(mediabox.top) - float(mediabox.bottom)
 
+def compose_post_page(post, idx, page_height, require_image=True) -> Optional[PageComposer]:
+    """
+    Prepara tutte le operazioni di disegno della pagina di un post (headline, immagine, metriche, link).
+    Non tocca il PDF: restituisce il PageComposer da renderizzare, oppure None se l'immagine manca
+    e la pagina va saltata. Con require_image=False (catalogo) la pagina viene generata comunque.
+    """
     # Configurazioni headline fisse richieste
     headline_text = "Analisi Contenuti"
     uppercase = True
@@ -52,138 +60,305 @@ def generate_pdf(client_name, since, until):
     headline_x = 80  # margine fisso a sinistra
     headline_y = page_height - headline_size - 30  # posizione verticale calcolata
 
-    for idx, post in enumerate(top_posts[:3]):
-        pdf_page = duplicate_template(template_path, 1)
-        logger.info(f"Generata pagina {idx + 1} per post del {post.get('data', 'data sconosciuta')}")
+    # Tutti gli elementi della pagina vengono disegnati in un unico overlay
+    page = PageComposer()
 
-        title_text = headline_text.upper() if uppercase else headline_text
-
-        add_text(pdf_page, title_text, 0, (headline_x, headline_y), headline_font, headline_size, align=align, color=headline_color)
-
-        image_path = post.get("local_img_path")
-        if image_path and os.path.exists(image_path):
-            with Image.open(image_path) as img:
-                width_px, height_px = img.size
-
-            # Fisso percentuale altezza al 50%
-            perc_height = 50
-            height_pdf = page_height * (perc_height / 100)
-            width_pdf = (width_px / height_px) * height_pdf
-
-            # Fisso x a 80
-            x_pos = 80
-            # Calcolo y per centrare verticalmente
-            y_pos = (page_height - height_pdf) / 2
-
-            add_image(pdf_page, image_path, 0, (x_pos, y_pos), (width_pdf, height_pdf))
-
-            # Calcolo X per metriche (60px a destra immagine)
-            metrics_x = x_pos + width_pdf + 60
-
-            # Fisso la coordinata Y per testo metriche a 135
-            metrics_y = 135
-            logger.info(f"Coordinata Y per testo metriche impostata fissa a: {metrics_y}")
-
-            placeholder_positions = {
-                "metrics": {
-                    "x": metrics_x,
-                    "y": metrics_y,
-                    "width": 700,
-                    "height": 540,
-                    "font": "Montserrat-Regular",
-                    "size": 24,
-                    "line_height": 28,
-                    "color": (1, 1, 1)
-                }
-            }
-
-            pos_metrics = placeholder_positions["metrics"]
-            x_text = pos_metrics["x"]
-
-            # Format timestamp from YYYY-MM-DD to DD/MM/YYYY
-            timestamp_str = post.get('timestamp', '')
-            if timestamp_str:
-                try:
-                    dt = datetime.strptime(timestamp_str, "%Y-%m-%d")
-                    formatted_date = dt.strftime("%d/%m/%Y")
-                except Exception:
-                    formatted_date = timestamp_str  # se formato errato, lascia com’è
-            else:
-                formatted_date = ""
-
-            media_type = post.get("media_type", "").lower()
-
-            metrics_lines = [
-                f"Data: {formatted_date}",
-                f"Score: {post.get('quality_score', '')}",
-                f"Shares: {post.get('shares', 'N/A')}",
-                f"Reach: {post.get('reach', 'N/A')}",
-                f"Saved: {post.get('saved', 'N/A')}",
-            ]
-
-            if media_type != "image":
-                metrics_lines.append(f"Video views: {post.get('video_views', 'N/A')}")
-
-            metrics_lines.extend([
-                f"Like count: {post.get('like_count', 'N/A')}",
-                f"Comments count: {post.get('comments_count', 'N/A')}",
-                f"Total interactions: {post.get('total_interactions', 'N/A')}",
-                "Link al post"
-            ])
-
-            
-
-            total_text_height = len(metrics_lines) * pos_metrics["line_height"]
-            y_center = pos_metrics["y"] + pos_metrics["height"] / 2
-            y_start = y_center + total_text_height / 2 - pos_metrics["line_height"]
-
-            for i, line in enumerate(metrics_lines):
-                y = y_start - i * pos_metrics["line_height"]
-                if line == "Link al post":
-                    url = post.get('media_url', '')
-                    if url:
-                        add_hyperlink(
-                            pdf_page,
-                            line,
-                            0,
-                            (x_text, y),
-                            pos_metrics["font"],
-                            pos_metrics["size"],
-                            url,
-                            color=pos_metrics.get("color", (0, 0, 0)),
-                            underline=True
-                        )
-                        logger.info(f"Inserito link cliccabile pagina {idx + 1}: testo '{line}' in posizione ({x_text}, {y}), URL: {url}")
-                    else:
-                        add_text(pdf_page, line, 0, (x_text, y), pos_metrics["font"], pos_metrics["size"], color=pos_metrics.get("color", (0, 0, 0)))
-                        logger.warning(f"URL mancante per link cliccabile nel post {idx + 1}. Inserito solo testo '{line}'.")
-                else:
-                    add_text(pdf_page, line, 0, (x_text, y), pos_metrics["font"], pos_metrics["size"], color=pos_metrics.get("color", (0, 0, 0)))
-                    logger.info(f"Inserito testo metriche pagina {idx + 1}: '{line}' in posizione ({x_text}, {y})")
+    title_text = headline_text.upper() if uppercase else headline_text
+
+    page.add_text(title_text, (headline_x, headline_y), headline_font, headline_size, align=align, color=headline_color)
 
+    image_path = post.get("local_img_path")
+    if image_path and os.path.exists(image_path):
+        width_px, height_px = get_image_size(image_path)
+
+        # Fisso percentuale altezza al 50%
+        perc_height = 50
+        height_pdf = page_height * (perc_height / 100)
+        width_pdf = (width_px / height_px) * height_pdf
+
+        # Fisso x a 80
+        x_pos = 80
+        # Calcolo y per centrare verticalmente
+        y_pos = (page_height - height_pdf) / 2
+
+        page.add_image(image_path, (x_pos, y_pos), (width_pdf, height_pdf))
+    elif require_image:
+        logger.warning(f"Immagine mancante o non trovata per post {idx + 1}: {image_path}")
+        logger.info(f"Salto inserimento immagine pagina {idx + 1} per mancanza file.")
+        return None
+    else:
+        # Modalità catalogo: la pagina viene comunque generata, solo con le metriche
+        logger.warning(f"Immagine mancante per post {idx + 1}: pagina generata senza immagine.")
+        x_pos = 80
+        width_pdf = 0
+
+    # Calcolo X per metriche (60px a destra immagine)
+    metrics_x = x_pos + width_pdf + 60
+
+    # Fisso la coordinata Y per testo metriche a 135
+    metrics_y = 135
+    logger.info(f"Coordinata Y per testo metriche impostata fissa a: {metrics_y}")
+
+    placeholder_positions = {
+        "metrics": {
+            "x": metrics_x,
+            "y": metrics_y,
+            "width": 700,
+            "height": 540,
+            "font": "Montserrat-Regular",
+            "size": 24,
+            "line_height": 28,
+            "color": (1, 1, 1)
+        }
+    }
+
+    pos_metrics = placeholder_positions["metrics"]
+    x_text = pos_metrics["x"]
+
+    # Format timestamp from YYYY-MM-DD to DD/MM/YYYY
+    timestamp_str = post.get('timestamp', '')
+    if timestamp_str:
+        try:
+            dt = datetime.strptime(timestamp_str, "%Y-%m-%d")
+            formatted_date = dt.strftime("%d/%m/%Y")
+        except Exception:
+            formatted_date = timestamp_str  # se formato errato, lascia com’è
+    else:
+        formatted_date = ""
+
+    media_type = post.get("media_type", "").lower()
+
+    metrics_lines = [
+        f"Data: {formatted_date}",
+        f"Score: {post.get('quality_score', '')}",
+        f"Shares: {post.get('shares', 'N/A')}",
+        f"Reach: {post.get('reach', 'N/A')}",
+        f"Saved: {post.get('saved', 'N/A')}",
+    ]
+
+    if media_type != "image":
+        metrics_lines.append(f"Video views: {post.get('video_views', 'N/A')}")
+
+    metrics_lines.extend([
+        f"Like count: {post.get('like_count', 'N/A')}",
+        f"Comments count: {post.get('comments_count', 'N/A')}",
+        f"Total interactions: {post.get('total_interactions', 'N/A')}",
+        "Link al post"
+    ])
+
+    total_text_height = len(metrics_lines) * pos_metrics["line_height"]
+    y_center = pos_metrics["y"] + pos_metrics["height"] / 2
+    y_start = y_center + total_text_height / 2 - pos_metrics["line_height"]
+
+    for i, line in enumerate(metrics_lines):
+        y = y_start - i * pos_metrics["line_height"]
+        if line == "Link al post":
+            url = post.get('media_url', '')
+            if url:
+                page.add_hyperlink(
+                    line,
+                    (x_text, y),
+                    pos_metrics["font"],
+                    pos_metrics["size"],
+                    url,
+                    color=pos_metrics.get("color", (0, 0, 0)),
+                    underline=True
+                )
+                logger.info(f"Inserito link cliccabile pagina {idx + 1}: testo '{line}' in posizione ({x_text}, {y}), URL: {url}")
+            else:
+                page.add_text(line, (x_text, y), pos_metrics["font"], pos_metrics["size"], color=pos_metrics.get("color", (0, 0, 0)))
+                logger.warning(f"URL mancante per link cliccabile nel post {idx + 1}. Inserito solo testo '{line}'.")
         else:
-            logger.warning(f"Immagine mancante o non trovata per post {idx + 1}: {image_path}")
-            logger.info(f"Salto inserimento immagine pagina {idx + 1} per mancanza file.")
+            page.add_text(line, (x_text, y), pos_metrics["font"], pos_metrics["size"], color=pos_metrics.get("color", (0, 0, 0)))
+            logger.info(f"Inserito testo metriche pagina {idx + 1}: '{line}' in posizione ({x_text}, {y})")
+
+    return page
+
+
+def register_report_fonts():
+    """
+    Registra i font usati nel report.
+    """
+    register_font("Montserrat-Regular", "fonts/Montserrat-Regular.ttf")
+    register_font("Montserrat-Bold", "fonts/Montserrat-Bold.ttf")
+
+
+def _render_post_page(task):
+    """
+    Compone la pagina di un post, la unisce allo sfondo del template in un PdfWriter temporaneo
+    e la restituisce già serializzata (serialize_page), oppure None se la pagina va saltata.
+    Eseguita nei processi del pool: al processo principale resta solo la scrittura dei byte.
+    """
+    post, idx, page_height, template_path, require_image = task
+    page = compose_post_page(post, idx, page_height, require_image=require_image)
+    if page is None:
+        return None
+    page_writer = PdfWriter()
+    page_index = add_template_page(page_writer, template_path)
+    page.render(page_writer, page_index)
+    return serialize_page(page_writer.pages[page_index])
+
+
+def _render_pages_parallel(posts, page_height, workers, template_path, require_image=True):
+    """
+    Renderizza le pagine di tutti i post in un pool di processi.
+    Restituisce un generatore di (idx, pagina serializzata) nello stesso ordine dei post.
+    In volo restano al massimo workers * 4 pagine: appena la più vecchia è pronta e viene scritta,
+    ne viene inviata un'altra, così il pool non resta fermo e la memoria non cresce con le pagine.
+    """
+    max_workers = workers or os.cpu_count() or 1
+    window = max_workers * 4
+    logger.info(f"Rendering parallelo con {max_workers} processi (al massimo {window} pagine in volo)")
+    with ProcessPoolExecutor(max_workers=max_workers, initializer=register_report_fonts) as executor:
+        pending = deque()
+        for idx, post in enumerate(posts):
+            pending.append((idx, executor.submit(_render_post_page, (post, idx, page_height, template_path, require_image))))
+            if len(pending) >= window:
+                done_idx, future = pending.popleft()
+                yield done_idx, future.result()
+        while pending:
+            done_idx, future = pending.popleft()
+            yield done_idx, future.result()
+
+
+def _write_pages(pages, output_path) -> int:
+    """
+    Scrive su disco, nell'ordine ricevuto, le pagine serializzate (None = pagina saltata).
+    Se non c'è nessuna pagina il PDF non viene creato.
+    :return: numero di pagine scritte.
+    """
+    writer = StreamingPdfWriter(output_path)
+    try:
+        for idx, page in pages:
+            if page is None:
+                continue
+            writer.add_serialized_page(page)
+            logger.info(f"Aggiunta pagina {idx + 1} al PDF finale.")
+    except BaseException:
+        writer.abort()
+        raise
+    if not len(writer):
+        writer.abort()
+        logger.warning("PDF non generato: nessuna pagina creata.")
+        return 0
+    writer.close()
+    return len(writer)
+
+
+def render_posts(posts, output_path, template_path=TEMPLATE_PATH, workers=1) -> int:
+    """
+    Renderizza una pagina per ogni post della lista e salva il PDF in output_path.
+    Separata da generate_pdf per poter essere riusata (es. benchmark) senza passare dal JSON.
+    Con workers > 1 (0 = tutti i core) ogni pagina (sfondo, overlay e merge) viene costruita e
+    serializzata in un pool di processi; il processo principale scrive solo i byte su disco
+    (StreamingPdfWriter), nell'ordine dei post.
+    :return: numero di pagine generate.
+    """
+    # Registra font disponibili
+    register_report_fonts()
+
+    page_width, page_height = get_template_size(template_path)
+
+    if workers != 1 and len(posts) > 1:
+        pages = _write_pages(_render_pages_parallel(posts, page_height, workers, template_path), output_path)
+        if pages:
+            logger.info(f"PDF multipagina generato con {pages} pagine: {output_path}")
+        return pages
+
+    pdf_final = PdfWriter()
+
+    for idx, post in enumerate(posts):
+        logger.info(f"Generata pagina {idx + 1} per post del {post.get('data', 'data sconosciuta')}")
+
+        page = compose_post_page(post, idx, page_height)
+        if page is None:
             continue
 
-        pdf_final.add_page(pdf_page.pages[0])
+        # Lo sfondo è un form XObject condiviso: la pagina lo referenzia senza copiarlo
+        page_index = add_template_page(pdf_final, template_path)
+        page.render(pdf_final, page_index)
         logger.info(f"Aggiunta pagina {idx + 1} al PDF finale.")
 
     if pdf_final.pages:
-        os.makedirs(f"output/{client_name}", exist_ok=True)
         save_pdf(pdf_final, output_path)
         logger.info(f"PDF multipagina generato con {len(pdf_final.pages)} pagine: {output_path}")
     else:
         logger.warning("PDF non generato: nessuna pagina creata.")
 
+    return len(pdf_final.pages)
+
+
+@log_exceptions
+def generate_catalogue(client_name, since, until, workers=1, posts=None):
+    """
+    Genera il catalogo completo del periodo: una pagina per ogni post (non solo i top 3),
+    in ordine cronologico, a partire da pdf_fields_{since}_{until}_catalogue.json (step5 con catalogue=True).
+    Le pagine vengono scritte su disco man mano, vedi render_catalogue.
+    Se posts è fornito (pipeline in memoria, src/pipeline.py) il JSON non viene riletto da disco.
+    :return: percorso del catalogo generato, oppure None.
+    """
+    json_path = f"output/{client_name}/pdf_fields_{since}_{until}_catalogue.json"
+    output_path = f"output/{client_name}/catalogo_post_{since}_{until}.pdf"
+
+    if posts is None:
+        if not os.path.exists(json_path):
+            logger.error(f"File JSON catalogo non trovato: {json_path}")
+            return
+
+        with open(json_path, "r", encoding="utf-8") as f:
+            posts = json.load(f)
+
+    if not isinstance(posts, list) or len(posts) == 0:
+        logger.error("Nessun post trovato nel JSON del catalogo o formato errato (lista attesa).")
+        return
+
+    os.makedirs(f"output/{client_name}", exist_ok=True)
+    render_catalogue(posts, output_path, workers=workers)
+    return output_path
+
+
+def render_catalogue(posts, output_path, template_path=TEMPLATE_PATH, workers=1) -> int:
+    """
+    Renderizza una pagina per ogni post scrivendo il PDF in modo progressivo (StreamingPdfWriter):
+    ogni pagina viene composta e serializzata in un PdfWriter temporaneo (nei processi del pool con
+    workers != 1), scritta su disco e poi rilasciata, così la memoria resta costante anche con migliaia di post.
+    I post senza immagine non vengono saltati: la pagina contiene solo le metriche.
+    'posts' può essere anche un generatore.
+    :return: numero di pagine generate.
+    """
+    register_report_fonts()
+
+    page_width, page_height = get_template_size(template_path)
+
+    if workers != 1:
+        pages = _render_pages_parallel(posts, page_height, workers, template_path, require_image=False)
+    else:
+        pages = (
+            (idx, _render_post_page((post, idx, page_height, template_path, False)))
+            for idx, post in enumerate(posts)
+        )
+
+    with StreamingPdfWriter(output_path) as catalogue:
+        for idx, page in pages:
+            catalogue.add_serialized_page(page)
+            logger.info(f"Aggiunta pagina {idx + 1} al catalogo.")
+
+    logger.info(f"Catalogo PDF generato con {len(catalogue)} pagine: {output_path}")
+    return len(catalogue)
+
 
 if __name__ == "__main__":
-    if len(sys.argv) != 4:
-        logger.error("Usage: python src/step8_generate_pdf.py <client_name> <since> <until>")
-        logger.info("Example: python src/step8_generate_pdf.py 55Bijoux 2025-07-01 2025-07-25")
+    args = [arg for arg in sys.argv[1:] if arg != "--catalogue"]
+    if len(args) not in (3, 4):
+        logger.error("Usage: python src/step8_generate_pdf.py <client_name> <since> <until> [workers] [--catalogue]")
+        logger.info("Example: python src/step8_generate_pdf.py 55Bijoux 2025-07-01 2025-07-25 4")
         sys.exit(1)
 
-    client_name = sys.argv[1]
-    since = sys.argv[2]
-    until = sys.argv[3]
-    generate_pdf(client_name, since, until)
+    client_name = args[0]
+    since = args[1]
+    until = args[2]
+    workers = int(args[3]) if len(args) == 4 else 1
+    if "--catalogue" in sys.argv:
+        generate_catalogue(client_name, since, until, workers)
+    else:
+        generate_pdf(client_name, since, until, workers)
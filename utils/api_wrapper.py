@@ -1,7 +1,11 @@
+import os
 import requests
+import threading
 import time
 from typing import Any, Dict, Optional
 
+from requests.adapters import HTTPAdapter
+
 from utils.logger import get_logger, log_exceptions
 
 # Istanzia il logger locale
@@ -12,6 +16,78 @@ TIMEOUT = 10  # secondi
 MAX_RETRIES = 3
 RETRY_DELAY = 2  # secondi tra i retry per errori transient
 
+# Connessioni HTTP riutilizzate verso graph.facebook.com (condivise da tutti i thread, es. batch.py)
+POOL_SIZE = 16
+
+# Budget di chiamate API al secondo condiviso da tutto il processo (0 = nessun limite),
+# sovrascrivibile con API_MAX_CALLS_PER_SECOND
+DEFAULT_MAX_CALLS_PER_SECOND = 10
+
+
+class RateLimiter:
+    """
+    Token bucket thread-safe: al massimo 'rate' chiamate al secondo, con raffiche fino a 'burst'.
+    acquire() attende finché non c'è un gettone disponibile.
+    """
+
+    def __init__(self, rate: float, burst: Optional[int] = None):
+        self.rate = rate
+        self.burst = burst or max(1, int(rate))
+        self._tokens = float(self.burst)
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        if self.rate <= 0:
+            return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+                self._last = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+def _build_session() -> requests.Session:
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+_SESSION = _build_session()
+rate_limiter = RateLimiter(float(os.getenv("API_MAX_CALLS_PER_SECOND", DEFAULT_MAX_CALLS_PER_SECOND)))
+
+
+def _limiter_for(token: Optional[str]) -> RateLimiter:
+    """
+    Budget di chiamate da usare: quello dell'app del token se fa parte del pool (utils/token_pool.py),
+    altrimenti quello globale.
+    """
+    if not token:
+        return rate_limiter
+    from utils.token_pool import shared_token_pool
+    return shared_token_pool().limiter_for(token) or rate_limiter
+
+
+def _observe(token: Optional[str], response: requests.Response, error: Optional[Dict[str, Any]] = None):
+    """
+    Passa al pool di token gli header di utilizzo e l'eventuale errore della risposta.
+    """
+    if not token:
+        return
+    from utils.token_pool import shared_token_pool
+    shared_token_pool().observe(token, response.headers, error)
+    if error and error.get("code") == 190:
+        # Token revocato o scaduto: l'esito in cache di utils/token_manager.py non vale più
+        from utils.token_manager import shared_token_manager
+        shared_token_manager().forget(token)
+
 
 def handle_transient_error(data: Dict[str, Any], attempt: int, method: str) -> bool:
     """
@@ -41,8 +117,10 @@ def get(url: str, params: Optional[Dict[str, Any]] = None) -> Any:
     """
     for attempt in range(1, MAX_RETRIES + 1):
         logger.debug(f"Chiamata API: GET {url} params={params}")
+        token = (params or {}).get("access_token")
         try:
-            response = requests.get(url, params=params, timeout=TIMEOUT)
+            _limiter_for(token).acquire()
+            response = _SESSION.get(url, params=params, timeout=TIMEOUT)
         except requests.RequestException as e:
             logger.error(f"Errore nella chiamata API {url}: {e}")
             raise
@@ -55,8 +133,10 @@ def get(url: str, params: Optional[Dict[str, Any]] = None) -> Any:
                 error_data = response.json().get("error", {"message": response.text, "code": response.status_code})
             except Exception:
                 error_data = {"message": response.text, "code": response.status_code}
+            _observe(token, response, error_data)
             return {"error": error_data}
         
+        _observe(token, response)
         try:
             data = response.json()
         except ValueError as e:
@@ -82,8 +162,10 @@ def post(url: str, data: Optional[Dict[str, Any]] = None) -> Any:
     """
     for attempt in range(1, MAX_RETRIES + 1):
         logger.debug(f"Chiamata API: POST {url} data={data}")
+        token = (data or {}).get("access_token")
         try:
-            response = requests.post(url, json=data, timeout=TIMEOUT)
+            _limiter_for(token).acquire()
+            response = _SESSION.post(url, json=data, timeout=TIMEOUT)
         except requests.RequestException as e:
             logger.error(f"Errore nella chiamata API {url}: {e}")
             raise
@@ -96,8 +178,10 @@ def post(url: str, data: Optional[Dict[str, Any]] = None) -> Any:
                 error_data = response.json().get("error", {"message": response.text, "code": response.status_code})
             except Exception:
                 error_data = {"message": response.text, "code": response.status_code}
+            _observe(token, response, error_data)
             return {"error": error_data}
 
+        _observe(token, response)
         try:
             payload = response.json()
         except ValueError as e:
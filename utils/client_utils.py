@@ -1,43 +1,258 @@
 import os
 import json
-import difflib
+import threading
+from contextlib import contextmanager
 from datetime import datetime
+from typing import Any, Dict, List
 from utils.logger import get_logger
+from utils.name_index import NameIndex
 logger = get_logger(__name__)
 
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
 
 CLIENTI_JSON = "config/clienti.json"
+# Registro delle modifiche (una riga JSON per salvataggio), al posto della copia completa in backup_clienti/
+CLIENTI_JOURNAL = "config/clienti.journal.jsonl"
+# Indice a trigrammi dei nomi cliente (utils/name_index.py) per la ricerca di nomi simili
+CLIENT_NAMES_INDEX = "config/client_names_index.json"
+# Da incrementare quando cambia il modo di elencare i nomi: l'indice salvato viene riallineato
+CLIENT_NAMES_INDEX_VERSION = 2
 
-# 📥 Carica nomi cliente da /media e da clienti.json
-def load_client_names():
-    existing_dirs = set(os.listdir("media")) if os.path.exists("media") else set()
-    existing_clients = set()
 
-    if os.path.exists(CLIENTI_JSON):
-        with open(CLIENTI_JSON, "r", encoding="utf-8") as f:
+class ClientDataError(Exception):
+    """
+    clienti.json esiste ma non è leggibile: non si scrive, per non sostituirlo con i soli dati salvati ora.
+    """
+
+
+@contextmanager
+def file_lock(path: str):
+    """
+    Lock esclusivo tra processi (fcntl su Linux/macOS, msvcrt su Windows) sul file indicato.
+    """
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "a+") as f:
+        if fcntl:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        else:
+            f.seek(0)
+            while True:
+                try:
+                    msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    # LK_LOCK rinuncia dopo 10 secondi: si riprova finché il lock non si libera
+                    continue
+        try:
+            yield
+        finally:
+            if fcntl:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+class ClientRegistry:
+    """
+    Anagrafica clienti (config/clienti.json) letta una sola volta e tenuta in memoria: il file viene
+    riletto solo se è stato modificato da un altro processo (data di modifica o dimensione diverse).
+    Ogni salvataggio avviene sotto lock tra processi, rilegge il file (nessun aggiornamento perso tra
+    esecuzioni parallele; se non è leggibile il salvataggio fallisce con ClientDataError), lo riscrive in
+    modo atomico (file temporaneo + rename) e aggiunge una riga al registro delle modifiche (CLIENTI_JOURNAL).
+
+    Esempio:
+        registry = client_registry()
+        data = registry.get("55Bijoux")
+        registry.update("55Bijoux", {**data, "last_until": "2025-08-01"})
+    """
+
+    def __init__(self, path: str = CLIENTI_JSON, journal_path: str = CLIENTI_JOURNAL):
+        self.path = path
+        self.journal_path = journal_path
+        self._lock = threading.RLock()
+        self._data: Dict[str, Dict[str, Any]] = {}
+        self._signature = None
+
+    def signature(self):
+        """
+        (data di modifica, dimensione) di clienti.json, None se non esiste.
+        """
+        return self._file_signature()
+
+    def _file_signature(self):
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def _refresh(self, for_write: bool = False):
+        """
+        Rilegge clienti.json se è cambiato. Prima di una scrittura (for_write=True) lo rilegge sempre, sotto lock:
+        con date di modifica poco precise una scrittura concorrente della stessa dimensione non cambierebbe
+        la firma. Se il file non è leggibile le letture restano sui dati precedenti e le scritture falliscono
+        con ClientDataError.
+        """
+        signature = self._file_signature()
+        if signature == self._signature and not for_write:
+            return
+        data = {}
+        if signature is not None:
             try:
-                data = json.load(f)
-                existing_clients = set(data.keys())
-            except json.JSONDecodeError:
-                pass
+                with open(self.path, "r", encoding="utf-8") as f:
+                    data = json.load(f)
+                if not isinstance(data, dict):
+                    raise ValueError("il contenuto non è un oggetto JSON")
+            except (OSError, ValueError) as e:
+                logger.error(f"Errore leggendo {self.path}: {e}")
+                if for_write:
+                    raise ClientDataError(f"{self.path} non leggibile ({e}): salvataggio annullato") from e
+                return
+        self._data = data
+        self._signature = signature
+
+    def names(self) -> List[str]:
+        with self._lock:
+            self._refresh()
+            return list(self._data)
+
+    def get(self, client_name: str) -> Dict[str, Any]:
+        with self._lock:
+            self._refresh()
+            return dict(self._data.get(client_name, {}))
+
+    def all(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            self._refresh()
+            return {name: dict(entry) for name, entry in self._data.items()}
+
+    def update(self, client_name: str, entry: Dict[str, Any]) -> bool:
+        """
+        Salva i dati di un cliente. :return: True se il cliente esisteva già.
+        """
+        with self._lock, file_lock(f"{self.path}.lock"):
+            self._refresh(for_write=True)
+            existed = client_name in self._data
+            self._data[client_name] = dict(entry)
+            self._write()
+            self._journal(client_name, entry)
+            self._signature = self._file_signature()
+        return existed
+
+    def patch(self, client_name: str, changes: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Aggiorna solo alcune chiavi di un cliente (lette e scritte sotto lo stesso lock). :return: dati aggiornati.
+        """
+        with self._lock, file_lock(f"{self.path}.lock"):
+            self._refresh(for_write=True)
+            entry = {**self._data.get(client_name, {}), **changes}
+            self._data[client_name] = entry
+            self._write()
+            self._journal(client_name, entry)
+            self._signature = self._file_signature()
+        return dict(entry)
+
+    def _write(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self._data, f, indent=2, ensure_ascii=False)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+
+    def _journal(self, client_name: str, entry: Dict[str, Any]):
+        record = {"ts": datetime.now().isoformat(timespec="seconds"), "pid": os.getpid(),
+                  "client": client_name, "entry": entry}
+        try:
+            with open(self.journal_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        except OSError as e:
+            logger.warning(f"Errore scrivendo il registro modifiche clienti: {e}")
+
+
+_registries: Dict[str, ClientRegistry] = {}
+_registries_lock = threading.Lock()
+
+
+def client_registry(path: str = None) -> ClientRegistry:
+    """
+    Registro clienti condiviso da tutto il processo (uno per file).
+    """
+    path = path or CLIENTI_JSON
+    with _registries_lock:
+        if path not in _registries:
+            _registries[path] = ClientRegistry(path)
+        return _registries[path]
+
+
+_media_dirs = (None, set())
+_name_index = None
+_name_index_lock = threading.Lock()
+
+
+def _media_signature():
+    try:
+        return os.stat("media").st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+
+# 📥 Carica nomi cliente da /media e da clienti.json
+def load_client_names():
+    global _media_dirs
+    # La cartella media viene rielencata solo se è cambiata (aggiunta o rimozione di un cliente)
+    signature = _media_signature()
+    if signature != _media_dirs[0]:
+        # Le cartelle nascoste sono le cache condivise (media/.cache, media/.pdf_cache), non clienti
+        _media_dirs = (signature, {name for name in os.listdir("media") if not name.startswith(".")}
+                       if signature is not None else set())
+    existing_dirs = _media_dirs[1]
+    existing_clients = set(client_registry().names())
 
     return list(existing_dirs.union(existing_clients))
 
 
+def client_name_index() -> NameIndex:
+    """
+    Indice dei nomi cliente condiviso dal processo, salvato in CLIENT_NAMES_INDEX.
+    Viene riallineato (solo i nomi nuovi) quando clienti.json o la cartella media cambiano.
+    """
+    global _name_index
+    with _name_index_lock:
+        if _name_index is None:
+            _name_index = NameIndex(CLIENT_NAMES_INDEX)
+        sources = [CLIENT_NAMES_INDEX_VERSION, client_registry().signature(), _media_signature()]
+        if _name_index.meta.get("sources") != json.loads(json.dumps(sources)):
+            _name_index.sync(load_client_names())
+            _name_index.meta["sources"] = sources
+            _name_index.save()
+        return _name_index
+
+
 # 🔍 Trova nomi simili a quello inserito
-def find_similar_names(input_name, all_names, cutoff=0.6):
-    matches = difflib.get_close_matches(input_name.lower(), [n.lower() for n in all_names], n=5, cutoff=cutoff)
-    results = []
-    for match in matches:
-        similarity = difflib.SequenceMatcher(None, input_name.lower(), match).ratio()
-        results.append((match, int(similarity * 100)))
-    return results
+def find_similar_names(input_name, all_names=None, cutoff=0.6):
+    """
+    Fino a 5 nomi simili come (nome in minuscolo, similitudine %), dal più simile.
+    Senza all_names cerca tra tutti i clienti con l'indice persistente (client_name_index).
+    """
+    if all_names is None:
+        index = client_name_index()
+    else:
+        index = NameIndex()
+        index.sync(all_names)
+    return index.search(input_name, n=5, cutoff=cutoff)
 
 
 # ✅ Controllo nomi cliente
 def check_client_name(input_name):
-    all_clients = load_client_names()
-    similars = find_similar_names(input_name, all_clients)
+    similars = find_similar_names(input_name)
 
     if similars:
         print(f"\n⚠️  Trovati nomi simili a '{input_name}':")
@@ -62,15 +277,6 @@ def check_client_name(input_name):
 
 # 💾 Salvataggio dati cliente
 def save_client_data(client_name, page_id, data):
-    if not os.path.exists(CLIENTI_JSON):
-        clienti = {}
-    else:
-        with open(CLIENTI_JSON, "r", encoding="utf-8") as f:
-            try:
-                clienti = json.load(f)
-            except json.JSONDecodeError:
-                clienti = {}
-
     # Debug log
     print(f"[💾] Salvataggio: {client_name} - data: {data}")
 
@@ -103,40 +309,19 @@ def save_client_data(client_name, page_id, data):
     if until:
         entry["last_until"] = until
 
-    if client_name in clienti:
+    try:
+        existed = client_registry().update(client_name, entry)
+    except ClientDataError as e:
+        print(f"❌ Dati di '{client_name}' non salvati: {e}")
+        logger.error(f"Dati di '{client_name}' non salvati: {e}")
+        return
+    if existed:
         print(f"[ℹ️] Cliente '{client_name}' aggiornato.")
     else:
         print(f"[➕] Nuovo cliente '{client_name}' aggiunto.")
-
-    clienti[client_name] = entry
-
-    with open(CLIENTI_JSON, "w", encoding="utf-8") as f:
-        json.dump(clienti, f, indent=2, ensure_ascii=False)
-    
-        logger.info(f"File clienti salvato in {CLIENTI_JSON}")
-
-    # 📦 Salvataggio backup
-    backup_dir = "backup_clienti"
-    backup_path = os.path.join(backup_dir, "clienti.json")
-    try:
-        os.makedirs(backup_dir, exist_ok=True)
-        with open(backup_path, "w", encoding="utf-8") as backup_file:
-            json.dump(clienti, backup_file, indent=2, ensure_ascii=False)
-        logger.info(f"Backup creato in {backup_path}")
-    except Exception as e:
-        logger.warning(f"Errore durante il salvataggio backup: {e}")
-
+    logger.info(f"File clienti salvato in {CLIENTI_JSON}")
 
 
 # 📤 Caricamento dati cliente
 def load_client_data(client_name):
-    if not os.path.exists(CLIENTI_JSON):
-        return {}
-
-    with open(CLIENTI_JSON, "r", encoding="utf-8") as f:
-        try:
-            data = json.load(f)
-        except json.JSONDecodeError:
-            return {}
-
-    return data.get(client_name, {})
+    return client_registry().get(client_name)
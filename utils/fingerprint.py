@@ -0,0 +1,110 @@
+import hashlib
+import json
+import os
+from pathlib import Path
+from typing import Any, Dict, Iterable, Optional
+
+from utils.client_utils import file_lock
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+
+# Blocchi letti per calcolare l'hash dei file grandi (template PDF, font)
+_CHUNK_SIZE = 1024 * 1024
+
+
+def hash_data(data: Any) -> str:
+    """
+    Impronta (sha256) di dati serializzabili in JSON, indipendente dall'ordine delle chiavi.
+    """
+    payload = json.dumps(data, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def hash_file(path) -> Optional[str]:
+    """
+    Impronta (sha256) del contenuto di un file, None se il file non esiste.
+    I percorsi relativi sono risolti rispetto alla root del progetto.
+    """
+    path = Path(path)
+    if not path.is_absolute():
+        path = BASE_DIR / path
+    if not path.exists():
+        return None
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def hash_files(paths: Iterable) -> Dict[str, Optional[str]]:
+    return {str(p): hash_file(p) for p in paths}
+
+
+class FingerprintStore:
+    """
+    Impronte degli step della pipeline salvate in un file JSON
+    (es. output/{cliente}/.pipeline_state_{since}_{until}.json, uno per periodo e modalità).
+    Per ogni step registra l'impronta degli input e quella dei dati prodotti.
+    save() scrive sotto lock tra processi e unisce il file su disco: vengono sovrascritti solo
+    gli step registrati o rimossi da questa istanza.
+
+    Esempio:
+        store = FingerprintStore("output/55Bijoux/.pipeline_state_2025-07-01_2025-07-25.json")
+        if store.get("step5", {}).get("inputs") == impronta:
+            ...
+        store.record("step5", impronta, impronta_output)
+        store.save()
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self._steps = self._load()
+        # Step registrati (record/set_files) o rimossi (forget) da questa istanza
+        self._changed = set()
+
+    def _load(self) -> Dict[str, Dict]:
+        if not self.path.exists():
+            return {}
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                return json.load(f).get("steps", {})
+        except (OSError, ValueError, AttributeError) as e:
+            logger.warning(f"Stato pipeline non leggibile ({e}), tutti gli step verranno rieseguiti.")
+            return {}
+
+    def get(self, step: str, default=None) -> Optional[Dict]:
+        return self._steps.get(step, default)
+
+    def record(self, step: str, inputs: str, output: str):
+        self._steps[step] = {"inputs": inputs, "output": output}
+        self._changed.add(step)
+
+    def set_files(self, step: str, files: Dict[str, Optional[str]]):
+        if step in self._steps:
+            self._steps[step]["files"] = files
+            self._changed.add(step)
+
+    def forget(self, step: str):
+        self._steps.pop(step, None)
+        self._changed.add(step)
+
+    def save(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with file_lock(f"{self.path}.lock"):
+            # Gli step non toccati da questa istanza restano quelli su disco (altri processi o thread)
+            steps = self._load()
+            for step in self._changed:
+                if step in self._steps:
+                    steps[step] = self._steps[step]
+                else:
+                    steps.pop(step, None)
+            tmp_path = self.path.with_name(f"{self.path.name}.{os.getpid()}.tmp")
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"steps": steps}, f, ensure_ascii=False, indent=2)
+            os.replace(tmp_path, self.path)
+        self._steps = steps
+        self._changed.clear()
@@ -0,0 +1,146 @@
+import subprocess
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, Optional, Union
+
+from utils.logger import get_logger
+from utils.media_cache import MediaCache
+from utils.media_utils import discard_download, download_file, host_slot
+
+logger = get_logger(__name__)
+
+# Processi ffmpeg contemporanei (ognuno limitato a un thread: uso CPU prevedibile)
+FFMPEG_WORKERS = 2
+
+# Altezza del frame in pixel: l'immagine occupa metà pagina (540 pt) e pdf_utils la ricampiona
+# a 150 DPI (540 / 72 * 150 = 1125 px), quindi un frame più grande verrebbe solo ridotto dopo
+FRAME_HEIGHT = 1125
+
+# Posizione del frame (secondi). Con 0 si prende il primo frame come prima
+FRAME_SEEK_SECONDS = 0.0
+
+
+class FrameExtractor:
+    """
+    Servizio di estrazione frame dai video con un pool limitato di processi ffmpeg.
+    - seek sull'input (-ss prima di -i) e decodifica dei soli keyframe: ffmpeg non decodifica il video dall'inizio
+    - ridimensionamento a FRAME_HEIGHT dentro ffmpeg invece di produrre il frame a piena risoluzione
+    - frame salvati in MediaCache (variante 'frame') per media_id: ogni video viene elaborato una sola volta,
+      anche se richiesto più volte contemporaneamente
+
+    Esempio:
+        with FrameExtractor(cache) as extractor:
+            future = extractor.submit(media_id, primi_byte_del_video, fallback_url=media_url)
+            frame_path = future.result()
+    """
+
+    def __init__(self, cache: Optional[MediaCache] = None, max_workers: int = FFMPEG_WORKERS,
+                 height: int = FRAME_HEIGHT, seek: float = FRAME_SEEK_SECONDS):
+        self.cache = cache or MediaCache()
+        self.height = height
+        self.seek = seek
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="ffmpeg")
+        self._pending: Dict[str, Future] = {}
+        # RLock: add_done_callback esegue subito _forget se il Future è già concluso
+        self._lock = threading.RLock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.shutdown()
+        return False
+
+    def shutdown(self, wait: bool = True):
+        self._executor.shutdown(wait=wait)
+
+    def submit(self, media_id: str, source: Union[str, Path, bytes, None], fallback_url: str = None,
+               progress=None) -> Future:
+        """
+        Accoda l'estrazione del frame di un video.
+        :param source: percorso locale, URL o byte iniziali del video (passati a ffmpeg via pipe).
+        :param fallback_url: se l'estrazione da source fallisce, il video viene scaricato per intero da qui.
+        :return: Future con il percorso del frame in cache, oppure None.
+        """
+        cached = self.cache.get(media_id, "frame")
+        if cached is not None:
+            future = Future()
+            future.set_result(cached)
+            return future
+
+        with self._lock:
+            # Stesso video già in lavorazione: si riusa il Future esistente
+            future = self._pending.get(media_id)
+            if future is None:
+                future = self._executor.submit(self._extract, media_id, source, fallback_url, progress)
+                self._pending[media_id] = future
+                future.add_done_callback(lambda _: self._forget(media_id))
+            return future
+
+    def extract(self, media_id: str, source, fallback_url: str = None) -> Optional[Path]:
+        """
+        Versione sincrona di submit().
+        """
+        return self.submit(media_id, source, fallback_url).result()
+
+    def _forget(self, media_id: str):
+        with self._lock:
+            self._pending.pop(media_id, None)
+
+    def _command(self, source: str, frame_path: Path):
+        return [
+            "ffmpeg", "-y", "-loglevel", "error",
+            "-threads", "1",
+            "-ss", f"{self.seek:.3f}",
+            "-skip_frame", "nokey",
+            "-an", "-sn", "-dn",
+            "-i", source,
+            "-frames:v", "1",
+            "-vf", f"scale=-2:'min({self.height},ih)'",
+            "-q:v", "3",
+            str(frame_path),
+        ]
+
+    def _run_ffmpeg(self, source, frame_path: Path) -> bool:
+        data = None
+        if isinstance(source, (bytes, bytearray)):
+            data, source = source, "pipe:0"
+        try:
+            subprocess.run(self._command(str(source), frame_path), input=data, check=True, capture_output=True)
+            return frame_path.exists()
+        except FileNotFoundError:
+            logger.error("❌ ffmpeg non trovato nel PATH")
+            return False
+        except subprocess.CalledProcessError as e:
+            logger.info(f"Estrazione frame non riuscita per {frame_path.name}")
+            if e.stderr:
+                logger.debug(f"ffmpeg stderr: {e.stderr.decode('utf-8', errors='replace')}")
+            return False
+
+    def _extract(self, media_id: str, source, fallback_url: Optional[str], progress) -> Optional[Path]:
+        frame_tmp = self.cache.path_for(media_id, "frame", ".tmp.jpg")
+        video_tmp = self.cache.path_for(media_id, "frame", ".tmp.mp4")
+        frame_tmp.parent.mkdir(parents=True, exist_ok=True)
+        try:
+            if source and self._run_ffmpeg(source, frame_tmp):
+                logger.info(f"✅ Frame estratto per {media_id}")
+                return self.cache.put(media_id, "frame", frame_tmp, url=fallback_url or "", ext=".jpg")
+
+            if not fallback_url:
+                return None
+
+            # Ultima risorsa: video completo
+            logger.info(f"Download completo del video {media_id} come ultima risorsa")
+            with host_slot(fallback_url):
+                if not download_file(fallback_url, video_tmp, progress=progress):
+                    return None
+            if not self._run_ffmpeg(video_tmp, frame_tmp):
+                return None
+            logger.info(f"✅ Frame estratto per {media_id} dal video completo")
+            return self.cache.put(media_id, "frame", frame_tmp, url=fallback_url, ext=".jpg")
+        finally:
+            # Un video scaricato a metà resta come .part e verrà ripreso al prossimo tentativo
+            discard_download(video_tmp)
+            if frame_tmp.exists():
+                frame_tmp.unlink()
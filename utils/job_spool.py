@@ -0,0 +1,160 @@
+import json
+import os
+import socket
+import time
+import uuid
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+
+# Coda dei job del worker (worker.py): un file JSON per job, spostato tra le cartelle di stato
+SPOOL_DIR = BASE_DIR / "spool"
+STATES = ("pending", "running", "done", "failed")
+
+# Secondi senza heartbeat dopo cui un job in running/ è considerato abbandonato (il worker lo aggiorna
+# ogni pochi secondi, vedi worker.py)
+HEARTBEAT_TIMEOUT = 300
+
+
+def _pid_alive(pid: int) -> bool:
+    if os.name == "nt":
+        # Su Windows os.kill terminerebbe il processo: vale solo l'heartbeat
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class JobSpool:
+    """
+    Coda di job su disco. Ogni job è un file JSON in pending/; chi lo prende lo sposta in running/
+    con os.replace (atomico: se due worker provano a prendere lo stesso job, uno solo ci riesce)
+    e a fine elaborazione in done/ o failed/ insieme all'esito. Il job in running/ registra il worker
+    che lo esegue (host e pid) e la data di modifica del file fa da heartbeat (heartbeat()): recover()
+    rimette in coda solo i job di worker terminati.
+    I nomi dei file iniziano con il timestamp di inserimento, quindi i job vengono presi in ordine.
+
+    Esempio:
+        spool = JobSpool()
+        spool.submit({"client_name": "55Bijoux", "since": "2025-06-01", "until": "2025-06-30"})
+        claimed = spool.claim()
+        if claimed:
+            job_id, job = claimed
+            spool.complete(job_id, {"status": "ok", ...})
+    """
+
+    def __init__(self, root=None):
+        self.root = Path(root) if root else SPOOL_DIR
+        for state in STATES:
+            (self.root / state).mkdir(parents=True, exist_ok=True)
+
+    def _path(self, state: str, job_id: str) -> Path:
+        return self.root / state / f"{job_id}.json"
+
+    def _write(self, path: Path, data: Dict[str, Any]):
+        tmp_path = path.with_suffix(".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, path)
+
+    def submit(self, job: Dict[str, Any]) -> str:
+        """
+        Accoda un job e ne restituisce l'id.
+        """
+        job_id = f"{datetime.now().strftime('%Y%m%d_%H%M%S_%f')}_{uuid.uuid4().hex[:6]}"
+        self._write(self._path("pending", job_id), {**job, "submitted_at": time.time()})
+        logger.info(f"📥 Job {job_id} accodato: {job.get('client_name')} {job.get('since')} → {job.get('until')}")
+        return job_id
+
+    def pending(self) -> List[str]:
+        return sorted(p.stem for p in (self.root / "pending").glob("*.json"))
+
+    def claim(self) -> Optional[Tuple[str, Dict[str, Any]]]:
+        """
+        Prende il job in attesa più vecchio, None se la coda è vuota.
+        """
+        for job_id in self.pending():
+            pending_path = self._path("pending", job_id)
+            running_path = self._path("running", job_id)
+            try:
+                # os.replace conserva la data di modifica: senza aggiornarla il job sembrerebbe abbandonato
+                os.utime(pending_path)
+                os.replace(pending_path, running_path)
+            except FileNotFoundError:
+                continue  # preso da un altro worker
+            try:
+                with open(running_path, "r", encoding="utf-8") as f:
+                    job = json.load(f)
+                self._write(running_path, {**job, "owner": {"host": socket.gethostname(), "pid": os.getpid()}})
+                return job_id, job
+            except (OSError, ValueError) as e:
+                logger.error(f"Job {job_id} non leggibile: {e}")
+                self.complete(job_id, {"status": "failed", "error": f"Job non leggibile: {e}"})
+        return None
+
+    def complete(self, job_id: str, result: Dict[str, Any]):
+        """
+        Chiude un job preso con claim(): finisce in done/ o failed/ a seconda di result["status"].
+        """
+        running_path = self._path("running", job_id)
+        try:
+            with open(running_path, "r", encoding="utf-8") as f:
+                job = json.load(f)
+        except (OSError, ValueError):
+            job = {}
+        state = "done" if result.get("status") == "ok" else "failed"
+        self._write(self._path(state, job_id), {**job, "result": result, "finished_at": time.time()})
+        running_path.unlink(missing_ok=True)
+
+    def heartbeat(self, job_ids):
+        """
+        Segnala che i job indicati sono ancora in esecuzione.
+        """
+        for job_id in job_ids:
+            try:
+                os.utime(self._path("running", job_id))
+            except FileNotFoundError:
+                pass
+
+    def _abandoned(self, path: Path, timeout: float) -> bool:
+        try:
+            if time.time() - path.stat().st_mtime > timeout:
+                return True
+            with open(path, "r", encoding="utf-8") as f:
+                owner = json.load(f).get("owner") or {}
+        except FileNotFoundError:
+            return False
+        except (OSError, ValueError):
+            # File in riscrittura (claim) o illeggibile: deciderà l'heartbeat
+            return False
+        # Worker di questo host terminato senza chiudere il job
+        return owner.get("host") == socket.gethostname() and not _pid_alive(owner.get("pid", 0))
+
+    def recover(self, timeout: float = HEARTBEAT_TIMEOUT) -> int:
+        """
+        Rimette in coda i job rimasti in running/ da worker interrotti a metà: quelli di un processo di questo
+        host non più attivo e quelli senza heartbeat da più di timeout secondi. I job di worker ancora attivi
+        (anche su altri host che condividono la cartella) non vengono toccati.
+        """
+        recovered = 0
+        for path in (self.root / "running").glob("*.json"):
+            if not self._abandoned(path, timeout):
+                continue
+            try:
+                os.replace(path, self._path("pending", path.stem))
+            except FileNotFoundError:
+                continue  # completato o recuperato da un altro worker nel frattempo
+            recovered += 1
+        if recovered:
+            logger.warning(f"♻️ {recovered} job interrotti rimessi in coda")
+        return recovered
@@ -1,15 +1,21 @@
 import logging
 import os
 import json
-from functools import wraps
+from functools import lru_cache, wraps
 from datetime import datetime
 
-# RichHandler for enhanced console formatting, if available
-try:
-    from rich.logging import RichHandler
-    _RICH_AVAILABLE = True
-except ImportError:
-    _RICH_AVAILABLE = False
+
+@lru_cache(maxsize=None)
+def _rich_handler_class():
+    """
+    RichHandler for enhanced console formatting, if available.
+    Imported on first logger configuration, not when this module is imported.
+    """
+    try:
+        from rich.logging import RichHandler
+    except ImportError:
+        return None
+    return RichHandler
 
 class JsonFormatter(logging.Formatter):
     """
@@ -55,8 +61,9 @@ def get_logger(name: str) -> logging.Logger:
     # Configure handlers once
     if not logger.handlers:
         # Console Handler
-        if _RICH_AVAILABLE:
-            console = RichHandler(rich_tracebacks=True)
+        rich_handler = _rich_handler_class()
+        if rich_handler is not None:
+            console = rich_handler(rich_tracebacks=True)
             console.setLevel(level)
             logger.info("Configuring RichHandler for console output")
             logger.addHandler(console)
@@ -113,13 +120,5 @@ def log_step_start(step_number: int, description: str):
     message = f"🚀 Starting Step {step_number}: {description}"
     logger.info(message)
 
-# Example: Initialize root logger configuration when this module is imported
-if __name__ != '__main__':
-    root_logger = get_logger('meta_metrics_collector')
-    root_logger.info("Centralized logger module loaded for Meta Metrics Collector")
-
-# Test logs: verificare che INFO e DEBUG siano emessi correttamente
-root_logger.debug("TEST DEBUG: se vedi questo, LOG_LEVEL=DEBUG è attivo")
-root_logger.info("TEST INFO: test di logging INFO configurato correttamente")
 
 # FILE: utils/logger.py
@@ -0,0 +1,277 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Optional
+from urllib.parse import urlparse
+
+from utils.client_utils import file_lock
+from utils.logger import get_logger
+from utils.media_utils import discard_download, download_file, verify_download
+
+logger = get_logger(__name__)
+
+# Cartella della cache condivisa da step6 e step7 (tutti i clienti e periodi)
+CACHE_DIR = Path(__file__).resolve().parent.parent / "media" / ".cache"
+INDEX_FILE = "index.json"
+
+# Spazio massimo su disco della cache (MB), sovrascrivibile con MEDIA_CACHE_MAX_MB
+DEFAULT_MAX_MB = 2048
+
+# Varianti salvate per ogni media ("resized": immagini ricampionate per il PDF, utils/pdf_utils.py)
+VARIANTS = ("original", "frame", "thumbnail", "resized")
+
+
+def media_key(post: Dict) -> str:
+    """
+    Chiave di cache di un post: il media_id Instagram, oppure (se assente)
+    l'hash dell'URL senza query string, che cambia a ogni firma del CDN.
+    """
+    media_id = post.get("media_id")
+    if media_id:
+        return str(media_id)
+    url = post.get("media_url", "")
+    parsed = urlparse(url)
+    return "url_" + hashlib.sha1(f"{parsed.netloc}{parsed.path}".encode("utf-8")).hexdigest()[:16]
+
+
+_shared = None
+_shared_lock = threading.Lock()
+
+
+def shared_cache() -> "MediaCache":
+    """
+    Istanza di MediaCache condivisa da tutto il processo: più pipeline in parallelo (batch.py)
+    usano lo stesso indice invece di sovrascriversi a vicenda index.json.
+    """
+    global _shared
+    with _shared_lock:
+        if _shared is None:
+            _shared = MediaCache()
+        return _shared
+
+
+class MediaCache:
+    """
+    Cache su disco dei media, indirizzata per (media_id, variante).
+    Ogni asset viene scaricato al massimo una volta, indipendentemente da cliente, periodo o
+    posizione del post nella classifica. L'indice (index.json) registra dimensione e ultimo accesso
+    di ogni file; quando la cache supera il budget vengono rimossi i file usati meno di recente
+    (esclusi quelli usati dall'istanza corrente, se pin=True).
+
+    Esempio:
+        cache = MediaCache()
+        path = cache.get_or_download(post["media_id"], post["media_url"])
+    """
+
+    def __init__(self, cache_dir=None, max_bytes: Optional[int] = None, pin: bool = True):
+        self.cache_dir = Path(cache_dir) if cache_dir else CACHE_DIR
+        # False: i file non restano protetti dalla pulizia dopo get()/put() (chi li usa li legge subito)
+        self.pin = pin
+        if max_bytes is None:
+            max_bytes = int(os.getenv("MEDIA_CACHE_MAX_MB", DEFAULT_MAX_MB)) * 1024 * 1024
+        self.max_bytes = max_bytes
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self._index_path = self.cache_dir / INDEX_FILE
+        self._lock = threading.RLock()
+        self._in_use = set()
+        # Voci rimosse da questa istanza (chiave -> momento della rimozione), da non riprendere dall'indice su disco
+        self._removed: Dict[str, float] = {}
+        self._index = self._load_index()
+
+    def _read_index(self) -> Dict[str, Dict]:
+        if not self._index_path.exists():
+            return {}
+        try:
+            with open(self._index_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Indice cache media non leggibile ({e}), la cache viene ricostruita.")
+            return {}
+
+    def _load_index(self) -> Dict[str, Dict]:
+        # Rimuove le voci dei file cancellati a mano
+        return {key: entry for key, entry in self._read_index().items() if (self.cache_dir / entry["file"]).exists()}
+
+    def _merge_index(self):
+        """
+        Unisce all'indice in memoria quello su disco, scritto anche da altri processi (main.py, batch.py e
+        worker.py possono usare la cache insieme): per ogni voce vale l'accesso più recente, le voci rimosse da
+        questa istanza restano rimosse se su disco non sono state ricreate dopo.
+        """
+        on_disk = self._read_index()
+        for key in [key for key in self._index if key not in on_disk]:
+            # Voce tolta da un altro processo (file rimosso per liberare spazio o corrotto)
+            if not (self.cache_dir / self._index[key]["file"]).exists():
+                del self._index[key]
+        for key, entry in on_disk.items():
+            removed_at = self._removed.get(key)
+            if removed_at is not None and entry.get("created", 0) <= removed_at:
+                continue
+            current = self._index.get(key)
+            if current is None or entry.get("last_access", 0) > current.get("last_access", 0):
+                self._index[key] = entry
+        self._removed.clear()
+
+    def _save_index(self, evict: bool = False):
+        """
+        Scrive l'indice sotto lock tra processi, dopo averlo unito a quello su disco (ed eventualmente
+        aver liberato spazio: il budget vale per i file di tutti i processi).
+        """
+        with file_lock(f"{self._index_path}.lock"):
+            self._merge_index()
+            if evict:
+                self._evict()
+            tmp_path = self._index_path.with_name(f"{self._index_path.name}.{os.getpid()}.tmp")
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(self._index, f, ensure_ascii=False, indent=2)
+            os.replace(tmp_path, self._index_path)
+
+    @staticmethod
+    def _key(media_id: str, variant: str) -> str:
+        if variant not in VARIANTS:
+            raise ValueError(f"Variante media non valida: {variant} (ammesse: {', '.join(VARIANTS)})")
+        return f"{media_id}:{variant}"
+
+    def path_for(self, media_id: str, variant: str = "original", ext: str = ".jpg") -> Path:
+        """
+        Percorso in cache per un media (esistente o meno).
+        """
+        self._key(media_id, variant)
+        return self.cache_dir / variant / f"{media_id}{ext}"
+
+    def get(self, media_id: str, variant: str = "original") -> Optional[Path]:
+        """
+        Restituisce il percorso del file in cache, oppure None se non presente.
+        """
+        key = self._key(media_id, variant)
+        with self._lock:
+            entry = self._index.get(key)
+            if entry is None:
+                return None
+            path = self.cache_dir / entry["file"]
+            if not verify_download(path, full=False):
+                # File mancante o corrotto (lunghezza/hash diversi da quelli registrati al download)
+                logger.warning(f"Cache media: {key} mancante o corrotto, verrà riscaricato")
+                del self._index[key]
+                self._removed[key] = time.time()
+                discard_download(path)
+                return None
+            # L'ultimo accesso viene scritto su disco con save() o al prossimo put()
+            entry["last_access"] = time.time()
+            if self.pin:
+                self._in_use.add(key)
+        logger.debug(f"Cache media: hit {key} -> {path}")
+        return path
+
+    def get_path(self, path) -> bool:
+        """
+        Come get(), ma a partire dal percorso di un file (es. local_img_path di un post salvato):
+        True se il file c'è ed è integro. I file in cache restano esclusi dalla pulizia per questa esecuzione.
+        """
+        path = Path(path).resolve()
+        try:
+            relative = path.relative_to(self.cache_dir.resolve()).as_posix()
+        except ValueError:
+            # File fuori dalla cache (es. immagini preparate a mano)
+            return verify_download(path, full=False)
+        with self._lock:
+            key = next((key for key, entry in self._index.items() if entry["file"] == relative), None)
+        if key is None:
+            return False
+        media_id, variant = key.rsplit(":", 1)
+        return self.get(media_id, variant) is not None
+
+    def put(self, media_id: str, variant: str, source_path, url: str = "", ext: str = None) -> Path:
+        """
+        Sposta in cache un file già scaricato/generato e lo registra nell'indice.
+        """
+        key = self._key(media_id, variant)
+        source_path = Path(source_path)
+        target = self.path_for(media_id, variant, ext or source_path.suffix or ".jpg")
+        target.parent.mkdir(parents=True, exist_ok=True)
+        os.replace(source_path, target)
+
+        with self._lock:
+            now = time.time()
+            self._index[key] = {
+                "file": target.relative_to(self.cache_dir).as_posix(),
+                "size": target.stat().st_size,
+                "url": url.split("?")[0],
+                "created": now,
+                "last_access": now,
+            }
+            if self.pin:
+                self._in_use.add(key)
+            self._save_index(evict=True)
+        logger.debug(f"Cache media: salvato {key} -> {target}")
+        return target
+
+    def get_or_download(self, media_id: str, url: str, variant: str = "original", ext: str = None,
+                        progress=None) -> Optional[Path]:
+        """
+        Restituisce il media dalla cache, scaricandolo solo se non presente.
+        :return: percorso in cache, oppure None se il download fallisce.
+        """
+        cached = self.get(media_id, variant)
+        if cached is not None:
+            logger.info(f"Media {media_id} ({variant}) già in cache, download saltato.")
+            return cached
+
+        if ext is None:
+            ext = os.path.splitext(urlparse(url).path)[1] or ".jpg"
+        # download_file scrive in un .part e rinomina solo a file verificato: un download
+        # interrotto riprende alla prossima esecuzione invece di ripartire da zero
+        target = self.path_for(media_id, variant, ext)
+        target.parent.mkdir(parents=True, exist_ok=True)
+        if not download_file(url, target, progress=progress):
+            return None
+        return self.put(media_id, variant, target, url=url, ext=ext)
+
+    def save(self):
+        """
+        Salva l'indice su disco (ultimi accessi aggiornati da get()).
+        """
+        with self._lock:
+            self._save_index()
+
+    def release(self):
+        """
+        Salva l'indice e rende di nuovo rimovibili i file usati finora: in un processo di lunga durata
+        (worker.py) va chiamata quando nessun job è in corso, altrimenti la cache non scenderebbe mai
+        sotto il budget.
+        """
+        with self._lock:
+            self._in_use.clear()
+            self._save_index(evict=True)
+
+    def total_size(self) -> int:
+        with self._lock:
+            return sum(entry["size"] for entry in self._index.values())
+
+    def _evict(self):
+        """
+        Rimuove i file usati meno di recente finché la cache non rientra nel budget.
+        """
+        total = self.total_size()
+        if total <= self.max_bytes:
+            return
+        candidates = sorted(
+            (key for key in self._index if key not in self._in_use),
+            key=lambda k: self._index[k]["last_access"],
+        )
+        for key in candidates:
+            if total <= self.max_bytes:
+                break
+            entry = self._index.pop(key)
+            self._removed[key] = time.time()
+            discard_download(self.cache_dir / entry["file"])
+            total -= entry["size"]
+            logger.info(f"Cache media: rimosso {key} ({entry['size'] / 1024:.0f} KB) per liberare spazio")
+        if total > self.max_bytes:
+            logger.warning(
+                f"Cache media oltre il budget ({total / 1024 / 1024:.1f} MB > {self.max_bytes / 1024 / 1024:.1f} MB): "
+                "i file rimanenti sono in uso in questa esecuzione."
+            )
@@ -1,75 +1,431 @@
 ### FILE: utils/media_utils.py
+import base64
+import glob
+import hashlib
+import json
+import os
 import requests
-import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from pathlib import Path
+from urllib.parse import urlparse
 from tqdm import tqdm
 from utils.logger import get_logger, log_exceptions
 
 logger = get_logger(__name__)
 
+# Download contemporanei massimi verso lo stesso host (CDN Instagram/Facebook)
+MAX_CONNECTIONS_PER_HOST = 4
+
+# Byte letti dall'inizio di un video per estrarne il primo frame senza scaricarlo tutto
+RANGE_READ_BYTES = 512 * 1024
+
+# Download segmentato (più connessioni in parallelo sullo stesso file) per i file grandi, es. reel lunghi.
+# Sovrascrivibili con le variabili d'ambiente DOWNLOAD_SEGMENT_THRESHOLD_MB e DOWNLOAD_SEGMENTS
+SEGMENT_THRESHOLD = int(float(os.getenv("DOWNLOAD_SEGMENT_THRESHOLD_MB", "8")) * 1024 * 1024)
+DOWNLOAD_SEGMENTS = int(os.getenv("DOWNLOAD_SEGMENTS", "4"))
+
+_HOST_SEMAPHORES = {}
+_HOST_LOCK = threading.Lock()
+
+# Sessione HTTP condivisa: le connessioni (TLS compreso) vengono riusate tra download e segmenti.
+# Anche i segmenti occupano uno slot dell'host (host_slot), quindi bastano MAX_CONNECTIONS_PER_HOST connessioni
+_SESSION = requests.Session()
+_SESSION.mount("https://", requests.adapters.HTTPAdapter(pool_maxsize=MAX_CONNECTIONS_PER_HOST))
+_SESSION.mount("http://", requests.adapters.HTTPAdapter(pool_maxsize=MAX_CONNECTIONS_PER_HOST))
+
+
+def _host_semaphore(url, limit=MAX_CONNECTIONS_PER_HOST) -> threading.BoundedSemaphore:
+    host = urlparse(url).netloc
+    with _HOST_LOCK:
+        semaphore = _HOST_SEMAPHORES.get(host)
+        if semaphore is None:
+            semaphore = _HOST_SEMAPHORES[host] = threading.BoundedSemaphore(limit)
+        return semaphore
+
+
+@contextmanager
+def host_slot(url, limit=MAX_CONNECTIONS_PER_HOST):
+    """
+    Limita i download contemporanei verso lo stesso host.
+    Uso: with host_slot(url): download_file(url, path)
+    """
+    with _host_semaphore(url, limit):
+        yield
+
+
+@contextmanager
+def extra_host_slots(url, wanted: int):
+    """
+    Prende fino a 'wanted' slot dell'host in più, solo tra quelli liberi (senza attendere), e restituisce
+    quanti ne ha ottenuti: le connessioni aggiuntive di un download segmentato restano nel limite per host.
+    """
+    semaphore = _host_semaphore(url)
+    acquired = 0
+    while acquired < wanted and semaphore.acquire(blocking=False):
+        acquired += 1
+    try:
+        yield acquired
+    finally:
+        for _ in range(acquired):
+            semaphore.release()
+
+
+class IncompleteDownload(Exception):
+    """
+    Il file ricevuto non corrisponde a lunghezza o checksum attesi.
+    """
+
+
+def _meta_path(path: Path) -> Path:
+    """
+    File sidecar con i validatori HTTP (ETag, Last-Modified) e lunghezza/hash del file scaricato.
+    """
+    return path.with_name(path.name + ".meta.json")
+
+
+def _load_meta(path: Path) -> dict:
+    try:
+        with open(_meta_path(path), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _save_meta(path: Path, meta: dict):
+    meta_path = _meta_path(path)
+    tmp_path = meta_path.with_name(meta_path.name + ".tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(meta, f, indent=2)
+    os.replace(tmp_path, meta_path)
+
+
+def _file_sha256(path: Path, hasher=None):
+    hasher = hasher or hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            hasher.update(block)
+    return hasher
+
+
+def _url_key(url: str) -> str:
+    # Gli URL firmati del CDN cambiano la query a ogni richiesta: conta solo host + percorso
+    parsed = urlparse(url)
+    return f"{parsed.netloc}{parsed.path}"
+
+
+def verify_download(path, full: bool = True) -> bool:
+    """
+    Controlla che un file scaricato corrisponda a lunghezza e SHA-256 registrati nel sidecar.
+    Con full=False (es. hit della cache media) l'hash si ricalcola solo se data di modifica o lunghezza
+    non sono più quelle registrate a fine download.
+    Restituisce True anche per i file senza sidecar (scaricati con versioni precedenti).
+    """
+    path = Path(path)
+    if not path.exists():
+        return False
+    meta = _load_meta(path)
+    if not meta:
+        return True
+    stat = path.stat()
+    if meta.get("length") is not None and stat.st_size != meta["length"]:
+        return False
+    if not full and meta.get("mtime_ns") == stat.st_mtime_ns:
+        return True
+    if meta.get("sha256") and _file_sha256(path).hexdigest() != meta["sha256"]:
+        return False
+    if meta.get("sha256") and meta.get("mtime_ns") != stat.st_mtime_ns:
+        # Sidecar di versioni precedenti o file toccato ma integro: i prossimi controlli rapidi non rifanno l'hash
+        meta["mtime_ns"] = stat.st_mtime_ns
+        _save_meta(path, meta)
+    return True
+
+
+def discard_download(path):
+    """
+    Rimuove un file scaricato insieme al suo sidecar (il .part eventuale resta per la ripresa).
+    """
+    path = Path(path)
+    for p in (path, _meta_path(path)):
+        if p.exists():
+            p.unlink()
+
+
+def _discard_partial(part_path: Path):
+    """
+    Rimuove il .part e gli eventuali segmenti ('<part>.segN') di un download interrotto.
+    """
+    for p in [part_path, *part_path.parent.glob(f"{glob.escape(part_path.name)}.seg*")]:
+        if p.exists():
+            p.unlink()
+
+
+def _fetch_segment(url, seg_path: Path, start: int, end: int, validator, on_chunk):
+    """
+    Scarica i byte start-end (inclusi) in seg_path, riprendendo dalla dimensione già presente.
+    """
+    done = seg_path.stat().st_size if seg_path.exists() else 0
+    if done >= end - start + 1:
+        return
+    headers = {"Range": f"bytes={start + done}-{end}"}
+    if validator:
+        headers["If-Range"] = validator
+    with _SESSION.get(url, headers=headers, stream=True, timeout=30) as response:
+        response.raise_for_status()
+        if response.status_code != 206:
+            # Il server ha risposto con il file intero: la risorsa è cambiata, il segmento non è valido
+            raise IncompleteDownload(f"Range non supportato per il segmento {seg_path.name}")
+        with open(seg_path, "ab") as f:
+            for chunk in response.iter_content(64 * 1024):
+                if chunk:
+                    f.write(chunk)
+                    on_chunk(len(chunk))
+    if seg_path.stat().st_size != end - start + 1:
+        raise IncompleteDownload(f"Segmento troncato: {seg_path.name}")
+
+
+def _download_segmented(url, part_path: Path, length: int, validator, progress, counted, resume=True):
+    """
+    Scarica un file grande in DOWNLOAD_SEGMENTS intervalli di byte (connessioni della sessione condivisa)
+    e li riunisce in part_path. Ogni segmento viene salvato in '<part>.segN': se il download si interrompe,
+    i segmenti già ricevuti non vengono riscaricati. I segmenti in parallelo sono al massimo quanti gli slot
+    dell'host liberi (extra_host_slots) più quello del download stesso.
+    counted[0]/counted[1] vengono aggiornati con i byte aggiunti al totale e alla barra 'progress'.
+    Con resume=False eventuali segmenti di una versione precedente del file vengono scartati.
+    """
+    segments = max(1, DOWNLOAD_SEGMENTS)
+    size = -(-length // segments)
+    ranges = [(i, i * size, min(length, (i + 1) * size) - 1) for i in range(segments) if i * size < length]
+    seg_paths = [part_path.with_name(f"{part_path.name}.seg{i}") for i, _, _ in ranges]
+    if not resume:
+        for seg_path in seg_paths:
+            if seg_path.exists():
+                seg_path.unlink()
+    logger.info(f"Download segmentato di {part_path.name[:-5]}: {length / 1024 / 1024:.1f} MB in {len(ranges)} segmenti")
+
+    bar = progress
+    if bar is None:
+        bar = tqdm(total=0, unit='B', unit_scale=True, unit_divisor=1024, desc=part_path.name[:-5], leave=True)
+    already = sum(p.stat().st_size for p in seg_paths if p.exists())
+    with bar.get_lock():
+        bar.total = (bar.total or 0) + length
+        bar.update(already)
+        counted[0] += length
+        counted[1] += already
+
+    lock = threading.Lock()
+
+    def on_chunk(n):
+        with lock:
+            counted[1] += n
+        bar.update(n)
+
+    try:
+        with extra_host_slots(url, len(ranges) - 1) as extra, \
+                ThreadPoolExecutor(max_workers=1 + extra) as pool:
+            if extra < len(ranges) - 1:
+                logger.debug(f"Slot liberi per {urlparse(url).netloc}: {1 + extra} segmenti alla volta")
+            futures = [
+                pool.submit(_fetch_segment, url, seg_path, start, end, validator, on_chunk)
+                for (_, start, end), seg_path in zip(ranges, seg_paths)
+            ]
+            for future in futures:
+                future.result()
+
+        with open(part_path, "wb") as out:
+            for seg_path in seg_paths:
+                with open(seg_path, "rb") as f:
+                    for block in iter(lambda: f.read(1024 * 1024), b""):
+                        out.write(block)
+        for seg_path in seg_paths:
+            seg_path.unlink()
+    finally:
+        if progress is None:
+            bar.close()
+
 
 @log_exceptions
-def download_file(url, path, retries=3):
+def download_file(url, path, retries=3, progress=None):
     """
     Scarica un file da un URL remoto e lo salva nel percorso specificato.
     Riprova fino a 'retries' volte in caso di errore.
     Mostra una barra di progresso con il nome del file (non l'intero URL).
     Gestisce il caso in cui content-length non sia disponibile.
+    Se viene passata una barra tqdm in 'progress' (download in parallelo), i byte vengono
+    aggiunti a quella barra condivisa invece di crearne una per file.
+
+    Il download è ripristinabile e verificato:
+    - i dati vengono scritti in '<path>.part' e rinominati in 'path' solo a download completo e verificato
+    - se il trasferimento si interrompe, il tentativo successivo (anche in un'altra esecuzione)
+      riprende dal punto raggiunto con una richiesta Range (If-Range evita di unire versioni diverse)
+    - se il file esiste già, la richiesta è condizionale (If-None-Match / If-Modified-Since):
+      con risposta 304 il file non viene riscaricato
+    - la lunghezza viene confrontata con Content-Length/Content-Range, il Content-MD5 se presente;
+      lunghezza e SHA-256 vengono salvati nel sidecar '<path>.meta.json' per verify_download()
+    - i file di almeno SEGMENT_THRESHOLD byte vengono scaricati in DOWNLOAD_SEGMENTS segmenti paralleli
     """
     path = Path(path)  # assicurarsi che path sia un Path object per .name
+    part_path = path.with_name(path.name + ".part")
+    meta = _load_meta(path)
+    if meta.get("url") != _url_key(url):
+        # Download parziale di un'altra risorsa (o senza validatori): riprenderlo unirebbe file diversi
+        meta = {"url": _url_key(url)}
+        _discard_partial(part_path)
+
     for attempt in range(1, retries + 1):
         logger.debug(f"Tentativo {attempt}/{retries} - Download da URL: {url} -> {path}")
+        written = 0
+        counted_total = 0
+        headers = {}
+
+        # File già presente e integro: richiesta condizionale
+        if path.exists() and meta.get("sha256") and verify_download(path):
+            if meta.get("etag"):
+                headers["If-None-Match"] = meta["etag"]
+            if meta.get("last_modified"):
+                headers["If-Modified-Since"] = meta["last_modified"]
+
+        # Download interrotto in precedenza: ripresa dal byte raggiunto
+        offset = part_path.stat().st_size if part_path.exists() else 0
+        if offset and not headers:
+            headers["Range"] = f"bytes={offset}-"
+            validator = meta.get("etag") or meta.get("last_modified")
+            if validator:
+                headers["If-Range"] = validator
+
         try:
-            response = requests.get(url, stream=True)
-            response.raise_for_status()
-            total_size = response.headers.get('content-length')
-            if total_size is not None:
-                total_size = int(total_size)
-            else:
-                total_size = None  # tqdm gestirà barra senza dimensione
-
-            with open(path, 'wb') as f, tqdm(
-                total=total_size,
-                unit='B',
-                unit_scale=True,
-                unit_divisor=1024,
-                desc=path.name,
-                leave=True,
-            ) as bar:
-                for chunk in response.iter_content(8192):
-                    if chunk:
-                        f.write(chunk)
-                        bar.update(len(chunk))
-
-            logger.info(f"✅ Download completato: {path}")
-            return True
-
-        except requests.exceptions.RequestException as e:
+            # Il with chiude la risposta (e restituisce la connessione al pool) anche in caso di errore
+            with _SESSION.get(url, stream=True, headers=headers, timeout=30) as response:
+                if response.status_code == 304:
+                    logger.info(f"✅ File invariato sul server, download saltato: {path}")
+                    return True
+
+                if response.status_code == 416:
+                    # Range non valido (il file remoto è cambiato o il .part è corrotto): si riparte da zero
+                    part_path.unlink()
+                    raise IncompleteDownload(f"Range non accettato per {path.name}, riparto da zero")
+
+                if response.status_code in (403, 410):
+                    # URL firmato del CDN scaduto: ritentare è inutile, serve un URL nuovo (utils/url_refresher.py)
+                    logger.error(f"❌ URL scaduto o non autorizzato ({response.status_code}): {url}")
+                    return False
+
+                response.raise_for_status()
+
+                if response.status_code == 206:
+                    logger.info(f"Ripresa download di {path.name} da {offset} byte")
+                    expected = response.headers.get("content-range", "").rsplit("/", 1)[-1]
+                    expected = int(expected) if expected.isdigit() else None
+                    mode = "ab"
+                else:
+                    # 200: file intero (il server ha ignorato il Range o la risorsa è cambiata)
+                    offset = 0
+                    expected = response.headers.get("content-length")
+                    expected = int(expected) if expected is not None else None
+                    mode = "wb"
+
+                previous_version = (meta.get("etag"), meta.get("last_modified"))
+                meta.update({
+                    "etag": response.headers.get("etag"),
+                    "last_modified": response.headers.get("last-modified"),
+                    "length": expected,
+                })
+                _save_meta(path, meta)
+
+                total_size = expected - offset if expected is not None else None
+
+                if (mode == "wb" and expected is not None and expected >= SEGMENT_THRESHOLD and DOWNLOAD_SEGMENTS > 1
+                        and response.headers.get("accept-ranges", "").lower() == "bytes"):
+                    # File grande: la risposta viene chiusa subito (la connessione torna al pool)
+                    # e il file scaricato a segmenti in parallelo
+                    response.close()
+                    counted = [0, 0]  # byte aggiunti al totale della barra, byte aggiornati
+                    try:
+                        # I segmenti di un download precedente valgono solo se la versione remota è la stessa
+                        same_version = any(previous_version) and previous_version == (meta["etag"], meta["last_modified"])
+                        _download_segmented(url, part_path, expected, meta.get("etag") or meta.get("last_modified"),
+                                            progress, counted, resume=same_version)
+                    finally:
+                        counted_total, written = counted
+                elif progress is not None:
+                    if total_size:
+                        counted_total = total_size
+                        with progress.get_lock():
+                            progress.total = (progress.total or 0) + total_size
+                            progress.refresh()
+                    with open(part_path, mode) as f:
+                        for chunk in response.iter_content(64 * 1024):
+                            if chunk:
+                                f.write(chunk)
+                                written += len(chunk)
+                                progress.update(len(chunk))
+                else:
+                    with open(part_path, mode) as f, tqdm(
+                        total=expected,
+                        initial=offset,
+                        unit='B',
+                        unit_scale=True,
+                        unit_divisor=1024,
+                        desc=path.name,
+                        leave=True,
+                    ) as bar:
+                        for chunk in response.iter_content(64 * 1024):
+                            if chunk:
+                                f.write(chunk)
+                                bar.update(len(chunk))
+
+                size = part_path.stat().st_size
+                if expected is not None and size != expected:
+                    # Il .part resta: il prossimo tentativo riprende da qui
+                    raise IncompleteDownload(f"File troncato: {size} byte ricevuti su {expected}")
+
+                sha256 = _file_sha256(part_path)
+                content_md5 = response.headers.get("content-md5")
+                if content_md5 and mode == "wb":
+                    md5 = base64.b64encode(_file_sha256(part_path, hashlib.md5()).digest()).decode()
+                    if md5 != content_md5:
+                        part_path.unlink()
+                        raise IncompleteDownload(f"Checksum Content-MD5 non corrispondente per {path.name}")
+
+                os.replace(part_path, path)
+                meta.update({"length": size, "sha256": sha256.hexdigest(), "mtime_ns": path.stat().st_mtime_ns})
+                _save_meta(path, meta)
+
+                logger.info(f"✅ Download completato: {path}")
+                return True
+
+        except (requests.exceptions.RequestException, IncompleteDownload) as e:
             logger.error(f"Errore download {url}: {e}")
+            if progress is not None and (written or counted_total):
+                # I byte mancanti verranno riscaricati al prossimo tentativo
+                with progress.get_lock():
+                    progress.total -= counted_total
+                    progress.update(-written)
             if attempt == retries:
                 logger.error(f"❌ Fallimento download dopo {retries} tentativi")
                 return False
 
 
-@log_exceptions
-def extract_frame(video_path, frame_path):
-    command = [
-        "ffmpeg",
-        "-i", video_path,
-        "-vf", "select=eq(n\\,0)",
-        "-q:v", "3",
-        "-frames:v", "1",
-        frame_path
-    ]
+def read_head(url, max_bytes=RANGE_READ_BYTES):
+    """
+    Legge solo i primi max_bytes di un file remoto con una richiesta HTTP Range.
+    Se il server ignora il Range (risposta 200) la lettura viene comunque interrotta a max_bytes.
+    :return: i byte letti, oppure None in caso di errore.
+    """
     try:
-        subprocess.run(command, check=True, capture_output=True)
-        logger.info(f"✅ Frame estratto: {frame_path}")
-        return True
-    except subprocess.CalledProcessError as e:
-        logger.error(f"❌ Errore estrazione frame: {e}")
-        if e.stderr:
-            logger.debug(f"ffmpeg stderr: {e.stderr.decode('utf-8')}")
-        return False
+        with _SESSION.get(url, headers={"Range": f"bytes=0-{max_bytes - 1}"}, stream=True, timeout=30) as response:
+            response.raise_for_status()
+            data = bytearray()
+            for chunk in response.iter_content(64 * 1024):
+                data.extend(chunk)
+                if len(data) >= max_bytes:
+                    break
+        logger.debug(f"Letti {len(data)} byte iniziali da {url} (status {response.status_code})")
+        return bytes(data[:max_bytes])
+    except requests.exceptions.RequestException as e:
+        logger.warning(f"Lettura parziale fallita per {url}: {e}")
+        return None
 
 
 @log_exceptions
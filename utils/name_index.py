@@ -0,0 +1,150 @@
+import difflib
+import heapq
+import json
+import os
+import threading
+from collections import Counter
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+# Candidati (per numero di trigrammi in comune) su cui si calcola la similitudine esatta
+DEFAULT_CANDIDATES = 30
+
+
+def trigrams(name: str) -> Set[str]:
+    """
+    Trigrammi del nome in minuscolo, con due spazi iniziali e uno finale (così contano anche inizio e fine).
+    """
+    padded = f"  {name.lower()} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class NameIndex:
+    """
+    Indice a trigrammi per la ricerca di nomi simili: invece di confrontare il nome cercato con tutti i nomi
+    (difflib su tutta la lista), si prendono i DEFAULT_CANDIDATES nomi con più trigrammi in comune e la
+    similitudine esatta (SequenceMatcher, come difflib.get_close_matches) si calcola solo su quelli.
+    L'indice si aggiorna un nome alla volta (add) e, con un percorso, viene salvato su disco in JSON.
+
+    Esempio:
+        index = NameIndex("config/client_names_index.json")
+        index.sync(load_client_names())
+        index.search("55 bijou")  # [("55bijoux", 93)]
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path
+        self._lock = threading.RLock()
+        self._names: List[str] = []
+        self._ids: Dict[str, int] = {}
+        self._postings: Dict[str, List[int]] = {}
+        # Numero di trigrammi di ogni nome (per normalizzare i trigrammi in comune)
+        self._sizes: List[int] = []
+        # Dati extra salvati insieme all'indice (es. impronta delle sorgenti dei nomi)
+        self.meta: Dict[str, Any] = {}
+        if path:
+            self._load()
+
+    def __len__(self) -> int:
+        return len(self._names)
+
+    def __contains__(self, name: str) -> bool:
+        return name.lower() in self._ids
+
+    def names(self) -> List[str]:
+        return list(self._names)
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            names, postings = data["names"], data["postings"]
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            logger.warning(f"Indice nomi non leggibile ({e}), verrà ricostruito.")
+            return
+        self._names = names
+        self._ids = {name: i for i, name in enumerate(names)}
+        self._postings = postings
+        self._sizes = [len(trigrams(name)) for name in names]
+        self.meta = data.get("meta", {})
+
+    def save(self):
+        if not self.path:
+            return
+        with self._lock:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            tmp_path = f"{self.path}.{os.getpid()}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"names": self._names, "postings": self._postings, "meta": self.meta}, f, ensure_ascii=False)
+            os.replace(tmp_path, self.path)
+
+    def add(self, name: str) -> bool:
+        """
+        Aggiunge un nome (in minuscolo); False se era già presente.
+        """
+        key = name.lower()
+        with self._lock:
+            if key in self._ids:
+                return False
+            name_id = len(self._names)
+            self._names.append(key)
+            self._ids[key] = name_id
+            grams = trigrams(key)
+            self._sizes.append(len(grams))
+            for gram in grams:
+                self._postings.setdefault(gram, []).append(name_id)
+            return True
+
+    def clear(self):
+        with self._lock:
+            self._names, self._ids, self._postings, self._sizes = [], {}, {}, []
+
+    def sync(self, names: Iterable[str]) -> bool:
+        """
+        Allinea l'indice alla lista di nomi: aggiunge i nuovi e lo ricostruisce solo se qualcuno è stato rimosso.
+        :return: True se l'indice è cambiato.
+        """
+        wanted = {name.lower() for name in names}
+        with self._lock:
+            if wanted.issuperset(self._ids) and len(wanted) == len(self._ids):
+                return False
+            if not wanted.issuperset(self._ids):
+                self.clear()
+            for name in sorted(wanted):
+                self.add(name)
+            return True
+
+    def search(self, query: str, n: int = 5, cutoff: float = 0.6,
+               candidates: int = DEFAULT_CANDIDATES) -> List[Tuple[str, int]]:
+        """
+        Fino a n nomi con similitudine >= cutoff, dal più simile, come (nome, similitudine %).
+        """
+        query = query.lower()
+        query_grams = trigrams(query)
+        with self._lock:
+            counts = Counter()
+            for gram in query_grams:
+                counts.update(self._postings.get(gram, ()))
+            # Coefficiente di Dice: i nomi lunghi non vengono favoriti solo perché hanno più trigrammi
+            best = heapq.nlargest(candidates, counts.items(),
+                                  key=lambda item: item[1] / (len(query_grams) + self._sizes[item[0]]))
+            shortlist = [self._names[name_id] for name_id, _ in best]
+
+        matcher = difflib.SequenceMatcher()
+        matcher.set_seq2(query)
+        scored = []
+        for name in shortlist:
+            matcher.set_seq1(name)
+            # Stessi filtri rapidi di difflib.get_close_matches prima del calcolo completo
+            if matcher.real_quick_ratio() >= cutoff and matcher.quick_ratio() >= cutoff:
+                ratio = matcher.ratio()
+                if ratio >= cutoff:
+                    scored.append((ratio, name))
+        scored.sort(reverse=True)
+        # Percentuale calcolata come in client_utils.find_similar_names (nome cercato come prima sequenza)
+        return [(name, int(difflib.SequenceMatcher(None, query, name).ratio() * 100)) for _, name in scored[:n]]
@@ -1,17 +1,97 @@
-from typing import Tuple
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Tuple
 from copy import deepcopy
-from PyPDF2 import PdfReader, PdfWriter
+import PyPDF2
+from PyPDF2 import PdfReader, PdfWriter, PageObject
+from PyPDF2.generic import (ArrayObject, ContentStream, DecodedStreamObject, DictionaryObject, FloatObject, IndirectObject,
+                            NameObject, NumberObject, StreamObject, TextStringObject)
+from reportlab import rl_config
 from reportlab.pdfgen import canvas
 from reportlab.lib.pagesizes import A4
 from reportlab.pdfbase import pdfmetrics
 from reportlab.pdfbase.ttfonts import TTFont
 from PIL import Image, UnidentifiedImageError
+import decimal
+import hashlib
 import io
 import logging
+import math
 import os
+import threading
+import weakref
 
 logger = logging.getLogger(__name__)
 
+# Template già parsati, per percorso assoluto e data di modifica (un solo parse per processo)
+_TEMPLATE_CACHE: Dict[Tuple[str, float], PdfReader] = {}
+# Font già registrati in ReportLab in questo processo: {nome: percorso}
+_REGISTERED_FONTS: Dict[str, str] = {}
+# Form XObject del template già aggiunti a ciascun writer: {writer: {percorso: numero oggetto}}
+_TEMPLATE_FORMS: "weakref.WeakKeyDictionary[PdfWriter, Dict[str, int]]" = weakref.WeakKeyDictionary()
+# Immagini già incorporate in ciascun writer: {writer: {hash contenuto: numero oggetto}}
+# (solo numeri: un IndirectObject terrebbe vivo il writer, che è la chiave debole)
+_WRITER_IMAGES: "weakref.WeakKeyDictionary[PdfWriter, Dict[str, int]]" = weakref.WeakKeyDictionary()
+
+# Immagini ricampionate per il PDF, salvate per hash del contenuto originale. Percorso ancorato alla root
+# del progetto (come media_cache.CACHE_DIR): non dipende dalla cartella da cui si lancia il programma
+IMAGE_CACHE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "media", ".pdf_cache")
+# Spazio massimo su disco delle immagini ricampionate (MB), sovrascrivibile con PDF_IMAGE_CACHE_MAX_MB
+DEFAULT_IMAGE_CACHE_MAX_MB = 512
+# Risoluzione di destinazione delle immagini nel box in cui vengono disegnate
+DEFAULT_IMAGE_DPI = 150
+JPEG_QUALITY = 85
+
+# Cache in memoria: {(percorso, mtime, dimensione file): valore}
+_IMAGE_SIZES: Dict[Tuple[str, float, int], Tuple[int, int]] = {}
+_IMAGE_DIGESTS: Dict[Tuple[str, float, int], str] = {}
+
+# Cache delle immagini ricampionate, una per cartella (IMAGE_CACHE_DIR può essere cambiata, es. benchmark)
+_IMAGE_CACHES: Dict[str, "MediaCache"] = {}
+_IMAGE_CACHES_LOCK = threading.Lock()
+# Overlay in corso che hanno disattivato la codifica ASCII85 di reportlab, e valore da ripristinare
+_A85_LOCK = threading.Lock()
+_A85_USERS = 0
+_A85_SAVED = None
+
+
+@contextmanager
+def _overlay_canvas(packet: io.BytesIO, pagesize: Tuple[float, float] = (1920, 1080)):
+    """
+    Canvas reportlab per un overlay, salvato in packet all'uscita (non in caso di errore).
+    Gli stream vengono scritti senza codifica ASCII85, che aumenta di ~25% i JPEG incorporati. reportlab la
+    legge solo dall'impostazione globale rl_config.useA85 (non esiste un'opzione per canvas): viene disattivata
+    finché c'è un overlay in corso e poi ripristinata, così gli altri usi di reportlab nel processo non cambiano.
+    """
+    global _A85_USERS, _A85_SAVED
+    with _A85_LOCK:
+        if _A85_USERS == 0:
+            _A85_SAVED = rl_config.useA85
+            rl_config.useA85 = 0
+        _A85_USERS += 1
+    try:
+        can = canvas.Canvas(packet, pagesize=pagesize)
+        yield can
+        can.save()
+    finally:
+        with _A85_LOCK:
+            _A85_USERS -= 1
+            if _A85_USERS == 0:
+                rl_config.useA85 = _A85_SAVED
+
+
+def _image_cache() -> "MediaCache":
+    # Import locale: utils.media_cache porta con sé client_utils, requests e tqdm, che a step8 e al worker
+    # non servono finché non c'è un'immagine da ricampionare
+    from utils.media_cache import MediaCache
+
+    with _IMAGE_CACHES_LOCK:
+        cache = _IMAGE_CACHES.get(IMAGE_CACHE_DIR)
+        if cache is None:
+            max_bytes = int(os.getenv("PDF_IMAGE_CACHE_MAX_MB", DEFAULT_IMAGE_CACHE_MAX_MB)) * 1024 * 1024
+            # pin=False: reportlab legge l'immagine appena la riceve, dopo può essere rimossa
+            cache = _IMAGE_CACHES[IMAGE_CACHE_DIR] = MediaCache(IMAGE_CACHE_DIR, max_bytes=max_bytes, pin=False)
+        return cache
+
 
 def register_font(name: str, path: str):
     """
@@ -19,8 +99,12 @@ def register_font(name: str, path: str):
     :param name: Nome del font da usare poi in add_text.
     :param path: Percorso del file .ttf del font.
     """
+    if _REGISTERED_FONTS.get(name) == path:
+        # Già registrato in questo processo (es. worker.py): il file .ttf non viene riletto
+        return
     try:
         pdfmetrics.registerFont(TTFont(name, path))
+        _REGISTERED_FONTS[name] = path
         logger.info(f"Font '{name}' registrato da '{path}'.")
     except Exception as e:
         logger.error(f"Errore registrando font '{name}': {e}")
@@ -45,14 +129,117 @@ def load_template(path: str) -> PdfReader:
         raise
 
 
+def get_template(path: str) -> PdfReader:
+    """
+    Restituisce il template PDF, parsandolo solo alla prima richiesta nel processo.
+    ATTENZIONE: il reader è condiviso, non va modificato.
+    :param path: Percorso del file PDF template.
+    :return: PdfReader condiviso.
+    """
+    try:
+        # Con la data di modifica nella chiave un processo di lunga durata (worker.py) vede i template aggiornati
+        key = (os.path.abspath(path), os.path.getmtime(path))
+    except OSError:
+        return load_template(path)
+    if key not in _TEMPLATE_CACHE:
+        _TEMPLATE_CACHE[key] = load_template(path)
+    return _TEMPLATE_CACHE[key]
+
+
+def get_template_size(path: str) -> Tuple[float, float]:
+    """
+    Restituisce (larghezza, altezza) della prima pagina del template, dalla cache.
+    """
+    mediabox = get_template(path).pages[0].mediabox
+    return float(mediabox.right) - float(mediabox.left), float(mediabox.top) - float(mediabox.bottom)
+
+
+def _add_object(pdf_writer: PdfWriter, obj):
+    """
+    Aggiunge un oggetto al writer come oggetto indiretto e ne restituisce il riferimento.
+    Serve per lo sfondo condiviso del template e per i /Contents delle pagine, che devono essere
+    oggetti indiretti. pypdf (successore di PyPDF2) ha il metodo pubblico add_object; PyPDF2 3.0.x
+    solo _add_object, privato: viene usato solo qui e solo con la versione indicata in requirements.txt.
+    """
+    if hasattr(pdf_writer, "add_object"):
+        return pdf_writer.add_object(obj)
+    if not PyPDF2.__version__.startswith("3.0.") or not hasattr(pdf_writer, "_add_object"):
+        raise RuntimeError(
+            f"PyPDF2 {PyPDF2.__version__} non supportato: manca PdfWriter.add_object "
+            "(installare la versione di requirements.txt)"
+        )
+    return pdf_writer._add_object(obj)
+
+
+def _get_template_form(pdf_writer: PdfWriter, template_path: str):
+    """
+    Restituisce il riferimento al form XObject con lo sfondo del template per questo writer.
+    Il form viene creato una sola volta per writer e condiviso da tutte le sue pagine.
+    """
+    forms = _TEMPLATE_FORMS.setdefault(pdf_writer, {})
+    key = os.path.abspath(template_path)
+    if key in forms:
+        return IndirectObject(forms[key], 0, pdf_writer)
+
+    template_pdf = get_template(template_path)
+    if len(template_pdf.pages) != 1:
+        logger.warning("Template PDF contiene più di una pagina. Verrà usata solo la prima.")
+    base_page = template_pdf.pages[0]
+
+    content = DecodedStreamObject()
+    contents = base_page.get_contents()
+    content.set_data(ContentStream(contents, template_pdf).get_data() if contents is not None else b"")
+    form = content.flate_encode()
+    form.update({
+        NameObject("/Type"): NameObject("/XObject"),
+        NameObject("/Subtype"): NameObject("/Form"),
+        NameObject("/FormType"): NumberObject(1),
+        NameObject("/BBox"): ArrayObject(FloatObject(v) for v in base_page.mediabox),
+        NameObject("/Resources"): base_page.get("/Resources", DictionaryObject()).clone(pdf_writer),
+    })
+    form_ref = _add_object(pdf_writer, form)
+    forms[key] = form_ref.idnum
+    logger.info(f"Template '{template_path}' aggiunto al PDF come form XObject condiviso.")
+    return form_ref
+
+
+def add_template_page(pdf_writer: PdfWriter, template_path: str) -> int:
+    """
+    Aggiunge al writer una pagina con lo sfondo del template.
+    La pagina non copia il template ma referenzia un form XObject condiviso,
+    quindi la dimensione del PDF non cresce con il numero di pagine.
+    :param pdf_writer: PdfWriter su cui lavorare.
+    :param template_path: Percorso del file PDF template.
+    :return: indice della pagina aggiunta.
+    """
+    form_ref = _get_template_form(pdf_writer, template_path)
+    base_page = get_template(template_path).pages[0]
+
+    page = PageObject.create_blank_page(pdf_writer, 1, 1)
+    page[NameObject("/MediaBox")] = base_page.mediabox
+    if "/Rotate" in base_page:
+        page[NameObject("/Rotate")] = NumberObject(base_page["/Rotate"])
+
+    content = DecodedStreamObject()
+    content.set_data(b"q /Template Do Q")
+    page[NameObject("/Contents")] = _add_object(pdf_writer, content)
+    page[NameObject("/Resources")] = DictionaryObject({
+        NameObject("/XObject"): DictionaryObject({NameObject("/Template"): form_ref}),
+    })
+
+    pdf_writer.add_page(page)
+    return len(pdf_writer.pages) - 1
+
+
 def duplicate_template(template_path: str, copies: int) -> PdfWriter:
     """
     Duplica la prima pagina del template per creare un PDF multipagina.
+    Per generare molte pagine preferire add_template_page (sfondo condiviso, nessuna copia).
     :param template_path: Percorso del file PDF template.
     :param copies: Numero di copie da creare.
     :return: PdfWriter pronto per modifiche.
     """
-    template_pdf = load_template(template_path)
+    template_pdf = get_template(template_path)
     if len(template_pdf.pages) != 1:
         logger.warning("Template PDF contiene più di una pagina. Verrà usata solo la prima.")
 
@@ -65,6 +252,316 @@ def duplicate_template(template_path: str, copies: int) -> PdfWriter:
     return writer
 
 
+def _file_key(image_path: str) -> Tuple[str, float, int]:
+    stat = os.stat(image_path)
+    return os.path.abspath(image_path), stat.st_mtime, stat.st_size
+
+
+def get_image_size(image_path: str) -> Tuple[int, int]:
+    """
+    Restituisce (larghezza, altezza) in pixel dell'immagine, aprendola una sola volta
+    finché il file non cambia.
+    """
+    key = _file_key(image_path)
+    if key not in _IMAGE_SIZES:
+        with Image.open(image_path) as img:
+            _IMAGE_SIZES[key] = img.size
+    return _IMAGE_SIZES[key]
+
+
+def _image_digest(image_path: str) -> str:
+    key = _file_key(image_path)
+    if key not in _IMAGE_DIGESTS:
+        with open(image_path, "rb") as f:
+            _IMAGE_DIGESTS[key] = hashlib.sha1(f.read()).hexdigest()
+    return _IMAGE_DIGESTS[key]
+
+
+def prepare_image(image_path: str, box_size: Tuple[float, float], dpi: int = DEFAULT_IMAGE_DPI) -> str:
+    """
+    Restituisce un'immagine adatta al box di destinazione (in punti PDF) alla risoluzione 'dpi'.
+    Se l'originale è più grande del necessario viene ricampionato e salvato come JPEG
+    in IMAGE_CACHE_DIR (MediaCache con budget PDF_IMAGE_CACHE_MAX_MB), con chiave basata sull'hash
+    del contenuto: lo stesso file non viene ricampionato due volte, anche tra esecuzioni diverse.
+    :param image_path: Percorso dell'immagine originale.
+    :param box_size: (larghezza, altezza) del box in punti.
+    :param dpi: Risoluzione di destinazione.
+    :return: percorso dell'immagine da incorporare (l'originale se già adeguata).
+    """
+    img_width, img_height = get_image_size(image_path)
+    box_width, box_height = box_size
+    ratio = min(box_width / img_width, box_height / img_height)
+
+    target_width = max(1, math.ceil(img_width * ratio / 72 * dpi))
+    target_height = max(1, math.ceil(img_height * ratio / 72 * dpi))
+    if target_width >= img_width or target_height >= img_height:
+        logger.debug(f"prepare_image: '{image_path}' già entro {dpi} dpi ({img_width}x{img_height}), uso l'originale")
+        return image_path
+
+    cache = _image_cache()
+    key = f"{_image_digest(image_path)}_{target_width}x{target_height}"
+    cached_path = cache.get(key, "resized")
+    if cached_path is not None:
+        logger.debug(f"prepare_image: uso immagine ricampionata in cache '{cached_path}'")
+        return str(cached_path)
+
+    with Image.open(image_path) as img:
+        if img.mode in ("RGBA", "LA") or "transparency" in img.info:
+            # La trasparenza non è supportata dal JPEG: si mantiene l'originale
+            logger.debug(f"prepare_image: '{image_path}' ha canale alpha, uso l'originale")
+            return image_path
+        resized = img.convert("RGB").resize((target_width, target_height), Image.LANCZOS)
+
+    tmp_path = os.path.join(IMAGE_CACHE_DIR, f"{key}.{os.getpid()}.{threading.get_ident()}.tmp")
+    resized.save(tmp_path, "JPEG", quality=JPEG_QUALITY, optimize=True)
+    cached_path = cache.put(key, "resized", tmp_path, ext=".jpg")
+    logger.info(f"Immagine '{image_path}' ricampionata {img_width}x{img_height} -> {target_width}x{target_height} ({dpi} dpi)")
+    return str(cached_path)
+
+
+def _xobject_digest(xobject) -> str:
+    """
+    Hash del contenuto di un XObject (dati dello stream più XObject annidati, es. l'immagine
+    dentro il form generato da reportlab).
+    """
+    digest = hashlib.sha1(xobject.get_data() if hasattr(xobject, "get_data") else b"")
+    nested = xobject.get("/Resources", DictionaryObject()).get("/XObject", DictionaryObject())
+    for name in sorted(nested.keys()):
+        digest.update(name.encode())
+        digest.update(_xobject_digest(nested[name]).encode())
+    return digest.hexdigest()
+
+
+def _check_page(pdf_writer: PdfWriter, page_index: int):
+    if not isinstance(pdf_writer, PdfWriter):
+        raise TypeError("pdf_writer deve essere un'istanza di PdfWriter.")
+    if page_index >= len(pdf_writer.pages) or page_index < 0:
+        raise IndexError(f"page_index {page_index} fuori range (0-{len(pdf_writer.pages)-1}).")
+
+
+def _merge_overlay(pdf_writer: PdfWriter, page_index: int, overlay: bytes):
+    """
+    Unisce la prima pagina di un PDF overlay (in memoria) alla pagina indicata del writer.
+    Risorse e annotazioni dell'overlay vengono clonate subito nel writer: il reader
+    temporaneo non resta referenziato e non viene risolto (per hash) al salvataggio.
+    """
+    overlay_pdf = PdfReader(io.BytesIO(overlay))
+    overlay_page = overlay_pdf.pages[0]
+
+    page2 = PageObject(pdf_writer)
+    page2[NameObject("/MediaBox")] = overlay_page.mediabox
+    page2[NameObject("/Contents")] = overlay_page[NameObject("/Contents")].get_object()
+    if "/Resources" in overlay_page:
+        resources = overlay_page["/Resources"]
+        # Le immagini già presenti nel writer vengono referenziate invece che incorporate di nuovo
+        known_images = _WRITER_IMAGES.setdefault(pdf_writer, {})
+        new_images = {}
+        xobjects = resources.get("/XObject", DictionaryObject())
+        for name in list(xobjects.keys()):
+            digest = _xobject_digest(xobjects[name])
+            if digest in known_images:
+                xobjects[NameObject(name)] = IndirectObject(known_images[digest], 0, pdf_writer)
+                logger.debug(f"_merge_overlay: immagine {name} già incorporata, riuso il riferimento")
+            else:
+                new_images[name] = digest
+
+        page2[NameObject("/Resources")] = resources.clone(pdf_writer)
+        for name, digest in new_images.items():
+            known_images[digest] = page2["/Resources"]["/XObject"].raw_get(name).idnum
+    if "/Annots" in overlay_page:
+        page2[NameObject("/Annots")] = overlay_page["/Annots"].clone(pdf_writer)
+    # id() del reader potrebbe essere riusato da un reader successivo
+    pdf_writer.reset_translation(overlay_pdf)
+
+    page = pdf_writer.pages[page_index]
+    page.merge_page(page2)
+    # merge_page lascia /Contents come stream diretto: gli stream devono essere oggetti indiretti
+    page[NameObject("/Contents")] = _add_object(pdf_writer, page[NameObject("/Contents")])
+
+
+def merge_overlay(pdf_writer: PdfWriter, page_index: int, overlay: bytes):
+    """
+    Unisce alla pagina indicata un overlay già renderizzato in memoria
+    (es. PageComposer.render_overlay eseguito in un altro processo).
+    """
+    try:
+        _check_page(pdf_writer, page_index)
+        _merge_overlay(pdf_writer, page_index, overlay)
+        logger.debug(f"merge_overlay: merge pagina {page_index} completato con successo")
+    except Exception as e:
+        logger.error(f"Errore in merge_overlay: {e}")
+
+
+def _draw_text(can: canvas.Canvas, text: str, position: Tuple[int, int], font: str, size: int,
+               align: str, color: Tuple[float, float, float]):
+    can.setFont(font, size)
+
+    # Set color
+    r, g, b = color
+    can.setFillColorRGB(r, g, b)
+    logger.debug(f"add_text: colore impostato a RGB({r}, {g}, {b})")
+
+    line_height = size * 1.2
+    x, y = position
+    lines = text.split('\n')
+    for i, line in enumerate(lines):
+        line_y = y - i * line_height
+        if align == "center":
+            text_width = pdfmetrics.stringWidth(line, font, size)
+            x_pos = x - (text_width / 2)
+        else:
+            x_pos = x
+        can.drawString(x_pos, line_y, line)
+        logger.debug(f"add_text: riga {i+1}/{len(lines)} '{line}' a ({x_pos}, {line_y}), font={font}, size={size}, align={align}")
+
+
+def _draw_image(can: canvas.Canvas, image_path: str, position: Tuple[int, int], size: Tuple[int, int],
+                dpi: int = DEFAULT_IMAGE_DPI):
+    if not os.path.isfile(image_path):
+        raise FileNotFoundError(f"File immagine non trovato: {image_path}")
+
+    img_width, img_height = get_image_size(image_path)
+    logger.debug(f"add_image: apertura immagine '{image_path}', dimensioni originali: {img_width}x{img_height}")
+
+    box_width, box_height = size
+    ratio = min(box_width / img_width, box_height / img_height)
+
+    new_width = img_width * ratio
+    new_height = img_height * ratio
+
+    x = position[0] + (box_width - new_width) / 2
+    y = position[1] + (box_height - new_height) / 2
+
+    logger.debug(f"add_image: rapporto ridimensionamento: {ratio:.3f}, dimensioni adattate: {new_width:.1f}x{new_height:.1f}")
+    logger.debug(f"add_image: posizione finale immagine (x={x:.1f}, y={y:.1f})")
+
+    embed_path = prepare_image(image_path, size, dpi) if dpi else image_path
+    can.drawImage(embed_path, x, y, width=new_width, height=new_height, preserveAspectRatio=True, mask='auto')
+
+
+def _draw_hyperlink(can: canvas.Canvas, text: str, position: Tuple[int, int], font: str, size: int, url: str,
+                    align: str, color: Tuple[float, float, float], underline: bool):
+    if not url:
+        logger.warning("add_hyperlink: URL vuoto, link non aggiunto.")
+
+    can.setFont(font, size)
+    r, g, b = color
+    can.setFillColorRGB(r, g, b)
+    logger.debug(f"add_hyperlink: colore impostato a RGB({r}, {g}, {b})")
+
+    x, y = position
+    lines = text.split('\n')
+    line_height = size * 1.2
+
+    for i, line in enumerate(lines):
+        line_y = y - i * line_height
+        text_width = pdfmetrics.stringWidth(line, font, size)
+        if align == "center":
+            x_pos = x - (text_width / 2)
+        else:
+            x_pos = x
+
+        can.drawString(x_pos, line_y, line)
+        logger.debug(f"add_hyperlink: riga {i+1}/{len(lines)} '{line}' a ({x_pos}, {line_y}), font={font}, size={size}, align={align}")
+
+        if underline:
+            underline_y = line_y - 2  # circa 2 punti sotto la baseline del testo
+            can.setStrokeColorRGB(1, 1, 1)  # imposta il colore della linea a bianco
+            can.setLineWidth(1)             # opzionale, imposta lo spessore della linea
+            can.line(x_pos, underline_y, x_pos + text_width, underline_y)
+            logger.debug(f"add_hyperlink: sottolineatura bianca aggiunta per '{line}' a ({x_pos}, {underline_y})")
+
+        # Definisci area rettangolare cliccabile per ogni riga di testo
+        rect = (x_pos, line_y, x_pos + text_width, line_y + size)
+        can.linkURL(url, rect, relative=0)
+        logger.debug(f"add_hyperlink: link URL '{url}' aggiunto nell’area {rect}")
+
+
+class PageComposer:
+    """
+    Raccoglie tutte le operazioni di disegno di una pagina (testo, immagini, link)
+    e le renderizza in un unico canvas, seguito da un solo merge sulla pagina PDF.
+    Evita il ciclo canvas -> serializzazione -> PdfReader -> merge_page per ogni elemento.
+
+    Esempio:
+        page = PageComposer()
+        page.add_text("Titolo", (80, 900), "Montserrat-Bold", 80)
+        page.add_image("media/cliente/post_1.jpg", (80, 270), (432, 540))
+        page.render(pdf_writer, 0)
+    """
+
+    def __init__(self, pagesize: Tuple[int, int] = (1920, 1080)):
+        self.pagesize = pagesize
+        self._operations = []
+
+    def __len__(self) -> int:
+        return len(self._operations)
+
+    def add_text(self, text: str, position: Tuple[int, int], font: str = "Helvetica", size: int = 12,
+                 align: str = "left", color: Tuple[float, float, float] = (0, 0, 0)):
+        """
+        Accoda un testo (stessi parametri di add_text, senza writer e pagina).
+        """
+        logger.debug(f"PageComposer.add_text: testo: '{text}', posizione: {position}, font: {font}, size: {size}, align: {align}, color: {color}")
+        self._operations.append(("add_text", _draw_text, (text, position, font, size, align, color)))
+        return self
+
+    def add_image(self, image_path: str, position: Tuple[int, int], size: Tuple[int, int],
+                  dpi: int = DEFAULT_IMAGE_DPI):
+        """
+        Accoda un'immagine (stessi parametri di add_image, senza writer e pagina).
+        """
+        logger.debug(f"PageComposer.add_image: immagine: '{image_path}', posizione: {position}, size: {size}, dpi: {dpi}")
+        self._operations.append(("add_image", _draw_image, (image_path, position, size, dpi)))
+        return self
+
+    def add_hyperlink(self, text: str, position: Tuple[int, int], font: str = "Helvetica", size: int = 12,
+                      url: str = "", align: str = "left", color: Tuple[float, float, float] = (0, 0, 0),
+                      underline: bool = False):
+        """
+        Accoda un testo con hyperlink (stessi parametri di add_hyperlink, senza writer e pagina).
+        """
+        logger.debug(f"PageComposer.add_hyperlink: testo: '{text}', url: {url}, posizione: {position}, font: {font}, size: {size}, align: {align}, color: {color}, underline: {underline}")
+        self._operations.append(("add_hyperlink", _draw_hyperlink, (text, position, font, size, url, align, color, underline)))
+        return self
+
+    def render_overlay(self) -> bytes:
+        """
+        Disegna tutte le operazioni accodate in un unico canvas e restituisce il PDF overlay in memoria.
+        Un errore su una singola operazione viene loggato e non blocca le altre.
+        """
+        packet = io.BytesIO()
+        with _overlay_canvas(packet, self.pagesize) as can:
+            for name, draw, params in self._operations:
+                can.saveState()
+                try:
+                    draw(can, *params)
+                except FileNotFoundError as fnf_err:
+                    logger.error(f"File immagine non trovato: {fnf_err}")
+                except UnidentifiedImageError as img_err:
+                    logger.error(f"Errore immagine non riconosciuta o corrotta: {img_err}")
+                except Exception as e:
+                    logger.error(f"Errore in {name}: {e}")
+                finally:
+                    can.restoreState()
+        logger.debug(f"PageComposer: {len(self._operations)} operazioni renderizzate in un unico canvas")
+        return packet.getvalue()
+
+    def render(self, pdf_writer: PdfWriter, page_index: int):
+        """
+        Renderizza le operazioni accodate e le unisce alla pagina indicata con un solo merge.
+        """
+        try:
+            _check_page(pdf_writer, page_index)
+            if not self._operations:
+                logger.debug("PageComposer: nessuna operazione da renderizzare.")
+                return
+            _merge_overlay(pdf_writer, page_index, self.render_overlay())
+            logger.debug(f"PageComposer: merge pagina {page_index} completato con successo")
+        except Exception as e:
+            logger.error(f"Errore in PageComposer.render: {e}")
+
+
 def add_text(pdf_writer: PdfWriter, text: str, page_index: int, position: Tuple[int, int],
              font: str = "Helvetica", size: int = 12, align: str = "left",
              color: Tuple[float, float, float] = (0, 0, 0)):
@@ -72,42 +569,17 @@ def add_text(pdf_writer: PdfWriter, text: str, page_index: int, position: Tuple[
     Aggiunge testo in posizione specifica su pagina PDF (multipagina supportata).
     Supporta l’allineamento orizzontale: "left" (default) o "center".
     Supporta il colore testo RGB con valori da 0 a 1.
+    Per più elementi sulla stessa pagina preferire PageComposer (un solo merge).
     """
     try:
         logger.debug(f"add_text: pagina {page_index}, testo: '{text}', posizione: {position}, font: {font}, size: {size}, align: {align}, color: {color}")
-        if not isinstance(pdf_writer, PdfWriter):
-            raise TypeError("pdf_writer deve essere un'istanza di PdfWriter.")
-        if page_index >= len(pdf_writer.pages) or page_index < 0:
-            raise IndexError(f"page_index {page_index} fuori range (0-{len(pdf_writer.pages)-1}).")
+        _check_page(pdf_writer, page_index)
 
         packet = io.BytesIO()
-        can = canvas.Canvas(packet, pagesize=(1920, 1080))
-        can.setFont(font, size)
-
-        # Set color
-        r, g, b = color
-        can.setFillColorRGB(r, g, b)
-        logger.debug(f"add_text: colore impostato a RGB({r}, {g}, {b})")
-
-        line_height = size * 1.2
-        x, y = position
-        lines = text.split('\n')
-        for i, line in enumerate(lines):
-            line_y = y - i * line_height
-            if align == "center":
-                text_width = pdfmetrics.stringWidth(line, font, size)
-                x_pos = x - (text_width / 2)
-            else:
-                x_pos = x
-            can.drawString(x_pos, line_y, line)
-            logger.debug(f"add_text: riga {i+1}/{len(lines)} '{line}' a ({x_pos}, {line_y}), font={font}, size={size}, align={align}")
-
-        can.save()
+        with _overlay_canvas(packet) as can:
+            _draw_text(can, text, position, font, size, align, color)
 
-        packet.seek(0)
-        overlay_pdf = PdfReader(packet)
-        overlay_page = overlay_pdf.pages[0]
-        pdf_writer.pages[page_index].merge_page(overlay_page)
+        _merge_overlay(pdf_writer, page_index, packet.getvalue())
         logger.debug("add_text: merge pagina completato con successo")
         logger.debug("add_text: testo aggiunto con successo.")
     except Exception as e:
@@ -115,46 +587,21 @@ def add_text(pdf_writer: PdfWriter, text: str, page_index: int, position: Tuple[
 
 
 def add_image(pdf_writer: PdfWriter, image_path: str, page_index: int, position: Tuple[int, int],
-              size: Tuple[int, int]):
+              size: Tuple[int, int], dpi: int = DEFAULT_IMAGE_DPI):
     """
     Inserisce un'immagine mantenendo proporzioni, gestendo errori di caricamento.
+    L'immagine viene ricampionata a 'dpi' per il box di destinazione (None = originale).
     """
     try:
         logger.debug(f"add_image: pagina {page_index}, immagine: '{image_path}', posizione: {position}, size: {size}")
-        if not isinstance(pdf_writer, PdfWriter):
-            raise TypeError("pdf_writer deve essere un'istanza di PdfWriter.")
-        if page_index >= len(pdf_writer.pages) or page_index < 0:
-            raise IndexError(f"page_index {page_index} fuori range (0-{len(pdf_writer.pages)-1}).")
-        if not os.path.isfile(image_path):
-            raise FileNotFoundError(f"File immagine non trovato: {image_path}")
-
-        img = Image.open(image_path)
-        img_width, img_height = img.size
-        logger.debug(f"add_image: apertura immagine '{image_path}', dimensioni originali: {img_width}x{img_height}")
-
-        box_width, box_height = size
-        ratio = min(box_width / img_width, box_height / img_height)
-
-        new_width = img_width * ratio
-        new_height = img_height * ratio
-
-        x = position[0] + (box_width - new_width) / 2
-        y = position[1] + (box_height - new_height) / 2
-
-        logger.debug(f"add_image: rapporto ridimensionamento: {ratio:.3f}, dimensioni adattate: {new_width:.1f}x{new_height:.1f}")
-        logger.debug(f"add_image: posizione finale immagine (x={x:.1f}, y={y:.1f})")
+        _check_page(pdf_writer, page_index)
 
         packet = io.BytesIO()
-        can = canvas.Canvas(packet, pagesize=(1920, 1080))
-        can.drawImage(image_path, x, y, width=new_width, height=new_height, preserveAspectRatio=True, mask='auto')
-        logger.debug("add_image: inizio salvataggio overlay canvas")
-
-        can.save()
+        with _overlay_canvas(packet) as can:
+            _draw_image(can, image_path, position, size, dpi)
+            logger.debug("add_image: inizio salvataggio overlay canvas")
 
-        packet.seek(0)
-        overlay_pdf = PdfReader(packet)
-        overlay_page = overlay_pdf.pages[0]
-        pdf_writer.pages[page_index].merge_page(overlay_page)
+        _merge_overlay(pdf_writer, page_index, packet.getvalue())
         logger.debug("add_image: immagine aggiunta con successo.")
 
     except FileNotFoundError as fnf_err:
@@ -183,58 +630,321 @@ def add_hyperlink(pdf_writer: PdfWriter, text: str, page_index: int, position: T
     """
     try:
         logger.debug(f"add_hyperlink: pagina {page_index}, testo: '{text}', url: {url}, posizione: {position}, font: {font}, size: {size}, align: {align}, color: {color}, underline: {underline}")
-        if not isinstance(pdf_writer, PdfWriter):
-            raise TypeError("pdf_writer deve essere un'istanza di PdfWriter.")
-        if page_index >= len(pdf_writer.pages) or page_index < 0:
-            raise IndexError(f"page_index {page_index} fuori range (0-{len(pdf_writer.pages)-1}).")
-        if not url:
-            logger.warning("add_hyperlink: URL vuoto, link non aggiunto.")
+        _check_page(pdf_writer, page_index)
 
         packet = io.BytesIO()
-        can = canvas.Canvas(packet, pagesize=(1920, 1080))
-        can.setFont(font, size)
-        r, g, b = color
-        can.setFillColorRGB(r, g, b)
-        logger.debug(f"add_hyperlink: colore impostato a RGB({r}, {g}, {b})")
-
-        x, y = position
-        lines = text.split('\n')
-        line_height = size * 1.2
-
-        for i, line in enumerate(lines):
-            line_y = y - i * line_height
-            text_width = pdfmetrics.stringWidth(line, font, size)
-            if align == "center":
-                x_pos = x - (text_width / 2)
-            else:
-                x_pos = x
+        with _overlay_canvas(packet) as can:
+            _draw_hyperlink(can, text, position, font, size, url, align, color, underline)
+
+        _merge_overlay(pdf_writer, page_index, packet.getvalue())
+        logger.debug("add_hyperlink: link aggiunto con successo.")
 
-            can.drawString(x_pos, line_y, line)
-            logger.debug(f"add_hyperlink: riga {i+1}/{len(lines)} '{line}' a ({x_pos}, {line_y}), font={font}, size={size}, align={align}")
+    except Exception as e:
+        logger.error(f"Errore in add_hyperlink: {e}")
 
-            if underline:
-                text_width = pdfmetrics.stringWidth(line, font, size)
-                underline_y = line_y - 2  # circa 2 punti sotto la baseline del testo
-                can.setStrokeColorRGB(1, 1, 1)  # imposta il colore della linea a bianco
-                can.setLineWidth(1)             # opzionale, imposta lo spessore della linea
-                can.line(x_pos, underline_y, x_pos + text_width, underline_y)
-                logger.debug(f"add_hyperlink: sottolineatura bianca aggiunta per '{line}' a ({x_pos}, {underline_y})")
 
-            # Definisci area rettangolare cliccabile per ogni riga di testo
-            rect = (x_pos, line_y, x_pos + text_width, line_y + size)
-            can.linkURL(url, rect, relative=0)
-            logger.debug(f"add_hyperlink: link URL '{url}' aggiunto nell’area {rect}")
+# Riferimento all'albero delle pagine nelle pagine serializzate: il numero lo assegna StreamingPdfWriter
+_PAGES_REF = -1
+# Numeri, nomi e stringhe PDF (sottoclassi dei tipi built-in) non vanno tradotti. Il controllo sui tipi
+# built-in è molto più veloce di isinstance sulle classi PyPDF2, che passa da typing.Protocol
+_SCALAR_TYPES = (int, str, bytes, decimal.Decimal)
 
-        can.save()
 
-        packet.seek(0)
-        overlay_pdf = PdfReader(packet)
-        overlay_page = overlay_pdf.pages[0]
-        pdf_writer.pages[page_index].merge_page(overlay_page)
-        logger.debug("add_hyperlink: link aggiunto con successo.")
+class _LocalRef(IndirectObject):
+    """
+    Riferimento a un oggetto di una pagina serializzata (serialize_page): non scrive nulla,
+    registra solo la posizione in cui StreamingPdfWriter inserirà il numero definitivo.
+    """
 
-    except Exception as e:
-        logger.error(f"Errore in add_hyperlink: {e}")
+    def __init__(self, index: int, positions: List[Tuple[int, int]]):
+        super().__init__(index, 0, None)
+        self._positions = positions
+
+    def write_to_stream(self, stream, encryption_key=None):
+        self._positions.append((stream.tell(), self.idnum))
+
+
+class _PageSerializer:
+    """
+    Serializza una pagina e gli oggetti che referenzia in record indipendenti dal file di destinazione:
+    (indice locale, hash, segmenti di byte, indici locali referenziati tra un segmento e l'altro).
+    L'hash di un oggetto include quelli degli oggetti che referenzia, così oggetti identici di pagine
+    diverse hanno lo stesso hash; None se l'oggetto non va condiviso (pagine, annotazioni, riferimenti ciclici).
+    """
+
+    # Oggetti che non devono essere condivisi tra pagine anche se identici
+    _NO_DEDUPE_TYPES = ("/Page", "/Annot")
+    # Filtri che PyPDF2 non decodifica: i dati restano compressi e il filtro viene mantenuto
+    _PASSTHROUGH_FILTERS = ("/DCTDecode", "/JPXDecode")
+
+    def __init__(self):
+        # Record in ordine di scrittura: ogni oggetto dopo quelli che referenzia (salvo cicli)
+        self.records: List[Tuple[int, Optional[str], List[bytes], List[int]]] = []
+        self._memo: Dict[Tuple[int, int], int] = {}
+        self._digests: Dict[int, Optional[str]] = {}
+        self._positions: List[Tuple[int, int]] = []
+        self._next_index = 0
+
+    def _allocate(self) -> int:
+        index = self._next_index
+        self._next_index += 1
+        return index
+
+    def _ref(self, index: int) -> _LocalRef:
+        return _LocalRef(index, self._positions)
+
+    def emit(self, index: int, obj, dedupe: bool):
+        """
+        Serializza un oggetto già tradotto e lo aggiunge ai record.
+        """
+        self._positions.clear()
+        buffer = io.BytesIO()
+        obj.write_to_stream(buffer, None)
+        data = buffer.getvalue()
+
+        chunks, refs, start = [], [], 0
+        for position, ref in self._positions:
+            chunks.append(data[start:position])
+            refs.append(ref)
+            start = position
+        chunks.append(data[start:])
+
+        digest = None
+        # Un oggetto che referenzia un oggetto non condivisibile (o non ancora scritto) non è condivisibile
+        if dedupe and all(self._digests.get(ref) is not None for ref in refs):
+            hasher = hashlib.sha1(chunks[0])
+            for ref, chunk in zip(refs, chunks[1:]):
+                hasher.update(f" {self._digests[ref]} R".encode())
+                hasher.update(chunk)
+            digest = hasher.hexdigest()
+        self._digests[index] = digest
+        self.records.append((index, digest, chunks, refs))
+
+    def translate(self, obj):
+        """
+        Copia un oggetto sostituendo i riferimenti indiretti con riferimenti locali ai record.
+        """
+        if isinstance(obj, _SCALAR_TYPES):
+            return obj
+
+        if isinstance(obj, IndirectObject):
+            key = (id(obj.pdf), obj.idnum)
+            if key in self._memo:
+                # Se l'oggetto è ancora in traduzione (riferimento ciclico) il suo hash non è noto
+                return self._ref(self._memo[key])
+            index = self._memo[key] = self._allocate()
+            translated = self.translate(obj.get_object())
+            dedupe = not (isinstance(translated, DictionaryObject) and translated.get("/Type") in self._NO_DEDUPE_TYPES)
+            self.emit(index, translated, dedupe)
+            return self._ref(index)
+
+        if isinstance(obj, StreamObject):
+            return self._copy_stream(obj)
+
+        if isinstance(obj, DictionaryObject):
+            copy = DictionaryObject()
+            for key, value in obj.items():
+                copy[NameObject(key)] = self.translate(value)
+            return copy
+
+        if isinstance(obj, ArrayObject):
+            return ArrayObject(self.translate(value) for value in obj)
+
+        return obj
+
+    def _copy_stream(self, obj):
+        """
+        Copia uno stream con le sole API pubbliche (get_data/set_data): i dati vengono decodificati e
+        ricompressi con FlateDecode. I filtri che PyPDF2 non decodifica (JPEG, JPEG 2000) restano:
+        get_data() restituisce i loro byte così come sono, dopo aver tolto gli eventuali filtri precedenti.
+        """
+        filters = obj.get("/Filter", ArrayObject())
+        filters = list(filters) if isinstance(filters, ArrayObject) else [filters]
+        parms = obj.get("/DecodeParms")
+        copy = DecodedStreamObject()
+        copy.set_data(obj.get_data())
+        if filters and filters[-1] in self._PASSTHROUGH_FILTERS:
+            copy[NameObject("/Filter")] = NameObject(filters[-1])
+            if isinstance(parms, ArrayObject):
+                parms = parms[-1] if len(parms) == len(filters) else None
+            if parms:
+                copy[NameObject("/DecodeParms")] = self.translate(parms)
+        else:
+            copy = copy.flate_encode()
+        for key, value in obj.items():
+            if key not in ("/Length", "/Filter", "/DecodeParms") and key not in copy:
+                copy[NameObject(key)] = self.translate(value)
+        return copy
+
+    def page(self, page: PageObject):
+        copy = DictionaryObject()
+        for key, value in page.items():
+            if key == "/Parent":
+                continue
+            if isinstance(value, StreamObject):
+                # Gli stream devono essere oggetti indiretti
+                index = self._allocate()
+                self.emit(index, self.translate(value), dedupe=True)
+                value = self._ref(index)
+            else:
+                value = self.translate(value)
+            copy[NameObject(key)] = value
+        copy[NameObject("/Parent")] = self._ref(_PAGES_REF)
+        self.emit(self._allocate(), copy, dedupe=False)
+        return self.records
+
+
+def serialize_page(page: PageObject) -> List[Tuple[int, Optional[str], List[bytes], List[int]]]:
+    """
+    Serializza una pagina (e tutti gli oggetti che referenzia) per StreamingPdfWriter.add_serialized_page.
+    Il risultato contiene solo byte, stringhe e interi: può essere prodotto in un processo del pool
+    e scritto dal processo principale senza parse, hash o compressione.
+    """
+    return _PageSerializer().page(page)
+
+
+class StreamingPdfWriter:
+    """
+    Writer PDF che scrive ogni pagina su disco appena viene aggiunta, senza tenere
+    in memoria il documento completo (a differenza di PdfWriter, che serializza tutto in write()).
+    In memoria restano solo offset e hash degli oggetti già scritti.
+
+    Gli oggetti identici (stesso contenuto, es. sfondo del template, font, immagini)
+    vengono scritti una sola volta e referenziati dalle pagine successive.
+    Il file viene scritto in '<output_path>.part' e rinominato alla chiusura.
+    Le pagine possono essere serializzate altrove (serialize_page, es. nei processi di un pool)
+    e aggiunte con add_serialized_page: qui restano solo numerazione e scrittura dei byte.
+
+    Esempio:
+        with StreamingPdfWriter("output/cliente/catalogo.pdf") as out:
+            for page in pagine:
+                out.add_page(page)
+    """
+
+    def __init__(self, output_path: str):
+        self.output_path = output_path
+        self._part_path = f"{output_path}.part"
+        self._file = open(self._part_path, "wb")
+        self._offsets: Dict[int, int] = {}
+        self._written: Dict[str, int] = {}
+        self._page_numbers = []
+        self._next_number = 1
+        self._pages_number = self._allocate()
+        self.deduplicated = 0
+        self._file.write(b"%PDF-1.7\n%\xe2\xe3\xcf\xd3\n")
+        logger.info(f"StreamingPdfWriter: scrittura progressiva in '{self._part_path}'")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+        return False
+
+    def __len__(self) -> int:
+        return len(self._page_numbers)
+
+    def _allocate(self) -> int:
+        number = self._next_number
+        self._next_number += 1
+        return number
+
+    def _write(self, obj, number: int = None) -> int:
+        """
+        Serializza un oggetto già tradotto (riferimenti a questo file) e ne restituisce il numero.
+        """
+        if number is None:
+            number = self._allocate()
+        self._offsets[number] = self._file.tell()
+        self._file.write(f"{number} 0 obj\n".encode())
+        obj.write_to_stream(self._file, None)
+        self._file.write(b"\nendobj\n")
+        return number
+
+    def add_serialized_page(self, records: List[Tuple[int, Optional[str], List[bytes], List[int]]]):
+        """
+        Scrive su disco una pagina prodotta da serialize_page: assegna i numeri degli oggetti,
+        riusa quelli già scritti con lo stesso hash e scrive i byte così come sono.
+        """
+        numbers: Dict[int, int] = {_PAGES_REF: self._pages_number}
+
+        def number_of(index: int) -> int:
+            if index not in numbers:
+                numbers[index] = self._allocate()
+            return numbers[index]
+
+        for index, digest, chunks, refs in records:
+            # Un oggetto già referenziato (ciclo) ha già il suo numero e va scritto comunque
+            if digest is not None and digest in self._written and index not in numbers:
+                numbers[index] = self._written[digest]
+                self.deduplicated += 1
+                continue
+            number = number_of(index)
+            self._offsets[number] = self._file.tell()
+            self._file.write(f"{number} 0 obj\n".encode())
+            self._file.write(chunks[0])
+            for ref, chunk in zip(refs, chunks[1:]):
+                self._file.write(f"{number_of(ref)} 0 R".encode())
+                self._file.write(chunk)
+            self._file.write(b"\nendobj\n")
+            if digest is not None:
+                self._written[digest] = number
+
+        self._page_numbers.append(numbers[records[-1][0]])
+        logger.debug(f"StreamingPdfWriter: pagina {len(self._page_numbers)} scritta ({self._file.tell()} byte)")
+
+    def add_page(self, page: PageObject):
+        """
+        Scrive su disco la pagina e tutti gli oggetti che referenzia.
+        Dopo la chiamata la pagina (e il writer/reader da cui proviene) possono essere rilasciati.
+        """
+        self.add_serialized_page(serialize_page(page))
+
+    def close(self):
+        """
+        Scrive albero delle pagine, catalogo, xref e trailer e rinomina il file definitivo.
+        """
+        pages = DictionaryObject({
+            NameObject("/Type"): NameObject("/Pages"),
+            NameObject("/Kids"): ArrayObject(IndirectObject(n, 0, None) for n in self._page_numbers),
+            NameObject("/Count"): NumberObject(len(self._page_numbers)),
+        })
+        self._write(pages, number=self._pages_number)
+        catalog = self._write(DictionaryObject({
+            NameObject("/Type"): NameObject("/Catalog"),
+            NameObject("/Pages"): IndirectObject(self._pages_number, 0, None),
+        }))
+        info = self._write(DictionaryObject({
+            NameObject("/Producer"): TextStringObject("meta_metrics_collector"),
+        }))
+
+        xref_offset = self._file.tell()
+        size = self._next_number
+        self._file.write(f"xref\n0 {size}\n0000000000 65535 f \n".encode())
+        for number in range(1, size):
+            self._file.write(f"{self._offsets[number]:010d} 00000 n \n".encode())
+        self._file.write(
+            f"trailer\n<< /Size {size} /Root {catalog} 0 R /Info {info} 0 R >>\n"
+            f"startxref\n{xref_offset}\n%%EOF\n".encode()
+        )
+        self._file.close()
+        os.replace(self._part_path, self.output_path)
+        logger.info(
+            f"PDF salvato con successo in '{self.output_path}' ({len(self._page_numbers)} pagine, "
+            f"{self.deduplicated} oggetti duplicati riusati)."
+        )
+
+    def abort(self):
+        """
+        Chiude e rimuove il file parziale (es. dopo un errore).
+        """
+        self._file.close()
+        if os.path.exists(self._part_path):
+            os.remove(self._part_path)
+        logger.warning(f"StreamingPdfWriter: scrittura annullata, rimosso '{self._part_path}'")
 
 
 def save_pdf(pdf_writer: PdfWriter, output_path: str):
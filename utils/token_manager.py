@@ -0,0 +1,194 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from datetime import datetime
+from typing import Any, Dict, Optional
+
+from utils.api_wrapper import get as api_get
+from utils.client_utils import file_lock
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+DEBUG_TOKEN_URL = "https://graph.facebook.com/v23.0/debug_token"
+# Esito di debug_token per ogni token (per hash: il token non viene mai scritto nella cache)
+TOKEN_CACHE_PATH = "config/token_cache.json"
+
+# Ore per cui l'esito di debug_token resta valido, sovrascrivibile con TOKEN_CACHE_TTL_HOURS
+DEFAULT_TTL_HOURS = 12
+# Giorni prima della scadenza da cui viene mostrato un avviso
+EXPIRY_WARNING_DAYS = 7
+# Codice Graph API di token non valido/scaduto/revocato
+INVALID_TOKEN_CODE = 190
+
+
+def token_hash(token: str) -> str:
+    return hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+
+def mask_token(token: str) -> str:
+    return f"{token[:6]}...{token[-4:]}" if len(token) > 10 else "token non mascherabile"
+
+
+class TokenManager:
+    """
+    Validazione dei token con cache: debug_token viene chiamato una volta sola e scadenza, permessi (scopes)
+    e app_id restano in config/token_cache.json. Finché il dato è più recente del TTL e il token non è
+    scaduto, la validazione non fa nessuna chiamata: più processi batch con lo stesso token non pagano
+    una chiamata ciascuno.
+
+    Esempio:
+        manager = TokenManager()
+        if manager.validate(token):
+            info = manager.info(token)  # {"expires_at", "scopes", "app_id", ...}
+    """
+
+    def __init__(self, cache_path: str = TOKEN_CACHE_PATH, ttl_hours: Optional[float] = None):
+        self.cache_path = cache_path
+        if ttl_hours is None:
+            ttl_hours = float(os.getenv("TOKEN_CACHE_TTL_HOURS", DEFAULT_TTL_HOURS))
+        self.ttl_seconds = ttl_hours * 3600
+        self._lock = threading.Lock()
+        self._cache = self._load()
+
+    def _load(self) -> Dict[str, Dict[str, Any]]:
+        if not os.path.exists(self.cache_path):
+            return {}
+        try:
+            with open(self.cache_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Cache token non leggibile ({e}), i token verranno rivalidati.")
+            return {}
+
+    def _save(self, key: str):
+        """
+        Scrive l'esito del token indicato (o la sua rimozione) sotto lock tra processi, dopo aver riletto
+        il file: gli esiti salvati nel frattempo da altri processi non vanno persi.
+        """
+        os.makedirs(os.path.dirname(self.cache_path), exist_ok=True)
+        with file_lock(f"{self.cache_path}.lock"):
+            cache = self._load()
+            if key in self._cache:
+                cache[key] = self._cache[key]
+            else:
+                cache.pop(key, None)
+            tmp_path = f"{self.cache_path}.{os.getpid()}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(cache, f, ensure_ascii=False, indent=2)
+            os.replace(tmp_path, self.cache_path)
+        self._cache = cache
+
+    @staticmethod
+    def _expires_at(info: Dict[str, Any]) -> int:
+        """
+        Prima scadenza tra token e accesso ai dati (0 = nessuna scadenza).
+        """
+        deadlines = [ts for ts in (info.get("expires_at"), info.get("data_access_expires_at")) if ts]
+        return min(deadlines) if deadlines else 0
+
+    def _is_fresh(self, info: Dict[str, Any]) -> bool:
+        now = time.time()
+        expires_at = self._expires_at(info)
+        if expires_at and now >= expires_at:
+            return False
+        return now - info.get("checked_at", 0) < self.ttl_seconds
+
+    def _inspect(self, token: str) -> Optional[Dict[str, Any]]:
+        """
+        Chiama debug_token. None se la risposta non permette di stabilire la validità (es. limite di chiamate).
+        """
+        data = api_get(DEBUG_TOKEN_URL, params={"input_token": token, "access_token": token})
+        error = data.get("error")
+        if error:
+            if error.get("code") == INVALID_TOKEN_CODE:
+                return {"is_valid": False, "checked_at": time.time(), "error": error.get("message")}
+            logger.warning(f"debug_token non disponibile: {error.get('message')}")
+            return None
+        details = data.get("data", {})
+        return {
+            "is_valid": bool(details.get("is_valid")),
+            "checked_at": time.time(),
+            "expires_at": details.get("expires_at", 0),
+            "data_access_expires_at": details.get("data_access_expires_at", 0),
+            "scopes": details.get("scopes", []),
+            "app_id": details.get("app_id"),
+            "user_id": details.get("user_id"),
+            "type": details.get("type"),
+        }
+
+    def info(self, token: str, refresh: bool = False) -> Optional[Dict[str, Any]]:
+        """
+        Dati del token (validità, scadenza, scopes, app_id), dalla cache se ancora freschi.
+        """
+        key = token_hash(token)
+        with self._lock:
+            cached = self._cache.get(key)
+            if not refresh and not (cached and self._is_fresh(cached)):
+                # Un altro processo potrebbe averlo già validato
+                cached = self._load().get(key) or cached
+                if cached:
+                    self._cache[key] = cached
+            if cached and not refresh and self._is_fresh(cached):
+                logger.debug(f"Token {mask_token(token)} validato dalla cache.")
+                return cached
+
+        info = self._inspect(token)
+        if info is None:
+            # Meglio un esito scaduto di nessun esito: la scadenza resta comunque verificata in validate()
+            return cached
+        with self._lock:
+            self._cache[key] = info
+            self._save(key)
+        return info
+
+    def validate(self, token: str) -> bool:
+        """
+        True se il token è valido; avvisa se scade entro EXPIRY_WARNING_DAYS.
+        """
+        info = self.info(token)
+        if not info or not info.get("is_valid"):
+            return False
+        expires_at = self._expires_at(info)
+        if expires_at:
+            remaining = expires_at - time.time()
+            if remaining <= 0:
+                return False
+            if remaining < EXPIRY_WARNING_DAYS * 86400:
+                logger.warning(
+                    f"⚠️ Il token {mask_token(token)} scade il {datetime.fromtimestamp(expires_at):%Y-%m-%d %H:%M}: "
+                    f"aggiornalo prima di quella data."
+                )
+        return True
+
+    def expiring_soon(self, token: str) -> bool:
+        info = self.info(token) or {}
+        expires_at = self._expires_at(info)
+        return bool(expires_at) and expires_at - time.time() < EXPIRY_WARNING_DAYS * 86400
+
+    def forget(self, token: str):
+        """
+        Rimuove l'esito salvato (es. dopo un errore 190 durante l'esecuzione): la prossima validazione richiama debug_token.
+        """
+        with self._lock:
+            key = token_hash(token)
+            self._cache.pop(key, None)
+            # Anche se in memoria non c'era: potrebbe averlo salvato un altro processo
+            self._save(key)
+
+
+_shared = None
+_shared_lock = threading.Lock()
+
+
+def shared_token_manager() -> TokenManager:
+    """
+    Istanza condivisa da tutto il processo (thread di batch.py e worker.py).
+    """
+    global _shared
+    with _shared_lock:
+        if _shared is None:
+            _shared = TokenManager()
+        return _shared
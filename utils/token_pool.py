@@ -0,0 +1,252 @@
+import json
+import os
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+
+from utils.api_wrapper import DEFAULT_MAX_CALLS_PER_SECOND, RateLimiter
+from utils.logger import get_logger
+from utils.token_manager import mask_token, shared_token_manager
+
+logger = get_logger(__name__)
+
+# Lista dei token del pool: [{"label", "token", "app_id" (opzionale), "clients" (opzionale)}]
+TOKENS_PATH = "config/tokens.json"
+
+# Secondi di esclusione di un token limitato da Meta quando la risposta non indica il tempo di attesa
+DEFAULT_COOLDOWN_SECONDS = 300
+# Le percentuali di utilizzo di Meta si riferiscono all'ultima ora: letture più vecchie non contano
+USAGE_WINDOW_SECONDS = 3600
+
+# Codici Graph API di limite raggiunto (app, utente, pagina, Business Use Case) e di token non valido
+THROTTLE_CODES = {4, 17, 32, 613}
+THROTTLE_CODE_RANGE = range(80000, 80100)
+APP_THROTTLE_CODE = 4
+AUTH_ERROR_CODES = {102, 190}
+
+
+def _is_throttle(code) -> bool:
+    return code in THROTTLE_CODES or code in THROTTLE_CODE_RANGE
+
+
+def _parse_usage(headers) -> Dict[str, Any]:
+    """
+    Utilizzo in percentuale letto dagli header X-App-Usage e X-Business-Use-Case-Usage
+    (massimo tra numero di chiamate, tempo CPU e tempo totale) e attesa stimata in secondi.
+    """
+    usage = {"app": None, "business": None, "regain_seconds": 0}
+    try:
+        app = json.loads(headers.get("X-App-Usage") or "null")
+        if app:
+            usage["app"] = max(app.get("call_count", 0), app.get("total_cputime", 0), app.get("total_time", 0))
+        business = json.loads(headers.get("X-Business-Use-Case-Usage") or "null")
+        for entries in (business or {}).values():
+            for entry in entries:
+                value = max(entry.get("call_count", 0), entry.get("total_cputime", 0), entry.get("total_time", 0))
+                usage["business"] = max(usage["business"] or 0, value)
+                usage["regain_seconds"] = max(usage["regain_seconds"], entry.get("estimated_time_to_regain_access", 0) * 60)
+    except (ValueError, AttributeError, TypeError) as e:
+        logger.debug(f"Header di utilizzo API non leggibili: {e}")
+    return usage
+
+
+@dataclass
+class PooledToken:
+    token: str
+    label: str
+    app_id: Optional[str] = None
+    scopes: List[str] = field(default_factory=list)
+    # Clienti serviti dal token (vuoto = tutti), per i system user con accesso solo ad alcune pagine
+    clients: List[str] = field(default_factory=list)
+    usage: float = 0.0
+    usage_at: float = 0.0
+    cooldown_until: float = 0.0
+    disabled: bool = False
+    assigned: int = 0
+
+
+class TokenPool:
+    """
+    Più token di accesso (app e system user diversi) tra cui distribuire il traffico: i limiti di Meta
+    sono per app e per token, quindi il throughput complessivo cresce con il numero di token.
+    - acquire(): assegna a un cliente il token con più margine (100 - utilizzo riportato da Meta)
+    - observe(): chiamata da utils/api_wrapper.py per ogni risposta; aggiorna l'utilizzo, mette in pausa i token
+      limitati (THROTTLE_CODES) ed esclude quelli non più validi (AUTH_ERROR_CODES)
+    - limiter_for(): budget di chiamate al secondo per app (DEFAULT_MAX_CALLS_PER_SECOND per ogni app)
+
+    Esempio:
+        pool = load_token_pool()
+        token = pool.acquire("55Bijoux")
+        try:
+            ...
+        finally:
+            pool.release(token)
+    """
+
+    def __init__(self):
+        self._tokens: Dict[str, PooledToken] = {}
+        self._app_usage: Dict[str, tuple] = {}
+        self._limiters: Dict[str, RateLimiter] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._tokens)
+
+    def apps(self) -> set:
+        return {entry.app_id for entry in self._tokens.values()}
+
+    def add(self, token: str, label: str = None, app_id: str = None, scopes: List[str] = None,
+            clients: List[str] = None):
+        with self._lock:
+            self._tokens[token] = PooledToken(
+                token=token, label=label or mask_token(token), app_id=app_id,
+                scopes=list(scopes or []), clients=list(clients or []),
+            )
+
+    def _usage(self, entry: PooledToken, now: float) -> float:
+        usage = entry.usage if now - entry.usage_at < USAGE_WINDOW_SECONDS else 0.0
+        app_usage, app_usage_at = self._app_usage.get(entry.app_id, (0.0, 0.0))
+        if now - app_usage_at < USAGE_WINDOW_SECONDS:
+            usage = max(usage, app_usage)
+        return usage
+
+    def acquire(self, client_name: str = None, scope: str = None, max_wait: float = DEFAULT_COOLDOWN_SECONDS) -> Optional[str]:
+        """
+        Token con più margine tra quelli utilizzabili per il cliente (e con il permesso 'scope', se indicato);
+        a parità di margine quello assegnato a meno clienti. Se sono tutti in pausa attende il primo
+        disponibile (al massimo max_wait secondi); None se nessun token è utilizzabile.
+        """
+        deadline = time.monotonic() + max_wait
+        while True:
+            with self._lock:
+                now = time.time()
+                candidates = [
+                    entry for entry in self._tokens.values()
+                    if not entry.disabled
+                    and (not entry.clients or client_name in entry.clients)
+                    and (not scope or not entry.scopes or scope in entry.scopes)
+                ]
+                if not candidates:
+                    logger.error(f"❌ Nessun token utilizzabile per {client_name or 'la richiesta'}.")
+                    return None
+                ready = [entry for entry in candidates if entry.cooldown_until <= now]
+                if ready:
+                    best = max(ready, key=lambda e: (100 - self._usage(e, now), -e.assigned))
+                    best.assigned += 1
+                    logger.info(f"🔑 Token '{best.label}' assegnato a {client_name or 'la richiesta'} "
+                                f"(utilizzo {self._usage(best, now):.0f}%)")
+                    return best.token
+                wait = min(entry.cooldown_until for entry in candidates) - now
+            if time.monotonic() + wait > deadline:
+                logger.error(f"❌ Tutti i token sono in pausa per limiti di utilizzo (primo libero tra {wait:.0f}s).")
+                return None
+            logger.warning(f"⏳ Tutti i token sono in pausa per limiti di utilizzo, attendo {wait:.0f}s...")
+            time.sleep(wait)
+
+    def release(self, token: str):
+        with self._lock:
+            entry = self._tokens.get(token)
+            if entry and entry.assigned > 0:
+                entry.assigned -= 1
+
+    def observe(self, token: str, headers=None, error: Dict[str, Any] = None):
+        """
+        Aggiorna lo stato del token a partire da una risposta dell'API.
+        """
+        with self._lock:
+            entry = self._tokens.get(token)
+            if entry is None:
+                return
+            now = time.time()
+            usage = _parse_usage(headers or {})
+            if usage["app"] is not None and entry.app_id:
+                self._app_usage[entry.app_id] = (usage["app"], now)
+            if usage["business"] is not None or usage["app"] is not None:
+                entry.usage = max(usage["business"] or 0, usage["app"] or 0)
+                entry.usage_at = now
+
+            code = (error or {}).get("code")
+            if code in AUTH_ERROR_CODES:
+                entry.disabled = True
+                logger.error(f"❌ Token '{entry.label}' non più valido (codice {code}): escluso dal pool.")
+            elif _is_throttle(code):
+                until = now + (usage["regain_seconds"] or DEFAULT_COOLDOWN_SECONDS)
+                # Il limite di codice 4 è dell'app: vale per tutti i suoi token
+                paused = [e for e in self._tokens.values()
+                          if e is entry or (code == APP_THROTTLE_CODE and e.app_id and e.app_id == entry.app_id)]
+                for e in paused:
+                    e.cooldown_until = max(e.cooldown_until, until)
+                logger.warning(f"⏸ Limite API raggiunto (codice {code}): {', '.join(e.label for e in paused)} "
+                               f"in pausa per {until - now:.0f}s.")
+
+    def limiter_for(self, token: str) -> Optional[RateLimiter]:
+        """
+        Budget di chiamate dell'app del token (None per i token fuori dal pool: si usa quello globale).
+        """
+        with self._lock:
+            entry = self._tokens.get(token)
+            if entry is None:
+                return None
+            key = entry.app_id or entry.token
+            if key not in self._limiters:
+                rate = float(os.getenv("API_MAX_CALLS_PER_SECOND", DEFAULT_MAX_CALLS_PER_SECOND))
+                self._limiters[key] = RateLimiter(rate)
+            return self._limiters[key]
+
+    def revalidate(self) -> int:
+        """
+        Rivalida i token (debug_token, con cache) e riammette quelli tornati validi.
+        :return: numero di token utilizzabili.
+        """
+        manager = shared_token_manager()
+        for entry in list(self._tokens.values()):
+            valid = manager.validate(entry.token)
+            with self._lock:
+                entry.disabled = not valid
+        return sum(1 for entry in self._tokens.values() if not entry.disabled)
+
+
+_shared = TokenPool()
+
+
+def shared_token_pool() -> TokenPool:
+    """
+    Pool condiviso da tutto il processo (vuoto finché non viene caricato con load_token_pool).
+    """
+    return _shared
+
+
+def load_token_pool(path: str = TOKENS_PATH) -> TokenPool:
+    """
+    Carica nel pool condiviso i token di config/tokens.json, con app e permessi letti da debug_token;
+    senza il file usa il solo token di load_token (META_ACCESS_TOKEN o config/token.json).
+    I token non validi vengono scartati.
+    """
+    from utils.token_utils import load_token
+
+    pool = shared_token_pool()
+    entries = []
+    if os.path.exists(path):
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                entries = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.error(f"Errore leggendo {path}: {e}")
+    else:
+        token = load_token(interactive=False)
+        if token:
+            entries = [{"token": token, "label": "default"}]
+
+    manager = shared_token_manager()
+    for item in entries:
+        token = item.get("token")
+        if not token or not manager.validate(token):
+            logger.warning(f"Token '{item.get('label') or 'senza nome'}' non valido, escluso dal pool.")
+            continue
+        info = manager.info(token) or {}
+        pool.add(token, label=item.get("label"), app_id=item.get("app_id") or info.get("app_id"),
+                 scopes=info.get("scopes"), clients=item.get("clients"))
+
+    logger.info(f"🔑 Pool di {len(pool)} token su {len(pool.apps())} app")
+    return pool
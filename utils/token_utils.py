@@ -1,7 +1,7 @@
 import os
 import json
-import requests
 from utils.logger import get_logger
+from utils.token_manager import mask_token, shared_token_manager
 
 # ✅ Logger centralizzato
 logger = get_logger(__name__)
@@ -12,16 +12,15 @@ TOKEN_PATH = "config/token.json"
 
 
 def is_token_valid(token: str) -> bool:
-    url = "https://graph.facebook.com/v18.0/me"
-    params = {"access_token": token}
-    try:
-        res = requests.get(url, params=params)
-        res.raise_for_status()
+    """
+    Valida il token con debug_token; l'esito resta in cache (config/token_cache.json) per TOKEN_CACHE_TTL_HOURS,
+    quindi le esecuzioni successive non fanno chiamate finché il token non si avvicina alla scadenza.
+    """
+    if shared_token_manager().validate(token):
         logger.debug("✅ Token validato correttamente con Meta API.")
         return True
-    except requests.exceptions.HTTPError:
-        logger.debug("❌ Token non valido.")
-        return False
+    logger.debug("❌ Token non valido.")
+    return False
 
 
 def save_new_token() -> str:
@@ -49,9 +48,31 @@ def save_new_token() -> str:
     return new_token
 
 
-def load_token() -> str:
+def load_token(interactive: bool = True) -> str:
+    """
+    Carica il token di accesso salvato in TOKEN_PATH, chiedendo all'utente come procedere.
+    Con interactive=False (batch.py, worker) non chiede nulla: usa META_ACCESS_TOKEN se impostata,
+    altrimenti il token salvato, e restituisce None se manca o non è valido.
+    """
     saved_token = None
 
+    if not interactive:
+        token = os.getenv("META_ACCESS_TOKEN")
+        if not token and os.path.exists(TOKEN_PATH):
+            with open(TOKEN_PATH, "r", encoding="utf-8") as f:
+                try:
+                    token = json.load(f).get("token")
+                except json.JSONDecodeError:
+                    token = None
+        if not token:
+            logger.error(f"❌ Nessun token disponibile (META_ACCESS_TOKEN o {TOKEN_PATH}).")
+            return None
+        if not is_token_valid(token):
+            logger.error("❌ Il token salvato non è valido o è scaduto.")
+            return None
+        logger.info(f"🔐 Token valido caricato in modalità non interattiva: {mask_token(token)}")
+        return token
+
     if os.path.exists(TOKEN_PATH):
         with open(TOKEN_PATH, "r", encoding="utf-8") as f:
             try:
@@ -60,6 +81,11 @@ def load_token() -> str:
             except json.JSONDecodeError:
                 pass
 
+    if saved_token and is_token_valid(saved_token) and not shared_token_manager().expiring_soon(saved_token):
+        # Token valido e lontano dalla scadenza: nessuna domanda (per sostituirlo basta eliminare TOKEN_PATH)
+        logger.info(f"🔐 Token valido caricato da {TOKEN_PATH}: {mask_token(saved_token)}")
+        return saved_token
+
     if saved_token:
         print("🔐 Token già salvato trovato.")
         choice = input("👉 Vuoi usare il token salvato? (s = sì, n = no): ").strip().lower()
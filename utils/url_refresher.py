@@ -0,0 +1,163 @@
+import json
+import os
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+from urllib.parse import parse_qs, urlparse
+
+from utils.api_wrapper import get as api_get
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+GRAPH_URL = "https://graph.facebook.com/v23.0/"
+
+# Massimo numero di id per chiamata ?ids= accettato dalla Graph API
+MAX_IDS_PER_CALL = 50
+
+# Gli URL che scadono entro questo margine vengono rinnovati in anticipo
+REFRESH_MARGIN_SECONDS = 30 * 60
+
+URL_FIELDS = ("media_url", "thumbnail_url")
+
+
+def url_expiry(url: str) -> Optional[int]:
+    """
+    Scadenza (unix timestamp) di un URL firmato del CDN Facebook/Instagram,
+    letta dal parametro 'oe' (esadecimale). None se l'URL non ha il parametro.
+    """
+    if not url:
+        return None
+    values = parse_qs(urlparse(url).query).get("oe")
+    if not values:
+        return None
+    try:
+        return int(values[0], 16)
+    except ValueError:
+        return None
+
+
+def is_expired(url: str, margin: int = REFRESH_MARGIN_SECONDS) -> bool:
+    """
+    True se l'URL è scaduto o scade entro 'margin' secondi.
+    """
+    expiry = url_expiry(url)
+    return expiry is not None and expiry - margin <= time.time()
+
+
+def _record_urls(data: Dict) -> Dict[str, str]:
+    """
+    URL aggiornati di un media restituito dalla Graph API.
+    Per i caroselli si usa il primo child con media_url, come in step5.
+    """
+    urls = {field: data.get(field) for field in URL_FIELDS if data.get(field)}
+    children = data.get("children", {}).get("data", [])
+    for child in children:
+        if child.get("media_url"):
+            urls["media_url"] = child["media_url"]
+            urls["thumbnail_url"] = child.get("thumbnail_url") or ""
+            break
+    return urls
+
+
+def fetch_fresh_urls(media_ids: Iterable[str], access_token: str) -> Dict[str, Dict]:
+    """
+    Recupera media_url/thumbnail_url aggiornati per più media con chiamate ?ids= (al massimo
+    MAX_IDS_PER_CALL id per chiamata).
+    :return: {media_id: {"media_url": ..., "thumbnail_url": ..., "children": [...]}}
+    """
+    media_ids = list(dict.fromkeys(str(m) for m in media_ids if m))
+    fresh = {}
+    for i in range(0, len(media_ids), MAX_IDS_PER_CALL):
+        batch = media_ids[i:i + MAX_IDS_PER_CALL]
+        logger.info(f"🔄 Rinnovo URL firmati per {len(batch)} media")
+        response = api_get(GRAPH_URL, params={
+            "ids": ",".join(batch),
+            "fields": "media_url,thumbnail_url,children{id,media_url,thumbnail_url}",
+            "access_token": access_token,
+        })
+        if "error" in response:
+            logger.error(f"Errore API rinnovo URL: {response['error']}")
+            continue
+        fresh.update(response)
+    return fresh
+
+
+def refresh_records(records: List[Dict], access_token: str, force_ids: Iterable[str] = ()) -> Tuple[List[str], Dict[str, Dict]]:
+    """
+    Rinnova in place media_url/thumbnail_url dei record (formato pdf_fields_*.json) scaduti o in scadenza,
+    più quelli in force_ids (es. download falliti con 403), con un'unica chiamata batch.
+    :return: (media_id aggiornati, risposta della Graph API per update_raw_media).
+    """
+    force_ids = {str(m) for m in force_ids}
+    to_refresh = [
+        str(r["media_id"]) for r in records
+        if r.get("media_id") and (str(r["media_id"]) in force_ids or any(is_expired(r.get(f, "")) for f in URL_FIELDS))
+    ]
+    if not to_refresh or not access_token:
+        return [], {}
+
+    fresh = fetch_fresh_urls(to_refresh, access_token)
+    updated = []
+    for record in records:
+        data = fresh.get(str(record.get("media_id")))
+        if not data:
+            continue
+        urls = _record_urls(data)
+        if any(record.get(field) != value for field, value in urls.items()):
+            record.update(urls)
+            updated.append(str(record["media_id"]))
+    logger.info(f"✅ URL rinnovati per {len(updated)}/{len(to_refresh)} media")
+    return updated, fresh
+
+
+def apply_fresh_urls(raw_data: List[Dict], fresh: Dict[str, Dict]) -> int:
+    """
+    Aggiorna in place media_url/thumbnail_url (anche nei children) dei record raw_media.
+    :return: numero di record aggiornati.
+    """
+    updated = 0
+    for entry in raw_data:
+        data = fresh.get(str(entry.get("media_id")))
+        if not data:
+            continue
+        for field in URL_FIELDS:
+            if data.get(field):
+                entry[field] = data[field]
+        fresh_children = {c.get("id"): c for c in data.get("children", {}).get("data", [])}
+        for child in entry.get("children", []):
+            child_data = fresh_children.get(child.get("id"))
+            if child_data:
+                for field in URL_FIELDS:
+                    if child_data.get(field):
+                        child[field] = child_data[field]
+        updated += 1
+    return updated
+
+
+def update_raw_media(client_name: str, since: str, until: str, fresh: Dict[str, Dict], raw_data: List[Dict] = None):
+    """
+    Riporta gli URL rinnovati in media/{client_name}/raw_media_{since}_{until}.json (anche nei children),
+    così gli step successivi e le esecuzioni future non ripartono da URL scaduti.
+    Con raw_data (pipeline in memoria, src/pipeline.py) aggiorna solo i record passati: il file
+    viene scritto una volta sola dalla pipeline.
+    """
+    if not fresh:
+        return
+    if raw_data is not None:
+        apply_fresh_urls(raw_data, fresh)
+        return
+
+    raw_path = os.path.join("media", client_name, f"raw_media_{since}_{until}.json")
+    if not os.path.exists(raw_path):
+        return
+
+    with open(raw_path, "r", encoding="utf-8") as f:
+        raw_data = json.load(f)
+
+    apply_fresh_urls(raw_data, fresh)
+
+    tmp_path = raw_path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(raw_data, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, raw_path)
+    logger.info(f"[💾] URL rinnovati salvati in {raw_path}")
@@ -0,0 +1,197 @@
+import argparse
+import signal
+import sys
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import date, timedelta
+
+from batch import DEFAULT_WORKERS, load_jobs, run_job
+from src import step8_generate_pdf
+from utils.job_spool import HEARTBEAT_TIMEOUT, JobSpool
+from utils.logger import get_logger
+from utils.media_cache import shared_cache
+from utils.pdf_utils import get_template
+from utils.token_pool import load_token_pool
+
+logger = get_logger("meta_metrics_collector.worker")
+
+# Secondi tra due controlli della coda quando non ci sono job
+POLL_SECONDS = 5
+# I token del pool vengono rivalidati al massimo una volta ogni ora (e a ogni avvio)
+TOKEN_CHECK_SECONDS = 3600
+
+
+class Worker:
+    """
+    Processo residente che esegue i job della coda (utils/job_spool.py) con la stessa logica di batch.py.
+    Import, font, template PDF, pool di token e cache media restano caricati tra un job e l'altro:
+    il tempo di ogni report è quasi solo quello del lavoro vero e proprio.
+    Con schedule_hours accoda periodicamente un aggiornamento di tutti i clienti.
+    """
+
+    def __init__(self, spool: JobSpool, args):
+        self.spool = spool
+        self.args = args
+        self._stop = threading.Event()
+        self._token_lock = threading.Lock()
+        self._pool = None
+        self._tokens_checked_at = 0.0
+        self._next_refresh = time.monotonic() if args.schedule_hours else None
+        self._cache_dirty = False
+        self._next_recover = 0.0
+
+    def stop(self, *_):
+        if not self._stop.is_set():
+            logger.info("⏹ Arresto richiesto: attendo la fine dei job in corso...")
+        self._stop.set()
+
+    def warm_up(self):
+        """
+        Carica una volta sola quello che ogni esecuzione di main.py rifà da capo.
+        """
+        start = time.monotonic()
+        step8_generate_pdf.register_report_fonts()
+        get_template(step8_generate_pdf.TEMPLATE_PATH)
+        shared_cache()
+        self.tokens()
+        logger.info(f"🔥 Worker pronto in {time.monotonic() - start:.1f}s")
+
+    def tokens(self):
+        """
+        Pool di token, rivalidato solo se l'ultimo controllo è più vecchio di TOKEN_CHECK_SECONDS.
+        """
+        with self._token_lock:
+            if self._pool is None or time.monotonic() - self._tokens_checked_at > TOKEN_CHECK_SECONDS:
+                if not self._pool:
+                    self._pool = load_token_pool()
+                elif not self._pool.revalidate():
+                    logger.error("❌ Nessun token valido nel pool.")
+                self._tokens_checked_at = time.monotonic()
+                if not self._pool:
+                    logger.error("❌ Token non disponibile: i job falliranno finché non viene aggiornato.")
+            return self._pool
+
+    def schedule(self):
+        """
+        Accoda l'aggiornamento periodico dei clienti quando è il momento.
+        """
+        if self._next_refresh is None or time.monotonic() < self._next_refresh:
+            return
+        since = until = None
+        if self.args.refresh_days:
+            until = date.today().isoformat()
+            since = (date.today() - timedelta(days=self.args.refresh_days)).isoformat()
+        try:
+            jobs = load_jobs(self.args.jobs, since, until)
+            for job in jobs:
+                self.spool.submit(job)
+            logger.info(f"🕒 Aggiornamento programmato: {len(jobs)} job accodati")
+        except Exception as e:
+            logger.error(f"Errore accodando l'aggiornamento programmato: {e}")
+        self._next_refresh = time.monotonic() + self.args.schedule_hours * 3600
+
+    def process(self, job_id: str, job: dict):
+        result = run_job(job, self.tokens(), self.args)
+        self.spool.complete(job_id, result)
+        return result
+
+    def recover(self):
+        """
+        Rimette in coda i job di worker terminati a metà (all'avvio e poi ogni HEARTBEAT_TIMEOUT secondi):
+        più worker possono servire la stessa coda.
+        """
+        if time.monotonic() < self._next_recover:
+            return
+        self.spool.recover()
+        self._next_recover = time.monotonic() + HEARTBEAT_TIMEOUT
+
+    def serve(self):
+        self.recover()
+        self.warm_up()
+        workers = max(1, self.args.workers)
+        logger.info(f"▶ Worker in ascolto su {self.spool.root} con {workers} job in parallelo")
+
+        # future -> id del job, per l'heartbeat dei job in corso
+        running = {}
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="worker") as pool:
+            while not self._stop.is_set():
+                self.schedule()
+                self.recover()
+                self.spool.heartbeat(running.values())
+
+                while len(running) < workers:
+                    claimed = self.spool.claim()
+                    if claimed is None:
+                        break
+                    running[pool.submit(self.process, *claimed)] = claimed[0]
+                    self._cache_dirty = True
+
+                if not running:
+                    if self._cache_dirty:
+                        # Nessun job in corso: i media usati tornano rimovibili dalla cache
+                        shared_cache().release()
+                        self._cache_dirty = False
+                    if self.args.once:
+                        break
+                    self._stop.wait(POLL_SECONDS)
+                    continue
+
+                done, _ = wait(running, timeout=POLL_SECONDS, return_when=FIRST_COMPLETED)
+                for future in done:
+                    running.pop(future)
+                    result = future.result()
+                    if result["status"] == "ok":
+                        logger.info(f"✅ {result['client_name']}: {result['pdf_path']} in {result['duration_seconds']}s")
+
+        if self._cache_dirty:
+            shared_cache().release()
+        logger.info("Worker terminato.")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Worker residente: esegue i report accodati senza interazione")
+    sub = parser.add_subparsers(dest="command")
+
+    serve = sub.add_parser("serve", help="Avvia il worker (default)")
+    serve.add_argument("--workers", type=int, default=DEFAULT_WORKERS, help="Job elaborati in parallelo")
+    serve.add_argument("--pdf-workers", type=int, default=1, help="Processi per il rendering di ogni PDF")
+    serve.add_argument("--stream", action="store_true", help="Pipeline in streaming (vedi main.py)")
+    serve.add_argument("--once", action="store_true", help="Esce quando la coda è vuota")
+    serve.add_argument("--schedule-hours", type=float, help="Accoda l'aggiornamento di tutti i clienti ogni N ore")
+    serve.add_argument("--refresh-days", type=int,
+                       help="Periodo degli aggiornamenti programmati: ultimi N giorni (default: ultimo periodo salvato)")
+    serve.add_argument("--jobs", type=str, help="File JSON dei job da programmare (default: tutti i clienti)")
+
+    submit = sub.add_parser("submit", help="Accoda un report")
+    submit.add_argument("--client-name", type=str, required=True, help="Nome del cliente")
+    submit.add_argument("--since", type=str, required=True, help="Data inizio (YYYY-MM-DD)")
+    submit.add_argument("--until", type=str, required=True, help="Data fine (YYYY-MM-DD)")
+    submit.add_argument("--catalogue", action="store_true", help="Genera il catalogo completo invece dei top 3")
+
+    for p in (serve, submit):
+        p.add_argument("--spool", type=str, help="Cartella della coda (default: spool/)")
+
+    argv = sys.argv[1:]
+    if not argv or argv[0] not in ("serve", "submit"):
+        argv = ["serve"] + argv
+    args = parser.parse_args(argv)
+    spool = JobSpool(args.spool)
+
+    if args.command == "submit":
+        spool.submit({"client_name": args.client_name, "since": args.since, "until": args.until,
+                      "catalogue": args.catalogue})
+        return
+
+    # Opzioni lette da run_job (batch.py): il catalogo è scelto per singolo job
+    args.catalogue = False
+    args.force = []
+
+    worker = Worker(spool, args)
+    signal.signal(signal.SIGTERM, worker.stop)
+    signal.signal(signal.SIGINT, worker.stop)
+    worker.serve()
+
+
+if __name__ == "__main__":
+    main()